@@ -1,11 +1,16 @@
 # lora_viewer.py - 最终完美版 v3：支持中文日志美化 + 所有增强功能
 
 import os
-import http.server
-import socketserver
+import queue
+import sys
+import atexit
+import logging
+import logging.handlers
 from urllib.parse import unquote, quote, parse_qs, urlparse
 from datetime import datetime
 
+from loraview_server import KeepAliveHandler, PooledHTTPServer
+
 # ========================
 # 配置区
 # ========================
@@ -19,6 +24,45 @@ ROOT_NAME = "全部"
 # 支持的图片格式
 IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff', '.gif'}
 
+# 说明文字预览
+TEXT_PREVIEW_LINES = 5  # 页面中显示的 .txt 行数，完整内容通过链接查看
+TEXT_PREVIEW_MAX_CHARS = 2000  # 每个 .txt 最多读取的字符数
+
+# 并发服务配置
+WORKER_THREADS = 16  # 处理请求的工作线程数（大文件传输不会阻塞页面和缩略图）
+MAX_QUEUED_CONNECTIONS = 64  # 等待工作线程的连接上限，超出后直接返回 503
+COPY_CHUNK_SIZE = 256 * 1024  # 平台不支持 sendfile 时，每次读取并发送的字节数
+KEEPALIVE_TIMEOUT = 5  # 持久连接空闲多少秒后关闭（空闲连接交给后台 selector 等待，不占用工作线程）
+KEEPALIVE_LINGER = 0.1  # 请求处理完后在工作线程中等待下一个请求的秒数，超过后才把连接交还给 selector
+KEEPALIVE_MAX_REQUESTS = 200  # 每个连接最多处理的请求数，之后关闭连接让客户端重新建立
+LOG_QUEUE_SIZE = 10000  # 日志由后台线程输出，队列满时丢弃新记录，不阻塞请求
+
+# ========================
+# 日志（后台线程输出到控制台）
+# ========================
+
+logger = logging.getLogger("loraview")
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列；队列已满时丢弃，请求线程不会因为控制台输出变慢而阻塞"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+def setup_logging():
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener = logging.handlers.QueueListener(log_queue, console)
+    listener.start()
+    atexit.register(listener.stop)  # 退出前写完队列中剩余的日志
+
 # ========================
 # 扫描所有子文件夹
 # ========================
@@ -327,10 +371,17 @@ def generate_html(current_folder_name=""):
             if text_file:
                 try:
                     txt_path = os.path.join(files['folder_path'], text_file)
+                    # 只读取开头部分，超长的说明不会拖慢页面
                     with open(txt_path, 'r', encoding='utf-8') as tf:
-                        content = tf.read().strip()
+                        head = tf.read(TEXT_PREVIEW_MAX_CHARS + 1)
+                    lines = head.strip().split('\n', TEXT_PREVIEW_LINES)
+                    content = '\n'.join(lines[:TEXT_PREVIEW_LINES])[:TEXT_PREVIEW_MAX_CHARS]
+                    more = len(lines) > TEXT_PREVIEW_LINES or len(head) > TEXT_PREVIEW_MAX_CHARS
                     if content:
                         html += f"<div class='text-content'>{content}</div>"
+                        if more:
+                            params = f"?dir={current_encoded}" if current_encoded else ""
+                            html += f"<p><a href='/file/{quote(text_file)}{params}' target='_blank'>📄 查看完整说明</a></p>"
                     else:
                         html += "<p><em>（文本为空）</em></p>"
                 except Exception as e:
@@ -361,20 +412,62 @@ def generate_html(current_folder_name=""):
 # 自定义请求处理器（含美化日志）
 # ========================
 
-class CustomHandler(http.server.SimpleHTTPRequestHandler):
+class CustomHandler(KeepAliveHandler):
+    keepalive_timeout = KEEPALIVE_TIMEOUT
+    keepalive_linger = KEEPALIVE_LINGER
+    keepalive_max_requests = KEEPALIVE_MAX_REQUESTS
+    copy_chunk_size = COPY_CHUNK_SIZE
+
+    def log_message(self, format, *args):
+        """错误信息也交给后台日志线程（基类直接写 stderr）"""
+        logger.warning("%s - %s", self.client_address[0], format % args)
+
     def log_request(self, code='-', size='-'):
         """重写日志方法：将 URL 解码后输出，避免 %E5%95%86 这类编码出现在 cmd 中"""
         if hasattr(self, 'command') and hasattr(self, 'path'):
             try:
                 decoded_path = unquote(self.path)
                 client = self.client_address[0]
-                print(f"{client} - \"{self.command} {decoded_path}\" → status={code}")
+                logger.info('%s - "%s %s" → status=%s', client, self.command, decoded_path, int(code))
             except Exception:
                 # 出错则使用父类默认方式
                 super().log_request(code, size)
         else:
             super().log_request(code, size)
 
+    def serve_file(self, filepath):
+        """以流式方式发送文件，内存占用与文件大小无关"""
+        try:
+            f = open(filepath, 'rb')
+        except (FileNotFoundError, IsADirectoryError, PermissionError):
+            self.send_error(404, "File not found.")
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            ext = os.path.splitext(filepath)[1].lower()
+            if ext in IMAGE_EXTS:
+                content_type = {
+                    '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+                    '.png': 'image/png', '.webp': 'image/webp',
+                    '.bmp': 'image/bmp', '.tiff': 'image/tiff',
+                    '.gif': 'image/gif'
+                }.get(ext, 'image')
+            elif ext == '.txt':
+                content_type = "text/plain; charset=utf-8"
+            else:
+                content_type = "application/octet-stream"
+
+            self.send_response(200)
+            self.send_header("Content-type", content_type)
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            try:
+                self.copy_file_range(f, 0, size)
+            except (BrokenPipeError, ConnectionResetError):
+                # 浏览器中途取消（例如关闭视频）属于正常情况
+                self.close_connection = True
+
     def do_GET(self):
         parsed = urlparse(self.path)
         query = parse_qs(parsed.query)
@@ -385,41 +478,26 @@ class CustomHandler(http.server.SimpleHTTPRequestHandler):
         current_folder_path = folder_map.get(dir_name, FOLDER)
 
         if path == "":
+            body = generate_html(dir_name)
             self.send_response(200)
             self.send_header("Content-type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            self.wfile.write(generate_html(dir_name))
+            self.wfile.write(body)
 
         elif path.startswith("file/"):
             filename = path.split("/", 1)[1]
-            filepath = os.path.join(current_folder_path, filename)
+            filepath = os.path.normpath(os.path.join(current_folder_path, filename))
 
             # 安全检查
             if os.path.commonpath([FOLDER]) != os.path.commonpath([FOLDER, filepath]):
                 self.send_error(403, "Forbidden")
                 return
 
-            if os.path.isfile(filepath):
-                self.send_response(200)
-                ext = os.path.splitext(filepath)[1].lower()
-                if ext in IMAGE_EXTS:
-                    mime = {
-                        '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
-                        '.png': 'image/png', '.webp': 'image/webp',
-                        '.bmp': 'image/bmp', '.tiff': 'image/tiff',
-                        '.gif': 'image/gif'
-                    }.get(ext, 'image')
-                    self.send_header("Content-type", mime)
-                else:
-                    self.send_header("Content-type", "application/octet-stream")
-                self.end_headers()
-                with open(filepath, 'rb') as f:
-                    self.wfile.write(f.read())
-            else:
-                self.send_error(404, "File not found.")
+            self.serve_file(filepath)
 
         elif path == "favicon.ico":
-            self.send_response(204)
+            self.send_response(204)  # 204 没有消息体，持久连接可以直接复用
             self.end_headers()
 
         else:
@@ -435,10 +513,13 @@ def run_server():
         return
 
     os.chdir(FOLDER)
+    setup_logging()
     try:
-        with socketserver.TCPServer(("", PORT), CustomHandler) as httpd:
+        with PooledHTTPServer(("", PORT), CustomHandler,
+                              workers=WORKER_THREADS, max_queued=MAX_QUEUED_CONNECTIONS) as httpd:
             print(f"\n✅ Lora 浏览器已启动（最终完美版）")
             print(f"   访问地址: http://localhost:{PORT}")
+            print(f"   并发: {WORKER_THREADS} 个工作线程，最多 {MAX_QUEUED_CONNECTIONS} 个排队连接")
             print(f"   功能: 子文件夹导航 + 搜索 + 缩略图放大 + 文字加大 + 创建日期 + 日志美化")
             print(f"   提示: 按 Ctrl+C 停止服务\n")
             httpd.serve_forever()
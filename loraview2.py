@@ -1,12 +1,55 @@
 # lora_viewer.py - 最终完美版 v6：优化信息显示 + 添加文件大小
 
 import os
-import http.server
-import socketserver
+import io
+import http.client
+import asyncio
+import argparse
+import queue
 from urllib.parse import unquote, quote, parse_qs, urlparse
 from datetime import datetime
 import subprocess
 import threading
+import secrets
+import json
+import bisect
+import hashlib
+import heapq
+import itertools
+import gzip
+import zlib
+import html
+import re
+import sqlite3
+import time
+import sys
+import atexit
+import multiprocessing
+import select
+import struct
+import ctypes
+import ctypes.util
+import contextvars
+import random
+import logging
+import logging.handlers
+import cProfile
+import pstats
+import ipaddress
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+try:
+    from PIL import Image  # ComfyUI 环境自带 Pillow；没有时改用 ffmpeg 生成缩略图
+except ImportError:
+    Image = None
+try:
+    import brotli  # 可选：安装后对支持的浏览器使用 br 压缩
+except ImportError:
+    brotli = None
+from email.utils import formatdate, parsedate_to_datetime
+from http import HTTPStatus
+
+from loraview_server import KeepAliveHandler, PooledHTTPServer
 
 # ========================
 # 配置区
@@ -18,7 +61,8 @@ PORT = 12321
 INCLUDE_ROOT = True
 ROOT_NAME = "全部"
 
-# 支持的媒体格式
+# 支持的模型与媒体格式
+MODEL_EXTS = {'.safetensors', '.ckpt', '.pt', '.bin', '.pth'}
 IMAGE_EXTS = {'.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tiff', '.gif'}
 VIDEO_EXTS = {'.mp4', '.mkv'}  # 可扩展 '.avi', '.mov' 等
 MEDIA_EXTS = IMAGE_EXTS | VIDEO_EXTS
@@ -27,10 +71,445 @@ MEDIA_EXTS = IMAGE_EXTS | VIDEO_EXTS
 THUMBNAIL_DIR = ".thumbnails"  # 缩略图存放的子文件夹名
 THUMBNAIL_WIDTH = 120  # 缩略图宽度
 THUMBNAIL_HEIGHT = 120  # 缩略图高度
+FFMPEG_BIN = os.environ.get("LORAVIEW_FFMPEG", "ffmpeg")  # ffmpeg 可执行文件路径（测试时可指向替身程序）
+VIDEO_THUMBNAIL_WORKERS = 2  # 同时运行的 ffmpeg 进程数上限
+VIDEO_THUMBNAIL_RETRY_BASE = 60  # 视频缩略图生成失败后首次重试的等待秒数，之后每次翻倍
+VIDEO_THUMBNAIL_RETRY_MAX = 6 * 3600  # 重试等待的上限（秒）
+IMAGE_THUMBNAIL_SIZE = 240  # 静态预览图缩略图的最长边（按 2 倍像素密度生成，显示在 120×120 区域中）
+IMAGE_THUMBNAIL_FORMAT = "webp"  # 静态缩略图格式：webp 或 jpeg
+IMAGE_THUMBNAIL_QUALITY = 80
+IMAGE_THUMBNAIL_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 生成缩略图的进程数
+IMAGE_THUMBNAIL_TIMEOUT = 15  # 请求等待缩略图生成的最长秒数，超时则直接返回原图
+IMAGE_THUMBNAIL_RETRY_BASE = 60  # 静态缩略图生成失败（图片损坏、缺少 Pillow 和 ffmpeg）后首次重试的等待秒数，之后每次翻倍
+IMAGE_THUMBNAIL_RETRY_MAX = 6 * 3600  # 重试等待的上限（秒）；原图修改后立即重新生成
+
+# 缩略图拼图（可选，需要 Pillow）：每个目录的预览图拼成少量大图，页面用 CSS 背景偏移显示，
+# 500 个模型的目录只需几个图片请求；拼图保存在 <目录>/.thumbnails/sprites/，预览图变化时只重画受影响的拼图
+SPRITE_ENABLED = False  # 是否启用拼图（没有 Pillow 时自动停用）
+SPRITE_TILE_SIZE = 240  # 每个格子的像素边长（按 2 倍像素密度，显示在 120×120 区域中）
+SPRITE_COLUMNS = 10  # 每张拼图的列数
+SPRITE_TILES_PER_SHEET = 100  # 每张拼图最多的格子数（行数随实际数量增长）
+SPRITE_BACKGROUND = (240, 240, 240)  # 格子空白处的颜色，与 .thumb-pane 背景一致
 
 # 文本内容折叠配置
 MAX_VISIBLE_LINES = 3  # 折叠状态下显示的最大行数
 LINE_HEIGHT = 20  # 每行文本的近似高度(px)
+TEXT_PREVIEW_MAX_CHARS = 2000  # 卡片预览最多保留的字符数，完整说明在点击展开时再加载
+SEARCH_INDEX_MAX_CHARS = 64 * 1024  # 每个 .txt 最多读取并写入全文索引的字符数
+
+# safetensors 元数据（只读取文件头部的 JSON，不加载张量）
+METADATA_WORKERS = 4  # 后台读取文件头的线程数
+METADATA_HEADER_MAX_BYTES = 32 * 1024 * 1024  # 文件头长度上限，超出视为损坏文件
+METADATA_TOP_TAGS = 8  # 卡片上显示的训练标签数（按 ss_tag_frequency 出现次数排序）
+
+# 模型文件哈希（SHA-256 / AutoV2，用于对照下载页面和查找重复文件）
+HASH_ENABLED = True  # 是否在后台计算模型文件的哈希
+HASH_WORKERS = 2  # 同时计算哈希的进程数（通常受磁盘带宽限制，无需太多）
+HASH_CHUNK_SIZE = 8 * 1024 * 1024  # 每次读取的字节数
+HASH_IDLE_SECONDS = 1.0  # 最后一个请求结束多久后才继续计算（有请求时暂停，把磁盘留给页面和预览）
+HASH_MAX_WAIT_SECONDS = 30  # 每个文件最多等待空闲多少秒（长时间播放视频时哈希不会一直停止）
+HASH_RETRY_BASE = 60  # 文件无法读取（被占用、无权限）时首次重试的等待秒数，之后每次翻倍
+HASH_RETRY_MAX = 6 * 3600  # 重试等待的上限（秒）
+HASH_REFRESH_INTERVAL = 5  # 同一目录的哈希结果最多每隔多少秒刷新一次页面数据
+
+# 重复文件报告
+DUPLICATE_SAMPLE_BYTES = 64 * 1024  # 大小相同的文件先比较开头和结尾各这么多字节，再用完整哈希确认
+
+# 目录扫描配置（递归扫描所有层级的子文件夹，如 loras/SDXL/characters）
+SCAN_WORKERS = 8  # 并行扫描子目录的线程数（网络盘延迟较高时并行收益明显）
+SCAN_MAX_DEPTH = 8  # 最大递归深度（符号链接形成的循环另按目录的设备号和 inode 识别）
+
+# 模型目录缓存配置（SQLite，翻页时不再重复扫描目录和读取 .txt）
+CATALOG_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loraview_catalog.db")
+CATALOG_RECHECK_SECONDS = 60  # 目录修改时间未变时，每隔多少秒仍逐个核对文件（捕获原地编辑的 .txt），0 表示不核对
+
+# 全文搜索
+SEARCH_DEFAULT_LIMIT = 20  # /api/search 默认返回条数
+SEARCH_MAX_LIMIT = 200  # /api/search 单次最多返回条数
+SEARCH_SNIPPET_CHARS = 60  # 摘要中命中位置前后保留的字符数
+
+# 大目录分页配置
+VIRTUAL_LIST_THRESHOLD = 500  # 模型数超过该值时默认使用虚拟列表（?view=full 强制完整列表，?view=virtual 强制虚拟列表）
+VIRTUAL_ROW_HEIGHT = 174  # 虚拟列表每行高度（px，含间距）
+HTML_STREAM_BATCH = 50  # 完整列表页面每输出多少个模型卡片发送一次（分块传输）
+API_PAGE_SIZE = 100  # /api/models 默认每页条数
+API_MAX_PAGE_SIZE = 1000  # /api/models 每页条数上限
+
+# 文件变化监听配置（后台维护目录列表和模型列表，请求处理时不再扫描磁盘）
+WATCH_ENABLED = True
+WATCH_POLL_INTERVAL = 0.5  # 无 inotify 时（如 Windows、网络盘）轮询目录修改时间的间隔（秒）
+
+# 并发服务配置
+WORKER_THREADS = 16  # 处理请求的工作线程数（大文件传输不会阻塞页面和缩略图）
+MAX_QUEUED_CONNECTIONS = 64  # 等待工作线程的连接上限，超出后直接返回 503
+COPY_CHUNK_SIZE = 256 * 1024  # 平台不支持 sendfile 时，每次读取并发送的字节数
+KEEPALIVE_TIMEOUT = 5  # 持久连接空闲多少秒后关闭（空闲连接交给后台 selector 等待，不占用工作线程）
+KEEPALIVE_LINGER = 0.1  # 请求处理完后在工作线程中等待下一个请求的秒数，超过后才把连接交还给 selector
+KEEPALIVE_MAX_REQUESTS = 200  # 每个连接最多处理的请求数，之后关闭连接让客户端重新建立
+SERVER_BACKEND = "threads"  # "threads"：线程池服务器；"asyncio"：单线程事件循环（大量视频长连接时更省线程），也可用 --asyncio 启动
+ASYNC_EXECUTOR_WORKERS = 8  # asyncio 后端中执行扫描、页面生成、缩略图等阻塞操作的线程数
+MAX_RANGES = 16  # 单个请求允许的最多 Range 区间数，超出时按完整文件返回
+
+# 浏览器缓存配置（过期后浏览器用 ETag / Last-Modified 重新验证，未变化时只返回 304）
+FILE_CACHE_MAX_AGE = 600  # 预览图、视频、模型文件的免验证缓存秒数，0 表示每次都重新验证
+THUMBNAIL_CACHE_MAX_AGE = 86400  # THUMBNAIL_DIR 中缩略图的免验证缓存秒数
+STATIC_CACHE_MAX_AGE = 365 * 86400  # /static/ 资源的缓存秒数（URL 带内容版本号，内容变化时地址随之变化）
+
+# 响应压缩（HTML、JSON、CSS、JS；图片、视频等已压缩的文件原样发送）
+COMPRESS_MIN_BYTES = 1024  # 小于该字节数的响应不压缩
+GZIP_LEVEL = 6  # 动态内容的 gzip 压缩级别（静态资源启动时按最高级别预压缩）
+BROTLI_QUALITY = 5  # 动态内容的 brotli 压缩质量（静态资源按 11 预压缩）
+
+# 运行指标（/metrics，Prometheus 文本格式）
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # 耗时直方图的桶上限（秒）
+SERVER_TIMING = True  # 页面响应附带 Server-Timing（浏览器开发者工具“时间”面板可见各阶段耗时）
+PROFILE_ENABLED = True  # 允许本机访问 /?profile=1 在 cProfile 下生成页面并返回耗时最多的函数（仅限 127.0.0.1 / ::1；加 &rescan=1 同时重新扫描目录）
+PROFILE_TOP_FUNCTIONS = 40  # 性能分析结果列出的函数数
+# 经反向代理转发的请求在本服务看来也来自 127.0.0.1：带 Forwarded / X-Forwarded-For / X-Real-IP 头的请求默认不视为本机，
+# 确认代理只转发本机请求（或代理自己做了访问控制）时才改为 True
+PROFILE_ALLOW_PROXIED = False
+
+# 访问日志（请求线程只把记录放入队列，由后台线程写到控制台和文件）
+ACCESS_LOG_CONSOLE = True  # 在控制台显示访问日志（URL 解码后显示）；错误信息总是显示
+ACCESS_LOG_FILE = ""  # 日志文件路径，留空不写文件，例如 r"D:\ComfyUI-portal\Lorabrower\loraview_access.log"
+ACCESS_LOG_JSON = False  # 日志文件使用 JSON Lines 格式（每行一个对象，含状态码、耗时、字节数）
+ACCESS_LOG_MAX_BYTES = 10 * 1024 * 1024  # 日志文件超过该大小时轮转
+ACCESS_LOG_BACKUPS = 3  # 轮转时保留的旧日志文件数
+ACCESS_LOG_FILE_SAMPLE = 1.0  # /file/ 与 /thumb/ 成功请求的记录比例（0~1，一个页面会产生数百个）；错误响应总是记录
+LOG_QUEUE_SIZE = 10000  # 日志队列上限，写出跟不上时丢弃新记录，不阻塞请求
+
+# ========================
+# 运行指标（/metrics）
+# ========================
+
+METRIC_INFO = {
+    "loraview_http_requests_total": ("counter", "按路由和状态码统计的请求数"),
+    "loraview_http_request_duration_seconds": ("histogram", "按路由统计的请求处理耗时（含发送响应）"),
+    "loraview_http_response_bytes_total": ("counter", "按路由统计的发送字节数（含响应头）"),
+    "loraview_http_requests_in_flight": ("gauge", "正在处理的请求数"),
+    "loraview_scan_folders_duration_seconds": ("histogram", "扫描目录树（scan_folders）的耗时"),
+    "loraview_folder_scan_seconds": ("summary", "按目录统计的重新列出目录（读取文件列表和 .txt）耗时"),
+    "loraview_cache_requests_total": ("counter", "各缓存的命中（hit）与未命中（miss）次数"),
+    "loraview_thumbnail_queue_depth": ("gauge", "等待或正在生成的缩略图任务数"),
+    "loraview_thumbnail_failures_total": ("counter", "缩略图生成失败次数"),
+    "loraview_hash_queue_depth": ("gauge", "等待计算哈希的模型文件数"),
+    "loraview_hashed_files_total": ("counter", "已完成哈希计算的模型文件数"),
+    "loraview_hash_failures_total": ("counter", "哈希计算失败的模型文件数"),
+    "loraview_log_dropped_total": ("counter", "日志队列已满而丢弃的日志条数"),
+}
+
+class Metrics:
+    """/metrics 的计数器、直方图和摘要
+
+    热路径上每次记录只有一次加锁和几次字典操作；直方图各桶分别计数，输出时再累加。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}  # (名称, 标签) -> 值
+        self.histograms = {}  # (名称, 标签) -> [各桶计数..., 超出最大桶的计数, 总和]
+        self.summaries = {}  # (名称, 标签) -> [次数, 总和]
+
+    def inc(self, name, labels=(), amount=1):
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def _observe(self, name, labels, seconds):
+        key = (name, labels)
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = [0] * (len(METRICS_BUCKETS) + 1) + [0.0]
+        hist[bisect.bisect_left(METRICS_BUCKETS, seconds)] += 1
+        hist[-1] += seconds
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            self._observe(name, labels, seconds)
+
+    def observe_request(self, route, status, seconds, sent):
+        labels = (("route", route),)
+        with self.lock:
+            key = ("loraview_http_requests_total", labels + (("status", str(status)),))
+            self.counters[key] = self.counters.get(key, 0) + 1
+            key = ("loraview_http_response_bytes_total", labels)
+            self.counters[key] = self.counters.get(key, 0) + sent
+            self._observe("loraview_http_request_duration_seconds", labels, seconds)
+
+    def observe_scan(self, path, seconds):
+        rel = os.path.relpath(path, FOLDER)
+        folder = ROOT_NAME if rel == "." else rel.replace(os.sep, "/")
+        key = ("loraview_folder_scan_seconds", (("folder", folder),))
+        with self.lock:
+            summary = self.summaries.setdefault(key, [0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+
+    def cache(self, name, hit, amount=1):
+        if amount:
+            self.inc("loraview_cache_requests_total", (("cache", name), ("result", "hit" if hit else "miss")), amount)
+
+    def render(self, samples=()):
+        """输出 Prometheus 文本格式；samples 为输出时才读取的 (名称, 标签, 值)"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(hist) for key, hist in self.histograms.items()}
+            summaries = {key: list(summary) for key, summary in self.summaries.items()}
+
+        series = {}
+        for (name, labels), value in sorted(counters.items()) + list(samples):
+            series.setdefault(name, []).append(f"{name}{format_labels(labels)} {format_number(value)}")
+        for (name, labels), hist in sorted(histograms.items()):
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(METRICS_BUCKETS + ("+Inf",), hist):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_number(hist[-1])}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        for (name, labels), (count, total) in sorted(summaries.items()):
+            lines = series.setdefault(name, [])
+            lines.append(f"{name}_sum{format_labels(labels)} {format_number(total)}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+
+        out = []
+        for name in sorted(series):
+            kind, help_text = METRIC_INFO.get(name, ("untyped", ""))
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+def format_number(value):
+    return repr(round(value, 6)) if isinstance(value, float) else str(value)
+
+metrics = Metrics()
+
+def route_label(raw_path):
+    """请求路径归类为 route 标签（取值固定，不随文件名增长）"""
+    path = unquote(urlparse(raw_path).path.strip("/"))
+    if path == "":
+        return "index"
+    if path in API_ROUTES:
+        return path
+    head = path.split("/", 1)[0]
+    if head == "favicon.ico":
+        return "favicon"
+    if head in ("file", "thumb", "static", "duplicates", "metrics"):
+        return head
+    return "other"
+
+def metrics_text():
+    """/metrics 的内容：累计的计数器加上当前的队列、请求数"""
+    hashes = hash_service.status()
+    samples = [
+        (("loraview_http_requests_in_flight", ()), request_load.in_flight),
+        (("loraview_thumbnail_queue_depth", (("kind", "video"),)), video_thumbnail_queue.pending.qsize()),
+        (("loraview_thumbnail_queue_depth", (("kind", "image"),)), len(_image_thumb_jobs)),
+        (("loraview_hash_queue_depth", ()), hashes["queued"]),
+        (("loraview_hashed_files_total", ()), hashes["hashed"]),
+        (("loraview_hash_failures_total", ()), hashes["failed"]),
+        (("loraview_log_dropped_total", ()), _log_handler.dropped if _log_handler else 0),
+    ]
+    return metrics.render(samples)
+
+# ========================
+# 访问日志（后台线程写出）
+# ========================
+
+access_logger = logging.getLogger("loraview.access")
+error_logger = logging.getLogger("loraview.error")
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """放入有界队列；队列已满时丢弃并计数，请求线程永远不会因为控制台或磁盘变慢而阻塞"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class JsonLinesFormatter(logging.Formatter):
+    """每条日志一行 JSON；访问日志带有客户端、路径、状态码、耗时和字节数"""
+
+    def format(self, record):
+        entry = {"time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                 "level": record.levelname.lower()}
+        access = getattr(record, "access", None)
+        if access:
+            entry.update(access)
+        else:
+            entry["message"] = record.getMessage()
+        return json.dumps(entry, ensure_ascii=False)
+
+_log_handler = None
+_log_listener = None
+
+def setup_logging():
+    """启动后台日志线程：控制台保持原来的“URL 解码”格式，文件可选 JSON Lines 并按大小轮转"""
+    global _log_handler, _log_listener
+    if _log_listener is not None:
+        return
+    handlers = []
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(logging.Formatter("%(message)s"))
+    if not ACCESS_LOG_CONSOLE:
+        console.addFilter(lambda record: record.name != access_logger.name)
+    handlers.append(console)
+    if ACCESS_LOG_FILE:
+        try:
+            log_file = logging.handlers.RotatingFileHandler(
+                ACCESS_LOG_FILE, maxBytes=ACCESS_LOG_MAX_BYTES, backupCount=ACCESS_LOG_BACKUPS, encoding="utf-8")
+            log_file.setFormatter(JsonLinesFormatter() if ACCESS_LOG_JSON
+                                  else logging.Formatter("%(asctime)s %(message)s"))
+            handlers.append(log_file)
+        except OSError as e:
+            print(f"无法打开日志文件 {ACCESS_LOG_FILE}: {e}")
+
+    _log_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    for logger in (access_logger, error_logger):
+        logger.addHandler(_log_handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    _log_listener = logging.handlers.QueueListener(_log_handler.queue, *handlers)
+    _log_listener.start()
+    atexit.register(_log_listener.stop)  # 退出前写完队列中剩余的日志
+
+def log_access(client, method, path, status, seconds=None, sent=None):
+    """记录一条访问日志；/file/、/thumb/ 的成功请求按 ACCESS_LOG_FILE_SAMPLE 抽样"""
+    ok = not isinstance(status, int) or status < 400
+    if ok and ACCESS_LOG_FILE_SAMPLE < 1 and random.random() >= ACCESS_LOG_FILE_SAMPLE:
+        if route_label(path) in ("file", "thumb"):
+            return
+    decoded_path = unquote(path)
+    access = {"client": client, "method": method, "path": decoded_path, "status": status}
+    if seconds is not None:
+        access["ms"] = round(seconds * 1000, 2)
+    if sent is not None:
+        access["bytes"] = sent
+    access_logger.info('%s - "%s %s" → status=%s', client, method, decoded_path, status, extra={"access": access})
+
+# ========================
+# 请求耗时分解（Server-Timing）与性能分析
+# ========================
+
+# 各阶段的名称与说明，按输出顺序排列；listdir / stat / text 是 group 的组成部分
+SERVER_TIMING_PHASES = {
+    "scan": "scan_folders",
+    "group": "group_files_in",
+    "listdir": "listdir",
+    "stat": "stat",
+    "text": "txt read",
+    "render": "HTML render",
+    "write": "send",
+    "total": "total",
+}
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+# 为 False 时不安排后台任务（元数据、哈希、视频缩略图、拼图），性能分析时使用，避免额外任务影响结果
+_schedule_background = contextvars.ContextVar("schedule_background", default=True)
+
+def add_timing(name, seconds):
+    """把一段耗时计入当前请求的 Server-Timing（不在请求中时忽略）"""
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[name] = timings.get(name, 0.0) + seconds
+
+def format_server_timing(phases, skip=()):
+    """按 SERVER_TIMING_PHASES 的顺序输出 Server-Timing 的值（skip 中的阶段不输出）"""
+    return ", ".join(f'{name};dur={phases[name] * 1000:.1f};desc="{desc}"'
+                     for name, desc in SERVER_TIMING_PHASES.items() if name in phases and name not in skip)
+
+def server_timing(timings, generate, write=None, total=None, skip=()):
+    """组装 Server-Timing 的值；generate 为生成页面的总耗时，扣除扫描和分组即为渲染耗时"""
+    phases = dict(timings)
+    phases["render"] = max(0.0, generate - phases.get("scan", 0.0) - phases.get("group", 0.0))
+    if write is not None:
+        phases["write"] = write
+    if total is not None:
+        phases["total"] = total
+    return format_server_timing(phases, skip)
+
+PROXY_HEADERS = ("Forwarded", "X-Forwarded-For", "X-Real-IP")
+
+def is_local_client(address, headers=None):
+    """请求是否来自本机；带代理转发头的请求只有在 PROFILE_ALLOW_PROXIED 时才算本机"""
+    if headers is not None and any(headers.get(name) for name in PROXY_HEADERS) and not PROFILE_ALLOW_PROXIED:
+        return False
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return (getattr(ip, "ipv4_mapped", None) or ip).is_loopback
+
+_profile_lock = threading.Lock()  # 同一时间只能有一个 cProfile 在运行（正在运行时其它请求直接拒绝，不占着工作线程等待）
+
+def rescan_view(dir_name):
+    """绕过内存快照：重新扫描目录树，并逐个核对页面涉及的目录，返回 [(耗时, 目录, 模型数)]"""
+    folder_map = scan_folders()
+    if is_aggregate_view(dir_name):
+        paths = sorted(set(folder_map.values()))
+    else:
+        paths = [folder_map.get(dir_name, FOLDER)]
+    folder_times = []
+    for path in paths:
+        started = time.perf_counter()
+        models = group_files_in(path, refresh=True)
+        folder_times.append((time.perf_counter() - started, path, len(models)))
+    return folder_times
+
+def profile_page(dir_name, sort="cumulative", rescan=False):
+    """在 cProfile 下完整生成一次页面，返回耗时最多的函数（文本）
+
+    rescan=True 时先绕过内存快照重新扫描并核对目录（列目录、stat、读取有变化的 .txt），
+    并列出最慢的目录。只统计处理请求的线程；scan_folders 并行列目录的线程只体现为等待时间。
+    分析期间不安排后台任务（元数据、哈希、视频缩略图、拼图）。
+    """
+    if sort not in ("cumulative", "tottime", "ncalls"):
+        raise ValueError("sort 只能是 cumulative、tottime 或 ncalls")
+    if not _profile_lock.acquire(blocking=False):
+        raise ValueError("已有性能分析正在运行，请稍后再试")
+    try:
+        profiler = cProfile.Profile()
+        timings = {}
+        folder_times = []
+        token = _request_timings.set(timings)
+        quiet = _schedule_background.set(False)
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            if rescan:
+                folder_times = rescan_view(dir_name)
+            body = generate_html(dir_name)
+        finally:
+            profiler.disable()
+            _schedule_background.reset(quiet)
+            _request_timings.reset(token)
+        elapsed = time.perf_counter() - started
+    finally:
+        _profile_lock.release()
+
+    out = io.StringIO()
+    out.write(f"目录: {dir_name or ROOT_NAME}\n")
+    out.write(f"页面: {len(body)} 字节，生成耗时 {elapsed * 1000:.1f} ms（含性能分析开销）\n")
+    out.write(f"Server-Timing: {server_timing(timings, elapsed)}\n\n")
+    if folder_times:
+        out.write("最慢的目录:\n")
+        for seconds, path, count in sorted(folder_times, reverse=True)[:10]:
+            out.write(f"  {seconds * 1000:9.1f} ms  {count:6d} 个模型  {path}\n")
+        out.write("\n")
+    pstats.Stats(profiler, stream=out).sort_stats(sort).print_stats(PROFILE_TOP_FUNCTIONS)
+    return out.getvalue()
 
 # ========================
 # 视频缩略图生成
@@ -41,7 +520,7 @@ def generate_video_thumbnail(video_path, thumbnail_path):
     try:
         # 使用ffmpeg从视频的第1秒提取一帧作为缩略图
         cmd = [
-            'ffmpeg', '-i', video_path,
+            FFMPEG_BIN, '-i', video_path,
             '-ss', '00:00:01',  # 从第1秒开始
             '-vframes', '1',    # 只取1帧
             '-vf', f'scale={THUMBNAIL_WIDTH}:{THUMBNAIL_HEIGHT}:force_original_aspect_ratio=decrease',  # 缩放
@@ -59,150 +538,1649 @@ def generate_video_thumbnail(video_path, thumbnail_path):
         print(f"生成缩略图异常: {video_path}, 错误: {e}")
         return False
 
-def get_video_thumbnail(video_path):
-    """获取视频缩略图路径，如果不存在则生成"""
-    video_dir = os.path.dirname(video_path)
+class VideoThumbnailQueue:
+    """视频缩略图任务队列
+
+    同一视频同时只会有一个任务；最多 VIDEO_THUMBNAIL_WORKERS 个 ffmpeg 并行；
+    失败会按视频修改时间记住，并以指数退避重试，避免每次刷新页面都重新启动 ffmpeg。
+    """
+
+    def __init__(self, workers=VIDEO_THUMBNAIL_WORKERS):
+        self.workers = workers
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.states = {}  # 视频路径 -> {"status", "mtime", "attempts", "retry_at"}
+        self.threads = []
+
+    def request(self, video_path, thumbnail_path, mtime):
+        """登记一个缺少缩略图的视频，返回当前状态：queued / running / failed"""
+        with self.lock:
+            state = self.states.get(video_path)
+            if state is not None and state["mtime"] == mtime:
+                if state["status"] in ("queued", "running"):
+                    return state["status"]
+                if state["status"] == "failed" and time.time() < state["retry_at"]:
+                    return "failed"
+                attempts = state["attempts"]
+            else:
+                attempts = 0  # 新视频或视频已被替换，重新计数
+            self.states[video_path] = {"status": "queued", "mtime": mtime,
+                                       "attempts": attempts, "retry_at": 0}
+            self.pending.put((video_path, thumbnail_path, mtime))
+            while len(self.threads) < self.workers:
+                t = threading.Thread(target=self.worker_loop, name=f"lora-ffmpeg-{len(self.threads)}", daemon=True)
+                t.start()
+                self.threads.append(t)
+            return "queued"
+
+    def worker_loop(self):
+        while True:
+            video_path, thumbnail_path, mtime = self.pending.get()
+            with self.lock:
+                state = self.states.get(video_path)
+                if state is None or state["mtime"] != mtime or state["status"] != "queued":
+                    continue  # 视频被替换后重新入队时，旧任务已失效（由新任务生成）
+                state["status"] = "running"
+            ok = False
+            try:
+                os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+                ok = generate_video_thumbnail(video_path, thumbnail_path)
+            except Exception as e:
+                print(f"生成视频缩略图出错 {video_path}: {e}")
+            finally:
+                # 无论成功与否都要结束 running 状态，否则该视频之后的请求会一直被去重忽略；
+                # 生成期间视频又被替换时，状态已属于新任务，保持不变
+                with self.lock:
+                    if self.states.get(video_path) is state:
+                        if ok:
+                            del self.states[video_path]
+                        else:
+                            state["attempts"] += 1
+                            delay = min(VIDEO_THUMBNAIL_RETRY_BASE * 2 ** (state["attempts"] - 1), VIDEO_THUMBNAIL_RETRY_MAX)
+                            state["status"] = "failed"
+                            state["retry_at"] = time.time() + delay
+            if not ok:
+                metrics.inc("loraview_thumbnail_failures_total", (("kind", "video"),))
+                continue
+            print(f"已生成缩略图: {thumbnail_path}")
+            if _watcher is not None:
+                try:
+                    _watcher.mark_dirty(os.path.dirname(video_path))
+                except Exception as e:
+                    print(f"刷新目录失败 {os.path.dirname(video_path)}: {e}")
+
+    def status(self, folder_path=None):
+        """返回任务状态（可按目录过滤），供页面轮询；键为相对 FOLDER 的视频路径，“全部”视图中同名视频不会互相覆盖"""
+        now = time.time()
+        with self.lock:
+            jobs = {}
+            for video_path, state in self.states.items():
+                if folder_path is not None and os.path.dirname(video_path) != folder_path:
+                    continue
+                jobs[video_job_key(video_path)] = {
+                    "status": state["status"],
+                    "attempts": state["attempts"],
+                    "retry_in": max(0, round(state["retry_at"] - now)) if state["status"] == "failed" else 0,
+                }
+            return {"queue_depth": self.pending.qsize(), "workers": self.workers, "jobs": jobs}
+
+video_thumbnail_queue = VideoThumbnailQueue()
+
+def video_job_key(video_path):
+    """视频任务在 /api/thumbnails 中的键：相对 FOLDER 的路径，统一用 / 分隔"""
+    return os.path.relpath(video_path, FOLDER).replace(os.sep, "/")
+
+def video_thumbnail_path(video_path):
     video_name = os.path.splitext(os.path.basename(video_path))[0]
-    
-    # 缩略图存放目录
-    thumbnail_dir = os.path.join(video_dir, THUMBNAIL_DIR)
-    thumbnail_path = os.path.join(thumbnail_dir, f"{video_name}.jpg")
-    
+    return os.path.join(os.path.dirname(video_path), THUMBNAIL_DIR, f"{video_name}.jpg")
+
+def get_video_thumbnail(video_path):
+    """获取视频缩略图路径，不存在时交给任务队列生成并返回 None"""
+    thumbnail_path = video_thumbnail_path(video_path)
+
     # 如果缩略图已存在，直接返回
     if os.path.exists(thumbnail_path):
+        metrics.cache("video_thumbnail", True)
         return thumbnail_path
-    
-    # 创建缩略图目录
-    os.makedirs(thumbnail_dir, exist_ok=True)
-    
-    # 异步生成缩略图
-    def generate_async():
-        if generate_video_thumbnail(video_path, thumbnail_path):
-            print(f"已生成缩略图: {thumbnail_path}")
+    metrics.cache("video_thumbnail", False)
+    if not _schedule_background.get():
+        return None
+
+    try:
+        mtime = os.stat(video_path).st_mtime_ns
+    except OSError:
+        return None
+    video_thumbnail_queue.request(video_path, thumbnail_path, mtime)
+    return None  # 缩略图正在生成中（或上次失败，等待重试）
+
+# ========================
+# 静态图片缩略图生成
+# ========================
+
+def render_image_thumbnail(src, dst, size, fmt, quality):
+    """在子进程中把预览图缩小为 size×size 以内的缩略图，并把修改时间设为与原图一致"""
+    tmp = dst + ".tmp"
+    try:
+        if Image is not None:
+            with Image.open(src) as im:
+                im.thumbnail((size, size))
+                if fmt == "jpeg" and im.mode not in ("RGB", "L"):
+                    im = im.convert("RGB")
+                im.save(tmp, format=fmt.upper(), quality=quality)
         else:
-            print(f"生成缩略图失败: {video_path}")
-    
-    # 在新线程中生成缩略图，避免阻塞主程序
-    threading.Thread(target=generate_async, daemon=True).start()
-    
-    return None  # 缩略图正在生成中
+            cmd = [
+                FFMPEG_BIN, '-i', src,
+                '-vf', f'scale={size}:{size}:force_original_aspect_ratio=decrease',
+                '-frames:v', '1',
+                '-c:v', 'libwebp' if fmt == "webp" else 'mjpeg',
+                '-f', 'image2', '-y', tmp
+            ]
+            result = subprocess.run(cmd, capture_output=True, timeout=30)
+            if result.returncode != 0:
+                return False
+        st = os.stat(src)
+        os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp, dst)
+        return True
+    except Exception:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        return False
+
+_image_thumb_pool = None
+_image_thumb_jobs = {}
+_image_thumb_failures = {}  # 缩略图路径 -> {"mtime", "attempts", "retry_at"}
+_image_thumb_lock = threading.Lock()
+
+def process_pool_context():
+    """进程池的启动方式：服务运行中直接 fork 会让子进程继承监听端口和所有客户端连接（关闭连接时
+    对方收不到 EOF），还可能卡在 fork 时其它线程持有的锁上，因此改用 forkserver / spawn 启动全新的进程"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def get_image_thumb_pool():
+    """延迟创建进程池；平台不支持多进程时退回线程池"""
+    global _image_thumb_pool
+    if _image_thumb_pool is None:
+        try:
+            _image_thumb_pool = ProcessPoolExecutor(max_workers=IMAGE_THUMBNAIL_WORKERS,
+                                                    mp_context=process_pool_context())
+        except (OSError, NotImplementedError, ImportError) as e:
+            print(f"无法创建缩略图进程池: {e}，改用线程池")
+            _image_thumb_pool = ThreadPoolExecutor(max_workers=IMAGE_THUMBNAIL_WORKERS)
+    return _image_thumb_pool
+
+def image_thumbnail_path(image_path):
+    """静态缩略图路径：<目录>/.thumbnails/<原文件名>.<格式>，不会与视频缩略图重名"""
+    ext = "jpg" if IMAGE_THUMBNAIL_FORMAT == "jpeg" else IMAGE_THUMBNAIL_FORMAT
+    return os.path.join(os.path.dirname(image_path), THUMBNAIL_DIR, f"{os.path.basename(image_path)}.{ext}")
+
+def get_image_thumbnail(image_path):
+    """返回与原图同步的缩略图路径；缺失或原图已更新时交给进程池生成，失败返回 None"""
+    thumbnail_path = image_thumbnail_path(image_path)
+    try:
+        src_mtime = os.stat(image_path).st_mtime
+    except OSError:
+        return None
+    try:
+        if abs(os.stat(thumbnail_path).st_mtime - src_mtime) < 1:
+            metrics.cache("image_thumbnail", True)
+            return thumbnail_path
+    except OSError:
+        pass
+    metrics.cache("image_thumbnail", False)
+
+    with _image_thumb_lock:
+        failure = _image_thumb_failures.get(thumbnail_path)
+        if failure is not None and failure["mtime"] == src_mtime and time.time() < failure["retry_at"]:
+            return None  # 上次生成失败且原图未变：直接返回原图，退避期内不再提交
+        job = _image_thumb_jobs.get(thumbnail_path)
+        submitted = job is None
+        if submitted:
+            os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+            job = get_image_thumb_pool().submit(
+                render_image_thumbnail, image_path, thumbnail_path,
+                IMAGE_THUMBNAIL_SIZE, IMAGE_THUMBNAIL_FORMAT, IMAGE_THUMBNAIL_QUALITY)
+            _image_thumb_jobs[thumbnail_path] = job
+    if submitted:
+        # 在锁外登记：任务已完成时回调会立即在当前线程中执行
+        job.add_done_callback(lambda done: image_thumbnail_done(thumbnail_path, src_mtime, done))
+    try:
+        if job.result(timeout=IMAGE_THUMBNAIL_TIMEOUT):
+            return thumbnail_path
+    except Exception:
+        pass
+    return None
+
+def image_thumbnail_done(thumbnail_path, src_mtime, job):
+    """任务结束：失败时按原图修改时间记住，并以指数退避重试"""
+    try:
+        ok = job.result()
+    except Exception:
+        ok = False
+    with _image_thumb_lock:
+        _image_thumb_jobs.pop(thumbnail_path, None)
+        if ok:
+            _image_thumb_failures.pop(thumbnail_path, None)
+            return
+        failure = _image_thumb_failures.get(thumbnail_path)
+        attempts = failure["attempts"] + 1 if failure and failure["mtime"] == src_mtime else 1
+        delay = min(IMAGE_THUMBNAIL_RETRY_BASE * 2 ** (attempts - 1), IMAGE_THUMBNAIL_RETRY_MAX)
+        _image_thumb_failures[thumbnail_path] = {"mtime": src_mtime, "attempts": attempts,
+                                                 "retry_at": time.time() + delay}
+    metrics.inc("loraview_thumbnail_failures_total", (("kind", "image"),))
+
+# ========================
+# 缩略图拼图（可选，需要 Pillow）
+# ========================
+
+def render_sprite_sheet(sheet_path, rows, paste, keep, clear, columns, tile, fmt, quality, background):
+    """在子进程中增量更新一张拼图
+
+    paste 为需要重画的 {格子序号: 预览图路径}，clear 为需要清空的格子；keep 为其余应沿用
+    旧拼图的格子，旧拼图无法读取时连同它们一起重画。返回无法读取的格子序号列表。
+    """
+    size = (columns * tile, rows * tile)
+    canvas = Image.new("RGB", size, background)
+    try:
+        with Image.open(sheet_path) as old:
+            canvas.paste(old.convert("RGB").crop((0, 0, min(old.width, size[0]), min(old.height, size[1]))), (0, 0))
+    except (OSError, ValueError):
+        paste = {**keep, **paste}  # 旧拼图不可用时整张重画
+
+    blank = Image.new("RGB", (tile, tile), background)
+    for slot in clear:
+        canvas.paste(blank, ((slot % columns) * tile, (slot // columns) * tile))
+    failed = []
+    for slot, src in paste.items():
+        x, y = (slot % columns) * tile, (slot // columns) * tile
+        canvas.paste(blank, (x, y))
+        try:
+            with Image.open(src) as im:
+                im.thumbnail((tile, tile))
+                im = im.convert("RGBA")
+                canvas.paste(im, (x + (tile - im.width) // 2, y + (tile - im.height) // 2), im)
+        except (OSError, ValueError):
+            failed.append(slot)
+
+    tmp = sheet_path + ".tmp"
+    canvas.save(tmp, format=fmt.upper(), quality=quality)
+    os.replace(tmp, sheet_path)
+    return failed
+
+class SpriteAtlas:
+    """按目录维护预览图拼图与偏移表
+
+    页面渲染时只读取内存中的偏移表；目录快照变化时在后台核对预览图的修改时间，
+    新增、替换的预览图放入空闲格子或原位置，删除的格子清空，只重画有变化的拼图。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.maps = {}  # 目录 -> 偏移表
+        self.seen = {}  # 目录 -> 最近一次核对时的模型快照（按对象身份比较）
+        self.pending = set()
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lora-sprites")
+
+    @staticmethod
+    def sprite_dir(path):
+        return os.path.join(path, THUMBNAIL_DIR, "sprites")
+
+    def lookup(self, path, models):
+        """返回目录当前的偏移表（可能为 None）；快照与上次核对时不同则安排后台更新"""
+        if not SPRITE_ENABLED or Image is None:
+            return None
+        with self.lock:
+            if path not in self.maps:
+                self.maps[path] = load_sprite_map(self.sprite_dir(path))
+            if not _schedule_background.get():
+                return self.maps[path]
+            if self.seen.get(path) is not models and path not in self.pending:
+                self.seen[path] = models
+                self.pending.add(path)
+                self.pool.submit(self.update, path, models)
+            return self.maps[path]
+
+    def update(self, path, models):
+        try:
+            self.rebuild(path, models)
+        except Exception as e:
+            print(f"生成拼图失败 {path}: {e}")
+        finally:
+            with self.lock:
+                self.pending.discard(path)
+
+    def rebuild(self, path, models):
+        previews = {}  # 预览图相对路径 -> mtime_ns
+        for info in models.values():
+            preview = info.get('image') or info.get('thumbnail')
+            if preview:
+                try:
+                    previews[preview] = os.stat(os.path.join(path, preview)).st_mtime_ns
+                except OSError:
+                    pass
+
+        with self.lock:
+            old = self.maps.get(path)
+        if old and (old["columns"], old["tile"]) != (SPRITE_COLUMNS, SPRITE_TILE_SIZE):
+            old = None  # 配置改变，整体重建
+        tiles = dict(old["tiles"]) if old else {}
+        sheets = {int(k): dict(v) for k, v in old["sheets"].items()} if old else {}
+        # 无法读取的预览图记下修改时间，文件未变化前不再重试
+        failed = {p: m for p, m in (old.get("failed", {}) if old else {}).items() if previews.get(p) == m}
+
+        paste = {}  # 拼图序号 -> {格子序号: 预览图路径}
+        clear = {}  # 拼图序号 -> {格子序号}
+        for preview, tile in list(tiles.items()):
+            if preview not in previews:  # 预览图已删除：空出格子
+                del tiles[preview]
+                clear.setdefault(tile["sheet"], set()).add(tile["slot"])
+            elif previews[preview] != tile["mtime_ns"]:  # 预览图已替换：原位置重画
+                tiles[preview] = dict(tile, mtime_ns=previews[preview])
+                paste.setdefault(tile["sheet"], {})[tile["slot"]] = os.path.join(path, preview)
+        used = {(t["sheet"], t["slot"]) for t in tiles.values()}
+        free = ((sheet, slot) for sheet in itertools.count() for slot in range(SPRITE_TILES_PER_SHEET)
+                if (sheet, slot) not in used)
+        for preview in sorted(previews.keys() - tiles.keys() - failed.keys()):
+            sheet, slot = next(free)
+            tiles[preview] = {"sheet": sheet, "slot": slot, "mtime_ns": previews[preview]}
+            paste.setdefault(sheet, {})[slot] = os.path.join(path, preview)
+            clear.get(sheet, set()).discard(slot)
+
+        sprite_dir = self.sprite_dir(path)
+        redraw = set()  # 拼图文件丢失或与记录的版本不符时整张重画
+        for sheet in {t["sheet"] for t in tiles.values()}:
+            info = sheets.get(sheet)
+            try:
+                version = f"{os.stat(os.path.join(sprite_dir, info['file'])).st_mtime_ns:x}" if info else None
+            except OSError:
+                version = None
+            if version is None or version != info["version"]:
+                redraw.add(sheet)
+        if not paste and not redraw and not any(clear.values()) and old and failed == old.get("failed", {}):
+            return
+
+        os.makedirs(sprite_dir, exist_ok=True)
+        ext = "jpg" if IMAGE_THUMBNAIL_FORMAT == "jpeg" else IMAGE_THUMBNAIL_FORMAT
+        jobs = {}
+        for sheet in paste.keys() | redraw | {k for k, v in clear.items() if v}:
+            sheet_tiles = {t["slot"]: os.path.join(path, p) for p, t in tiles.items() if t["sheet"] == sheet}
+            rows = (max(sheet_tiles) // SPRITE_COLUMNS + 1) if sheet_tiles else 1
+            if sheet in redraw:
+                sheet_paste, keep = sheet_tiles, {}
+                sheet_clear = set(range(rows * SPRITE_COLUMNS)) - sheet_tiles.keys()
+            else:
+                sheet_paste = paste.get(sheet, {})
+                keep = {slot: src for slot, src in sheet_tiles.items() if slot not in sheet_paste}
+                sheet_clear = clear.get(sheet, set())
+            file_name = f"sheet-{sheet}.{ext}"
+            jobs[sheet] = (file_name, rows, get_image_thumb_pool().submit(
+                render_sprite_sheet, os.path.join(sprite_dir, file_name), rows,
+                sheet_paste, keep, sheet_clear, SPRITE_COLUMNS, SPRITE_TILE_SIZE,
+                IMAGE_THUMBNAIL_FORMAT, IMAGE_THUMBNAIL_QUALITY, SPRITE_BACKGROUND))
+        for sheet, (file_name, rows, job) in jobs.items():
+            failed_slots = set(job.result())
+            st = os.stat(os.path.join(sprite_dir, file_name))
+            sheets[sheet] = {"file": file_name, "rows": rows, "version": f"{st.st_mtime_ns:x}"}
+            for preview in [p for p, t in tiles.items() if t["sheet"] == sheet and t["slot"] in failed_slots]:
+                failed[preview] = tiles.pop(preview)["mtime_ns"]  # 无法读取的预览图仍按单张图片显示
+
+        sprite_map = {"columns": SPRITE_COLUMNS, "tile": SPRITE_TILE_SIZE, "sheets": sheets, "tiles": tiles,
+                      "failed": failed}
+        tmp = os.path.join(sprite_dir, "sprites.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(sprite_map, f, ensure_ascii=False)
+        os.replace(tmp, os.path.join(sprite_dir, "sprites.json"))
+        with self.lock:
+            self.maps[path] = sprite_map
+        print(f"已更新拼图: {path}（{len(tiles)} 张预览，重画 {len(jobs)} 张拼图）")
+
+def load_sprite_map(sprite_dir):
+    try:
+        with open(os.path.join(sprite_dir, "sprites.json"), encoding="utf-8") as f:
+            sprite_map = json.load(f)
+        sprite_map["sheets"] = {int(k): v for k, v in sprite_map["sheets"].items()}
+        return sprite_map
+    except (OSError, ValueError, KeyError):
+        return None
+
+sprite_atlas = SpriteAtlas()
+
+def sprite_tile(files, folder_name):
+    """模型预览在拼图中的位置：返回 {url, size, pos}（按 120×120 的显示尺寸），不在拼图中时返回 None"""
+    path = files.get('folder_path')
+    preview = files.get('image') or files.get('thumbnail')
+    if not preview or not path or not SPRITE_ENABLED:
+        return None
+    sprite_map = sprite_atlas.maps.get(path)
+    tile = sprite_map["tiles"].get(preview) if sprite_map else None
+    if tile is None:
+        return None
+    sheet = sprite_map["sheets"][tile["sheet"]]
+    columns = sprite_map["columns"]
+    params = f"dir={quote(folder_name)}&" if folder_name else ""
+    return {
+        "url": f"/file/{THUMBNAIL_DIR}/sprites/{sheet['file']}?{params}v={sheet['version']}",
+        "size": [columns * THUMBNAIL_WIDTH, sheet["rows"] * THUMBNAIL_HEIGHT],
+        "pos": [(tile["slot"] % columns) * THUMBNAIL_WIDTH, (tile["slot"] // columns) * THUMBNAIL_HEIGHT],
+    }
+
+def sprite_style(sprite):
+    return (f"background-image:url('{sprite['url']}');background-size:{sprite['size'][0]}px {sprite['size'][1]}px;"
+            f"background-position:-{sprite['pos'][0]}px -{sprite['pos'][1]}px")
 
 # ========================
 # 扫描所有子文件夹
 # ========================
 
+def dir_identity(path):
+    """目录标识 (st_dev, st_ino)：符号链接指向的目录与原目录标识相同"""
+    st = os.stat(path)
+    return st.st_dev, st.st_ino
+
+def list_subdirs(path):
+    """列出一个目录下的子目录，返回 [(名称, 目录标识)]
+
+    符号链接指向的目录也会列出；标识用于识别通过链接重复到达的目录（包括指回上级形成的循环）。
+    """
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name == THUMBNAIL_DIR:
+                    continue
+                try:
+                    if entry.is_dir():
+                        subdirs.append((entry.name, dir_identity(entry.path)))
+                except OSError:
+                    pass
+    except OSError as e:
+        print(f"扫描目录失败: {e}")
+    return subdirs
+
+def scan_tree(rel, path, depth, seen, folder_map):
+    """并行列出 path（显示名 rel，深度 depth）以下的所有子目录并加入 folder_map
+
+    seen 为已列出目录的标识集合，同一目录只列出一次，因此符号链接循环不会无限展开。
+    """
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as pool:
+        pending = {pool.submit(list_subdirs, path): (rel, depth)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel, depth = pending.pop(future)
+                for name, identity in future.result():
+                    if identity in seen:
+                        continue
+                    seen.add(identity)
+                    child_rel = f"{rel}/{name}" if rel else name
+                    child_path = os.path.join(FOLDER, *child_rel.split("/"))
+                    folder_map[child_rel] = child_path
+                    if depth + 1 < SCAN_MAX_DEPTH:
+                        pending[pool.submit(list_subdirs, child_path)] = (child_rel, depth + 1)
+
 def scan_folders():
+    """递归扫描 FOLDER 下的所有子文件夹，各子树由线程池并行列出
+
+    返回 {显示名: 路径}，多级目录的显示名为以 / 分隔的相对路径（如 SDXL/characters）。
+    """
+    started = time.perf_counter()
     folder_map = {}
     if INCLUDE_ROOT:
         folder_map[ROOT_NAME] = FOLDER
+
     try:
-        for item in os.listdir(FOLDER):
-            path = os.path.join(FOLDER, item)
-            if os.path.isdir(path):
-                folder_map[item] = path
-    except Exception as e:
-        print(f"扫描目录失败: {e}")
+        seen = {dir_identity(FOLDER)}
+    except OSError:
+        seen = set()
+    scan_tree("", FOLDER, 0, seen, folder_map)
+    elapsed = time.perf_counter() - started
+    metrics.observe("loraview_scan_folders_duration_seconds", (), elapsed)
+    add_timing("scan", elapsed)
     return folder_map
 
+def format_size_mb(size_bytes):
+    """字节数转为MB为单位的字符串"""
+    return f"{size_bytes / (1024 * 1024):.1f}MB"
+
 def get_file_size_mb(file_path):
     """获取文件大小，返回MB为单位的字符串"""
     try:
-        size_bytes = os.path.getsize(file_path)
-        size_mb = size_bytes / (1024 * 1024)
-        return f"{size_mb:.1f}MB"
+        return format_size_mb(os.path.getsize(file_path))
     except:
         return "未知大小"
 
-def group_files_in(path):
-    """在指定路径中分组模型、文本、图片或视频，并记录创建时间和文件大小"""
-    if not os.path.exists(path):
-        return {}
+def read_text_file(full_path, max_chars=None):
+    """读取 .txt 说明文件，返回 (内容, 是否成功)；max_chars 限制最多读取的字符数"""
+    try:
+        with open(full_path, 'r', encoding='utf-8') as tf:
+            return tf.read(-1 if max_chars is None else max_chars).strip(), True
+    except Exception as e:
+        return f"[读取失败] {str(e)}", False
 
-    base_names = {}
-    model_exts = {'.safetensors', '.ckpt', '.pt', '.bin', '.pth'}
+def text_preview(content):
+    """截取说明文字的前 MAX_VISIBLE_LINES 行作为卡片预览，返回 (预览, 是否还有更多内容)"""
+    lines = content.split('\n', MAX_VISIBLE_LINES)
+    more = len(lines) > MAX_VISIBLE_LINES
+    preview = '\n'.join(lines[:MAX_VISIBLE_LINES])
+    if len(preview) > TEXT_PREVIEW_MAX_CHARS:
+        preview, more = preview[:TEXT_PREVIEW_MAX_CHARS], True
+    return preview, more
+
+# ========================
+# safetensors 元数据提取
+# ========================
+
+def read_safetensors_header(model_path):
+    """读取 safetensors 文件开头的 8 字节长度（小端）和随后的 JSON 头，不读取张量数据"""
+    with open(model_path, 'rb') as f:
+        prefix = f.read(8)
+        if len(prefix) != 8:
+            raise ValueError("文件过短")
+        (length,) = struct.unpack("<Q", prefix)
+        if length > METADATA_HEADER_MAX_BYTES:
+            raise ValueError(f"文件头过大: {length} 字节")
+        data = f.read(length)
+    if len(data) != length:
+        raise ValueError("文件头不完整")
+    header = json.loads(data)
+    if not isinstance(header, dict):
+        raise ValueError("文件头格式错误")
+    return header
+
+def summarize_metadata(header):
+    """从文件头中提取卡片展示用的信息：底模、rank/alpha、输出名、常用训练标签"""
+    meta = header.get("__metadata__") or {}
+    summary = {}
+
+    base_model = (meta.get("ss_base_model_version") or meta.get("modelspec.architecture")
+                  or meta.get("ss_sd_model_name"))
+    if base_model:
+        summary["base_model"] = base_model
+
+    dim = meta.get("ss_network_dim")
+    if dim is None:
+        # 没有训练元数据时，从 lora_down 权重的形状推断 rank
+        for key, info in header.items():
+            if key.endswith("lora_down.weight") and isinstance(info, dict) and info.get("shape"):
+                dim = info["shape"][0]
+                break
+    if dim is not None:
+        summary["dim"] = str(dim)
+    if meta.get("ss_network_alpha") is not None:
+        summary["alpha"] = str(meta["ss_network_alpha"])
+    if meta.get("ss_output_name"):
+        summary["output_name"] = meta["ss_output_name"]
 
-    files = {}
     try:
-        for f in os.listdir(path):
-            fp = os.path.join(path, f)
-            if os.path.isfile(fp):
-                files[f.lower()] = f  # 原始文件名
-    except Exception as e:
-        print(f"读取失败 {path}: {e}")
-        return {}
-
-    for filename in files.values():
-        name, ext = os.path.splitext(filename.lower())
-        orig_name = filename
-        full_path = os.path.join(path, orig_name)
-
-        if ext in model_exts:
-            base_names.setdefault(name, {})['model'] = orig_name
-            base_names[name]['folder_path'] = path
-            base_names[name]['model_ext'] = ext  # 保存模型文件扩展名
-            # 获取创建时间和文件大小
-            try:
-                ctime = os.path.getctime(full_path)
-                base_names[name]['created_time'] = datetime.fromtimestamp(ctime).strftime("%Y-%m-%d %H:%M")
-                base_names[name]['file_size'] = get_file_size_mb(full_path)
-            except:
-                base_names[name]['created_time'] = "未知"
-                base_names[name]['file_size'] = "未知"
-        elif ext == '.txt':
-            base_names.setdefault(name, {})['text'] = orig_name
-            # 预读取文本内容并计算行数
+        frequency = json.loads(meta.get("ss_tag_frequency") or "{}")
+    except ValueError:
+        frequency = {}
+    counts = {}
+    for tags in frequency.values():
+        if isinstance(tags, dict):
+            for tag, count in tags.items():
+                tag = tag.strip()
+                if tag and isinstance(count, int):
+                    counts[tag] = counts.get(tag, 0) + count
+    if counts:
+        summary["tags"] = heapq.nlargest(METADATA_TOP_TAGS, counts, key=counts.get)
+    return summary
+
+class MetadataExtractor:
+    """后台读取 safetensors 文件头：按目录成批提交，结果写入目录缓存，完成后刷新该目录的快照"""
+
+    def __init__(self, workers=METADATA_WORKERS):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lora-metadata")
+        self.lock = threading.Lock()
+        self.pending = set()  # 正在处理的目录，避免重复提交
+
+    def request(self, folder_path, files):
+        """files 为 [(文件名, 大小, mtime_ns)]"""
+        with self.lock:
+            if folder_path in self.pending:
+                return
+            self.pending.add(folder_path)
+        self.pool.submit(self.extract_folder, folder_path, files)
+
+    def extract_folder(self, folder_path, files):
+        rows = []
+        try:
+            for name, size, mtime_ns in files:
+                try:
+                    summary = summarize_metadata(read_safetensors_header(os.path.join(folder_path, name)))
+                except Exception as e:
+                    print(f"读取模型元数据失败: {os.path.join(folder_path, name)}: {e}")
+                    summary = {}  # 同样写入缓存，文件不变就不再重试
+                rows.append((name, size, mtime_ns, summary))
+            get_catalog().save_metadata(folder_path, rows)
+        finally:
+            with self.lock:
+                self.pending.discard(folder_path)
+        if _watcher is not None:
+            _watcher.mark_dirty(folder_path, force=False)
+
+metadata_extractor = MetadataExtractor()
+
+# ========================
+# 模型文件哈希
+# ========================
+
+def hash_file(path, chunk_size=HASH_CHUNK_SIZE):
+    """流式计算文件的 SHA-256（在进程池中运行；读入复用同一块缓冲区）"""
+    digest = hashlib.sha256()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, 'rb', buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+def autov2_hash(sha256):
+    """AutoV2 短哈希：SHA-256 的前 10 位（大写），与常见模型站点显示的一致"""
+    return sha256[:10].upper()
+
+class RequestLoad:
+    """记录正在处理的请求数，后台任务据此在有请求时让出磁盘"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.last_finished = 0.0
+
+    def __enter__(self):
+        with self.lock:
+            self.in_flight += 1
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.in_flight -= 1
+            self.last_finished = time.time()
+
+    def wait_idle(self, idle_seconds, max_wait=None):
+        """阻塞到没有请求、且最后一个请求结束已超过 idle_seconds 秒
+
+        max_wait 限制最长等待秒数：视频流等长连接会一直计入 in_flight，不设上限时后台任务会无限期暂停。
+        """
+        deadline = None if max_wait is None else time.time() + max_wait
+        while True:
+            with self.lock:
+                busy = self.in_flight > 0
+                wait = idle_seconds - (time.time() - self.last_finished)
+            if not busy and wait <= 0:
+                return
+            if deadline is not None and time.time() >= deadline:
+                return
+            time.sleep(max(0.1, min(wait, idle_seconds)))
+
+request_load = RequestLoad()
+
+class HashService:
+    """后台计算模型文件的 SHA-256：结果按 (路径, 大小, mtime) 缓存在目录缓存中，每个文件只计算一次
+
+    计算在进程池中进行；每个文件开始前会等待请求空闲（最多 HASH_MAX_WAIT_SECONDS 秒），正在计算的文件不会中断。
+    读取失败的文件按 (大小, mtime) 记住并以指数退避重试，避免刷新目录后又立即重新入队。
+    """
+
+    def __init__(self, workers=HASH_WORKERS):
+        self.workers = workers
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.queued = {}  # 文件路径 -> (目录, 文件名, 大小, mtime_ns)
+        self.folder_left = {}  # 目录 -> 尚未完成的文件数
+        self.last_refresh = {}  # 目录 -> 上次刷新快照的时间
+        self.failures = {}  # 文件路径 -> {"key": (大小, mtime_ns), "attempts", "retry_at"}
+        self.hashed = 0
+        self.failed = 0
+        self.pool = None
+        self.threads = []
+
+    def start_workers(self):
+        if self.threads:
+            return
+        try:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_pool_context())
+        except (OSError, NotImplementedError, ImportError) as e:
+            print(f"无法创建哈希进程池: {e}，改用线程池")
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+        for i in range(self.workers):
+            t = threading.Thread(target=self.worker_loop, name=f"lora-hash-{i}", daemon=True)
+            t.start()
+            self.threads.append(t)
+
+    def backing_off(self, folder_path, name, size, mtime_ns):
+        """该文件最近计算失败且仍在退避期内（文件大小或 mtime 变化后立即重新计算）"""
+        with self.lock:
+            failure = self.failures.get(os.path.join(folder_path, name))
+        return failure is not None and failure["key"] == (size, mtime_ns) and time.time() < failure["retry_at"]
+
+    def request(self, folder_path, files):
+        """files 为 [(文件名, 大小, mtime_ns)]；已在队列中或仍在失败退避期内的文件不会重复加入"""
+        if not HASH_ENABLED:
+            return
+        files = [f for f in files if not self.backing_off(folder_path, *f)]
+        if not files:
+            return
+        with self.lock:
+            self.start_workers()
+            for name, size, mtime_ns in files:
+                path = os.path.join(folder_path, name)
+                if self.queued.get(path) == (folder_path, name, size, mtime_ns):
+                    continue
+                if path not in self.queued:
+                    self.folder_left[folder_path] = self.folder_left.get(folder_path, 0) + 1
+                self.queued[path] = (folder_path, name, size, mtime_ns)
+                self.pending.put(path)
+
+    def worker_loop(self):
+        while True:
+            path = self.pending.get()
+            with self.lock:
+                job = self.queued.get(path)
+            if job is None:
+                continue  # 同一文件重复入队，已由其它线程处理
+            request_load.wait_idle(HASH_IDLE_SECONDS, HASH_MAX_WAIT_SECONDS)
+            folder_path, name, size, mtime_ns = job
             try:
-                with open(full_path, 'r', encoding='utf-8') as tf:
-                    content = tf.read().strip()
-                lines = content.split('\n')
-                base_names[name]['text_content'] = content
-                base_names[name]['text_line_count'] = len(lines)
-                base_names[name]['needs_collapse'] = len(lines) > MAX_VISIBLE_LINES
+                sha256 = self.pool.submit(hash_file, path).result()
             except Exception as e:
-                base_names[name]['text_content'] = f"[读取失败] {str(e)}"
-                base_names[name]['text_line_count'] = 1
-                base_names[name]['needs_collapse'] = False
-        elif ext in IMAGE_EXTS:
-            base_names.setdefault(name, {})['image'] = orig_name
-        elif ext in VIDEO_EXTS:
-            base_names.setdefault(name, {})['video'] = orig_name
+                print(f"计算哈希失败: {path}: {e}")
+                sha256 = None
+            with self.lock:
+                if self.queued.get(path) != job:
+                    continue  # 计算期间文件又有变化，已重新入队
+                del self.queued[path]
+                left = self.folder_left[folder_path] = self.folder_left[folder_path] - 1
+                if left <= 0:
+                    del self.folder_left[folder_path]
+                if sha256 is None:
+                    self.failed += 1
+                    failure = self.failures.get(path)
+                    attempts = failure["attempts"] + 1 if failure and failure["key"] == (size, mtime_ns) else 1
+                    delay = min(HASH_RETRY_BASE * 2 ** (attempts - 1), HASH_RETRY_MAX)
+                    self.failures[path] = {"key": (size, mtime_ns), "attempts": attempts,
+                                           "retry_at": time.time() + delay}
+                else:
+                    self.hashed += 1
+                    self.failures.pop(path, None)
+                refresh = left <= 0 or time.time() - self.last_refresh.get(folder_path, 0) >= HASH_REFRESH_INTERVAL
+                if refresh:
+                    self.last_refresh[folder_path] = time.time()
+            if sha256 is not None:
+                get_catalog().save_hash(folder_path, name, size, mtime_ns, sha256)
+            if refresh and _watcher is not None:
+                _watcher.mark_dirty(folder_path, force=False)
+
+    def status(self):
+        with self.lock:
+            return {
+                "enabled": HASH_ENABLED,
+                "queued": len(self.queued),
+                "hashed": self.hashed,
+                "failed": self.failed,
+                "backing_off": sum(1 for f in self.failures.values() if time.time() < f["retry_at"]),
+            }
+
+hash_service = HashService()
+
+# ========================
+# 模型目录缓存（SQLite）
+# ========================
+
+class ModelCatalog:
+    """持久化的模型记录：目录修改时间未变时直接读库，变化时只重新读取有改动的 .txt
+
+    库中只保存 .txt 的预览（前几行），完整说明由 /api/text 按需读取。
+
+    模型名与 .txt 内容同时写入 FTS5 全文索引（trigram 分词，可直接匹配中日韩文字），
+    索引随目录重新扫描增量更新，只改动新增、删除或 .txt 有变化的模型。
+    """
+
+    COLUMNS = ("base", "model", "model_ext", "size", "ctime", "mtime_ns",
+               "text", "text_mtime_ns", "text_content", "text_more", "image", "video")
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        self.write_lock = threading.Lock()
+        self.fts = True  # SQLite 未编译 FTS5 时退回 LIKE 扫描
+
+    def connect(self):
+        """每个线程使用独立连接（WAL 模式下读写互不阻塞）"""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            has_search = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name='search_docs'").fetchone()
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS dirs (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    checked REAL
+                );
+                CREATE TABLE IF NOT EXISTS models (
+                    dir TEXT,
+                    base TEXT,
+                    model TEXT,
+                    model_ext TEXT,
+                    size INTEGER,
+                    ctime REAL,
+                    mtime_ns INTEGER,
+                    text TEXT,
+                    text_mtime_ns INTEGER,
+                    text_content TEXT,
+                    text_more INTEGER,
+                    image TEXT,
+                    video TEXT,
+                    PRIMARY KEY (dir, base)
+                );
+                CREATE TABLE IF NOT EXISTS model_meta (
+                    dir TEXT,
+                    file TEXT,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    data TEXT,
+                    PRIMARY KEY (dir, file)
+                );
+                CREATE TABLE IF NOT EXISTS model_hashes (
+                    dir TEXT,
+                    file TEXT,
+                    size INTEGER,
+                    mtime_ns INTEGER,
+                    sha256 TEXT,
+                    PRIMARY KEY (dir, file)
+                );
+                CREATE INDEX IF NOT EXISTS model_hashes_sha256 ON model_hashes (sha256);
+                CREATE TABLE IF NOT EXISTS search_docs (
+                    id INTEGER PRIMARY KEY,
+                    dir TEXT,
+                    base TEXT,
+                    name TEXT,
+                    body TEXT,
+                    UNIQUE (dir, base)
+                );
+            """)
+            if not has_search:
+                # 旧版缓存没有全文索引：让所有目录在下次访问时重新扫描并建立索引
+                with conn:
+                    conn.execute("DELETE FROM dirs")
+            if "text_more" not in {r[1] for r in conn.execute("PRAGMA table_info(models)")}:
+                # 旧版缓存保存的是完整说明：重新读取为预览
+                with conn:
+                    conn.execute("ALTER TABLE models ADD COLUMN text_more INTEGER")
+                    conn.execute("UPDATE models SET text_mtime_ns=NULL")
+                    conn.execute("DELETE FROM dirs")
+            try:
+                conn.execute("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(
+                        name, body, content='search_docs', content_rowid='id', tokenize='trigram')
+                """)
+            except sqlite3.OperationalError as e:
+                if self.fts:
+                    print(f"SQLite 不支持 FTS5 trigram 分词（{e}），全文搜索改用逐条扫描")
+                self.fts = False
+            self.local.conn = conn
+        return conn
+
+    def folder_records(self, path, force=False):
+        """返回目录中的模型记录列表；目录未变化时只需要一次 stat，force=True 时强制逐个核对文件"""
+        try:
+            dir_mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self.forget(path)
+            return []
+        if force:
+            return self.rescan(path, dir_mtime)
+
+        row = self.connect().execute(
+            "SELECT mtime_ns, checked FROM dirs WHERE path=?", (path,)).fetchone()
+        if row is not None and row["mtime_ns"] == dir_mtime:
+            if CATALOG_RECHECK_SECONDS <= 0 or time.time() - row["checked"] < CATALOG_RECHECK_SECONDS:
+                metrics.cache("catalog", True)
+                return self.load(path)
+        metrics.cache("catalog", False)
+        return self.rescan(path, dir_mtime)
+
+    def load(self, path):
+        rows = self.connect().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM models WHERE dir=?", (path,))
+        return [dict(r) for r in rows]
+
+    def forget(self, path):
+        with self.write_lock:
+            conn = self.connect()
+            with conn:
+                self.unindex(conn, path, [r[0] for r in conn.execute(
+                    "SELECT base FROM search_docs WHERE dir=?", (path,))])
+                conn.execute("DELETE FROM models WHERE dir=?", (path,))
+                conn.execute("DELETE FROM model_meta WHERE dir=?", (path,))
+                conn.execute("DELETE FROM model_hashes WHERE dir=?", (path,))
+                conn.execute("DELETE FROM dirs WHERE path=?", (path,))
+
+    def folder_metadata(self, path):
+        """目录中已缓存的 safetensors 元数据：{文件名: (大小, mtime_ns, 摘要)}"""
+        rows = self.connect().execute(
+            "SELECT file, size, mtime_ns, data FROM model_meta WHERE dir=?", (path,))
+        return {r["file"]: (r["size"], r["mtime_ns"], json.loads(r["data"])) for r in rows}
+
+    def save_metadata(self, path, rows):
+        with self.write_lock:
+            conn = self.connect()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO model_meta (dir, file, size, mtime_ns, data) VALUES (?, ?, ?, ?, ?)",
+                    [(path, name, size, mtime_ns, json.dumps(summary, ensure_ascii=False))
+                     for name, size, mtime_ns, summary in rows])
+
+    def folder_hashes(self, path):
+        """目录中已缓存的哈希：{文件名: (大小, mtime_ns, sha256)}"""
+        rows = self.connect().execute(
+            "SELECT file, size, mtime_ns, sha256 FROM model_hashes WHERE dir=?", (path,))
+        return {r["file"]: (r["size"], r["mtime_ns"], r["sha256"]) for r in rows}
+
+    def save_hash(self, path, name, size, mtime_ns, sha256):
+        with self.write_lock:
+            conn = self.connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO model_hashes (dir, file, size, mtime_ns, sha256) VALUES (?, ?, ?, ?, ?)",
+                    (path, name, size, mtime_ns, sha256))
+
+    def find_hash(self, prefix, limit=50):
+        """按 SHA-256 前缀（AutoV2 即前 10 位）查找模型文件，返回 [(目录, 文件名, sha256)]"""
+        prefix = prefix.lower()
+        rows = self.connect().execute(
+            "SELECT dir, file, sha256 FROM model_hashes WHERE sha256 >= ? AND sha256 < ? LIMIT ?",
+            (prefix, prefix + "g", limit))
+        return [tuple(r) for r in rows]
+
+    def unindex(self, conn, path, bases):
+        """从全文索引中移除模型（外部内容表需要先按旧内容删除 FTS 行）"""
+        for base in bases:
+            row = conn.execute("SELECT id, name, body FROM search_docs WHERE dir=? AND base=?",
+                               (path, base)).fetchone()
+            if row is None:
+                continue
+            if self.fts:
+                conn.execute("INSERT INTO search (search, rowid, name, body) VALUES ('delete', ?, ?, ?)",
+                             (row[0], row[1], row[2]))
+            conn.execute("DELETE FROM search_docs WHERE id=?", (row[0],))
+
+    def index(self, conn, path, records, bodies):
+        """把模型名与 .txt 内容（bodies: 模型名 -> 说明文字）写入全文索引"""
+        for rec in records:
+            body = bodies.get(rec["base"], "")
+            cur = conn.execute("INSERT INTO search_docs (dir, base, name, body) VALUES (?, ?, ?, ?)",
+                               (path, rec["base"], rec["base"], body))
+            if self.fts:
+                conn.execute("INSERT INTO search (rowid, name, body) VALUES (?, ?, ?)",
+                             (cur.lastrowid, rec["base"], body))
+
+    def match_clause(self, terms):
+        """搜索条件：返回 (FROM 子句, WHERE 子句, 参数, 是否使用 FTS5)，search 与 count 共用
+
+        不少于 3 个字符的关键词走 FTS5 索引，更短的关键词只能逐条 LIKE 匹配。
+        """
+        long_terms = [t for t in terms if len(t) >= 3]
+        short_terms = [t for t in terms if len(t) < 3]
+        params = []
+        where = []
+        use_fts = bool(self.fts and long_terms)
+        if use_fts:
+            source = "search JOIN search_docs d ON d.id = search.rowid"
+            where.append("search MATCH ?")
+            params.append(" AND ".join('"' + t.replace('"', '""') + '"' for t in long_terms))
+        else:
+            source = "search_docs d"
+            short_terms = terms
+        for t in short_terms:
+            pattern = "%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where.append("(d.name LIKE ? ESCAPE '\\' OR d.body LIKE ? ESCAPE '\\')")
+            params += [pattern, pattern]
+        return source, " AND ".join(where), params, use_fts
+
+    def search(self, terms, limit):
+        """按关键词（全部命中）搜索模型名与 .txt 内容，返回 [(目录, 模型名, 说明内容, 得分)]
+
+        走 FTS5 索引时按 bm25 排序（模型名权重更高）。
+        """
+        source, where, params, use_fts = self.match_clause(terms)
+        if use_fts:
+            sql = f"SELECT d.dir, d.base, d.body, bm25(search, 10.0, 1.0) AS score FROM {source} WHERE {where}"
+            sql += " ORDER BY score LIMIT ?"  # bm25 中模型名的权重已高于说明内容
+        else:
+            # 没有相关度可用时，模型名命中的结果排在前面
+            name_hit = " + ".join(["(instr(lower(d.name), ?) > 0)"] * len(terms))
+            sql = f"SELECT d.dir, d.base, d.body, 0.0 AS score FROM {source} WHERE {where}"
+            sql += f" ORDER BY ({name_hit}) DESC, d.base LIMIT ?"
+            params += terms
+        params.append(limit)
+        return [tuple(r) for r in self.connect().execute(sql, params)]
+
+    def count(self, terms):
+        """与 search 相同条件的命中数，按目录分组返回 {目录: 数量}（调用方可剔除已不存在的目录）"""
+        source, where, params, _ = self.match_clause(terms)
+        rows = self.connect().execute(f"SELECT d.dir, COUNT(*) FROM {source} WHERE {where} GROUP BY d.dir", params)
+        return {r[0]: r[1] for r in rows}
+
+    def rescan(self, path, dir_mtime):
+        """重新列出目录，未改动的 .txt 直接沿用库中的预览"""
+        started = time.perf_counter()
+        old = {r["base"]: r for r in self.load(path)}
+        files = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_file():
+                        files[entry.name.lower()] = entry  # 原始文件名
+        except OSError as e:
+            print(f"读取失败 {path}: {e}")
+            return []
+        listed = time.perf_counter()
+        add_timing("listdir", listed - started)
+        text_time = 0.0
+
+        records = {}
+        changed = set()  # .txt 有变化、需要重建全文索引的模型
+        bodies = {}  # 本次读取过的说明文字，只用于写入全文索引
+        for lower_name, entry in files.items():
+            name, ext = os.path.splitext(lower_name)
+            if ext not in MODEL_EXTS and ext != '.txt' and ext not in MEDIA_EXTS:
+                continue
+            rec = records.setdefault(name, dict.fromkeys(self.COLUMNS))
+            rec["base"] = name
+
+            if ext in MODEL_EXTS:
+                rec["model"] = entry.name
+                rec["model_ext"] = ext
+                try:
+                    st = entry.stat()
+                    rec["size"] = st.st_size
+                    rec["ctime"] = st.st_ctime
+                    rec["mtime_ns"] = st.st_mtime_ns
+                except OSError:
+                    pass
+            elif ext == '.txt':
+                rec["text"] = entry.name
+                try:
+                    text_mtime = entry.stat().st_mtime_ns
+                except OSError:
+                    text_mtime = None
+                prev = old.get(name)
+                if (prev and text_mtime is not None and prev["text"] == entry.name
+                        and prev["text_mtime_ns"] == text_mtime):
+                    rec["text_content"] = prev["text_content"]
+                    rec["text_more"] = prev["text_more"]
+                    rec["text_mtime_ns"] = text_mtime
+                else:
+                    # 只读取索引所需的前 SEARCH_INDEX_MAX_CHARS 个字符，库中只保存预览
+                    read_started = time.perf_counter()
+                    content, ok = read_text_file(entry.path, SEARCH_INDEX_MAX_CHARS)
+                    text_time += time.perf_counter() - read_started
+                    rec["text_content"], rec["text_more"] = text_preview(content)
+                    rec["text_mtime_ns"] = text_mtime if ok else None
+                    bodies[name] = content
+                    changed.add(name)
+            elif ext in IMAGE_EXTS:
+                rec["image"] = entry.name
+            elif ext in VIDEO_EXTS:
+                rec["video"] = entry.name
+        add_timing("stat", time.perf_counter() - listed - text_time)
+
+        # 只为新增、删除、说明文件变化（含 .txt 被删除）的模型更新全文索引
+        conn = self.connect()
+        indexed = {r[0] for r in conn.execute("SELECT base FROM search_docs WHERE dir=?", (path,))}
+        changed |= records.keys() - indexed
+        changed |= {b for b in records.keys() & old.keys() if records[b]["text"] != old[b]["text"]}
+        removed = indexed - records.keys()
+        read_started = time.perf_counter()
+        for base in changed - bodies.keys():
+            if records[base]["text"]:
+                bodies[base] = read_text_file(os.path.join(path, records[base]["text"]), SEARCH_INDEX_MAX_CHARS)[0]
+        add_timing("text", text_time + time.perf_counter() - read_started)
+
+        placeholders = ", ".join("?" * (len(self.COLUMNS) + 1))
+        with self.write_lock:
+            with conn:
+                self.unindex(conn, path, changed | removed)
+                self.index(conn, path, [records[b] for b in changed], bodies)
+                conn.execute("DELETE FROM models WHERE dir=?", (path,))
+                conn.executemany(
+                    f"INSERT INTO models (dir, {', '.join(self.COLUMNS)}) VALUES ({placeholders})",
+                    [(path, *(rec[c] for c in self.COLUMNS)) for rec in records.values()])
+                conn.execute("INSERT OR REPLACE INTO dirs (path, mtime_ns, checked) VALUES (?, ?, ?)",
+                             (path, dir_mtime, time.time()))
+        metrics.observe_scan(path, time.perf_counter() - started)
+        return list(records.values())
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+def get_catalog():
+    """延迟创建全局目录缓存；数据库不可写时退回内存数据库"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            catalog = ModelCatalog(CATALOG_DB)
+            try:
+                catalog.connect()
+            except sqlite3.Error as e:
+                print(f"无法打开目录缓存 {CATALOG_DB}: {e}，改用内存缓存")
+                catalog = ModelCatalog(":memory:")
+            _catalog = catalog
+        return _catalog
+
+def group_files_in(path, refresh=False):
+    """在指定路径中分组模型、文本、图片或视频，并记录创建时间和文件大小（数据来自目录缓存）
+
+    safetensors 元数据和文件哈希已缓存且文件未变时放入 'metadata' / 'sha256'，
+    否则交给后台任务，完成后快照会自动刷新。
+    """
+    started = time.perf_counter()
+    base_names = {}
+    catalog = get_catalog()
+    cached_meta = catalog.folder_metadata(path)
+    cached_hashes = catalog.folder_hashes(path)
+    stale_meta = []
+    stale_hashes = []
+    meta_hits = hash_hits = 0
+    for rec in catalog.folder_records(path, force=refresh):
+        info = {'folder_path': path}  # 没有模型文件的视频、图片也需要（视频任务键、拼图位置）
+        if rec["model"]:
+            info['model'] = rec["model"]
+            if rec["model_ext"] == '.safetensors' and rec["size"] is not None:
+                cached = cached_meta.get(rec["model"])
+                if cached and cached[0] == rec["size"] and cached[1] == rec["mtime_ns"]:
+                    meta_hits += 1
+                    if cached[2]:
+                        info['metadata'] = cached[2]
+                else:
+                    stale_meta.append((rec["model"], rec["size"], rec["mtime_ns"]))
+            if rec["size"] is not None:
+                cached = cached_hashes.get(rec["model"])
+                if cached and cached[0] == rec["size"] and cached[1] == rec["mtime_ns"]:
+                    hash_hits += 1
+                    info['sha256'] = cached[2]
+                elif not hash_service.backing_off(path, rec["model"], rec["size"], rec["mtime_ns"]):
+                    stale_hashes.append((rec["model"], rec["size"], rec["mtime_ns"]))
+            info['model_ext'] = rec["model_ext"]  # 保存模型文件扩展名
+            info['size'] = rec["size"]  # 字节数（查找重复文件用）
+            info['mtime_ns'] = rec["mtime_ns"]
+            if rec["ctime"] is not None:
+                info['created_time'] = datetime.fromtimestamp(rec["ctime"]).strftime("%Y-%m-%d %H:%M")
+                info['file_size'] = format_size_mb(rec["size"])
+            else:
+                info['created_time'] = "未知"
+                info['file_size'] = "未知"
+        if rec["text"]:
+            info['text'] = rec["text"]
+            info['text_content'] = rec["text_content"] or ""  # 仅为预览，完整内容见 /api/text
+            info['needs_collapse'] = bool(rec["text_more"])
+        if rec["image"]:
+            info['image'] = rec["image"]
+        if rec["video"]:
+            info['video'] = rec["video"]
             # 为视频文件生成缩略图
-            thumbnail_path = get_video_thumbnail(full_path)
+            thumbnail_path = get_video_thumbnail(os.path.join(path, rec["video"]))
             if thumbnail_path:
-                base_names[name]['thumbnail'] = os.path.join(THUMBNAIL_DIR, f"{os.path.splitext(orig_name)[0]}.jpg")
+                info['thumbnail'] = os.path.join(THUMBNAIL_DIR, f"{os.path.splitext(rec['video'])[0]}.jpg")
+        base_names[rec["base"]] = info
 
+    metrics.cache("metadata", True, meta_hits)
+    metrics.cache("metadata", False, len(stale_meta))
+    metrics.cache("hash", True, hash_hits)
+    metrics.cache("hash", False, len(stale_hashes))
+    if stale_meta and _schedule_background.get():
+        metadata_extractor.request(path, stale_meta)
+    if stale_hashes and _schedule_background.get():
+        hash_service.request(path, stale_hashes)
+    add_timing("group", time.perf_counter() - started)
     return base_names
 
 # ========================
-# 生成 HTML 页面
+# 文件变化监听
 # ========================
 
-def generate_html(current_folder_name=""):
-    folder_map = scan_folders()
-    if not folder_map:
-        return "<h1>未找到任何子文件夹或根目录不可访问</h1>".encode('utf-8')
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
 
-    current_path = folder_map.get(current_folder_name, FOLDER)
-    is_root = (current_path == FOLDER and current_folder_name == ROOT_NAME) if INCLUDE_ROOT else False
-    base_names = group_files_in(current_path)
-    total = len(base_names)
-    current_encoded = quote(current_folder_name)
+def load_inotify():
+    """Linux 下通过 ctypes 加载 inotify，其它平台返回 None（使用轮询）"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        return libc
+    except (OSError, AttributeError):
+        return None
 
-    # 导航链接
-    nav_items = []
-    for name in sorted(folder_map.keys()):
-        active = 'style="font-weight:bold;color:#007acc;"' if name == current_folder_name or (is_root and name == ROOT_NAME) else ''
-        encoded_name = quote(name)
-        nav_items.append(f'<a href="/?dir={encoded_name}" {active}>{name}</a>')
-    nav_html = " | ".join(nav_items)
+class FolderWatcher:
+    """后台线程维护目录列表和各目录的模型分组快照
 
-    # 开始构建 HTML
-    html = f"""
-    <html>
-    <head>
-        <title>Lora Models Viewer</title>
-        <meta charset="UTF-8">
-        <style>
+    Linux 使用 inotify，其它平台按 WATCH_POLL_INTERVAL 轮询目录修改时间。
+    请求处理时只读取内存中的快照，不访问磁盘。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.folder_map = {}
+        self.models = {}
+        self.refreshing = set()  # 正在重新分组的目录
+        self.dirty = set()  # 分组期间被标记为已变化、需要再刷新一次的目录
+        self.thread = None
+        self.backend = "polling"
+
+    def start(self):
+        self.rebuild_folders()
+        target = None
+        libc = load_inotify()
+        if libc is not None:
+            fd = libc.inotify_init1(os.O_NONBLOCK | getattr(os, "O_CLOEXEC", 0))
+            if fd >= 0:
+                self.backend = "inotify"
+                wds = {}
+                self.add_watches(libc, fd, wds)
+                target = lambda: self.run_inotify(libc, fd, wds)
+        if target is None:
+            mtimes = self.dir_mtimes()
+            target = lambda: self.run_polling(mtimes)
+
+        # 先建立监听（轮询时先记录目录修改时间）再做首次分组，分组期间发生的改动不会漏掉
+        for path in self.watched_paths():
+            self.refresh(path)
+        self.thread = threading.Thread(target=target, name="lora-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def watched_paths(self):
+        paths = set(self.folder_map.values())
+        paths.add(FOLDER)
+        return paths
+
+    def rebuild_folders(self):
+        self.set_folder_map(scan_folders())
+
+    def update_subdirs(self, changed):
+        """只重新列出修改时间变化的目录：移除消失的子目录分支，扫描新出现的子目录分支
+
+        目录的修改时间只随直接子项的增删改名变化，未变化的子目录保持原样，不必重新扫描整个 FOLDER。
+        """
+        with self.lock:
+            folder_map = dict(self.folder_map)
+        rel_of = {path: rel for rel, path in folder_map.items() if path != FOLDER}
+        rel_of[FOLDER] = ""
+
+        def children(rel):
+            prefix = f"{rel}/" if rel else ""
+            return {r[len(prefix):] for r, p in folder_map.items()
+                    if p != FOLDER and r.startswith(prefix) and "/" not in r[len(prefix):]}
+
+        listings = {}  # 显示名 -> {子目录名: 目录标识}
+        for path in sorted(changed, key=len):  # 先处理上级目录
+            rel = rel_of.get(path)
+            if rel is None or (rel and rel not in folder_map):
+                continue  # 不是已知目录，或已随上级目录一起移除
+            if (rel.count("/") + 1 if rel else 0) >= SCAN_MAX_DEPTH:
+                continue  # 超过扫描深度的目录本来就不列出子目录
+            listings[rel] = dict(list_subdirs(path))
+            for name in children(rel) - listings[rel].keys():
+                gone = f"{rel}/{name}" if rel else name
+                for r in [r for r in folder_map if r == gone or r.startswith(gone + "/")]:
+                    del folder_map[r]
+
+        # 删除完成后再收集标识，这样从一处移动到另一处的目录不会被当作重复目录跳过
+        seen = set()
+        for path in set(folder_map.values()) | {FOLDER}:
+            try:
+                seen.add(dir_identity(path))
+            except OSError:
+                pass
+        for rel, listing in listings.items():
+            depth = rel.count("/") + 1 if rel else 0
+            for name in listing.keys() - children(rel):
+                if listing[name] in seen:
+                    continue
+                seen.add(listing[name])
+                child_rel = f"{rel}/{name}" if rel else name
+                child_path = os.path.join(FOLDER, *child_rel.split("/"))
+                folder_map[child_rel] = child_path
+                if depth + 1 < SCAN_MAX_DEPTH:
+                    scan_tree(child_rel, child_path, depth + 1, seen, folder_map)
+        self.set_folder_map(folder_map)
+
+    def set_folder_map(self, folder_map):
+        with self.lock:
+            self.folder_map = folder_map
+            live = set(folder_map.values()) | {FOLDER}
+            for path in list(self.models):
+                if path not in live:
+                    del self.models[path]
+
+    def refresh(self, path, force=False):
+        """重新分组一个目录（通过 SQLite 目录缓存，只处理有变化的文件）"""
+        with self.lock:
+            self.refreshing.add(path)
+            self.dirty.discard(path)
+        try:
+            models = group_files_in(path, refresh=force)
+            with self.lock:
+                self.models[path] = models
+        finally:
+            with self.lock:
+                self.refreshing.discard(path)
+                again = path in self.dirty
+        if again:
+            self.refresh(path, force=True)
+
+    def mark_dirty(self, path, force=True):
+        """其它后台任务（如缩略图生成、元数据提取）改变了目录内容或缓存时调用"""
+        with self.lock:
+            if path in self.refreshing:
+                # 分组结果可能已经过时，等当前分组完成后再刷新一次
+                self.dirty.add(path)
+                return
+            known = path in self.models
+        if known:
+            self.refresh(path, force=force)
+
+    def get_models(self, path):
+        """目录的分组快照；读取快照的耗时计入 Server-Timing 的 group（快照缺失时由 group_files_in 计时）"""
+        started = time.perf_counter()
+        with self.lock:
+            models = self.models.get(path)
+        if models is None:
+            return group_files_in(path)
+        add_timing("group", time.perf_counter() - started)
+        return models
+
+    def periodic_recheck(self, last):
+        """定期让目录缓存核对一次文件，捕获不改变目录修改时间的原地编辑"""
+        if CATALOG_RECHECK_SECONDS > 0 and time.time() - last >= CATALOG_RECHECK_SECONDS:
+            for path in self.watched_paths():
+                self.refresh(path)
+            return time.time()
+        return last
+
+    def dir_mtimes(self):
+        mtimes = {}
+        for path in self.watched_paths():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def run_polling(self, mtimes):
+        last_recheck = time.time()
+        while not self.stop_event.wait(WATCH_POLL_INTERVAL):
+            try:
+                current = self.dir_mtimes()
+                if current != mtimes:
+                    # 有变化的目录可能新建/删除了子文件夹：只重新列出这些目录，新出现的分支再向下扫描
+                    self.update_subdirs({path for path, mtime in current.items()
+                                         if mtime is not None and mtime != mtimes.get(path)})
+                    current = self.dir_mtimes()
+                for path, mtime in current.items():
+                    if mtime != mtimes.get(path):
+                        self.refresh(path)
+                mtimes = current
+                last_recheck = self.periodic_recheck(last_recheck)
+            except Exception as e:
+                print(f"目录监听异常: {e}")
+
+    def add_watches(self, libc, fd, wds):
+        """为尚未监听的目录添加 inotify 监听，wds 为 {监听描述符: 目录}"""
+        known = set(wds.values())
+        for path in self.watched_paths():
+            if path not in known:
+                wd = libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK)
+                if wd >= 0:
+                    wds[wd] = path
+
+    def run_inotify(self, libc, fd, wds):
+        def read_events():
+            """读取所有待处理事件，返回 (有变化的目录, 子目录是否增删)"""
+            dirty = set()
+            folders_changed = False
+            while True:
+                try:
+                    data = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    return dirty, folders_changed
+                offset = 0
+                while offset + header <= len(data):
+                    wd, mask, _cookie, length = struct.unpack_from("iIII", data, offset)
+                    offset += header + length
+                    path = wds.get(wd)
+                    if path is None:
+                        continue
+                    if mask & IN_IGNORED:
+                        del wds[wd]
+                        folders_changed = True
+                        continue
+                    if mask & (IN_ISDIR | IN_DELETE_SELF | IN_MOVE_SELF):
+                        folders_changed = True
+                    dirty.add(path)
+
+        header = struct.calcsize("iIII")
+        last_recheck = time.time()
+        try:
+            while not self.stop_event.is_set():
+                ready, _, _ = select.select([fd], [], [], 1.0)
+                if not ready:
+                    last_recheck = self.periodic_recheck(last_recheck)
+                    continue
+                time.sleep(0.05)  # 合并同一次复制/保存产生的多个事件
+                dirty, folders_changed = read_events()
+                try:
+                    if folders_changed:
+                        self.rebuild_folders()
+                        self.add_watches(libc, fd, wds)
+                    watched = self.watched_paths()
+                    for path in dirty & watched:
+                        self.refresh(path, force=True)
+                except Exception as e:
+                    print(f"目录监听异常: {e}")
+        finally:
+            os.close(fd)
+
+_watcher = None
+
+def start_watcher():
+    global _watcher
+    if WATCH_ENABLED and _watcher is None:
+        _watcher = FolderWatcher()
+        _watcher.start()
+        print(f"   目录监听: {_watcher.backend}（新增或修改的 lora 会自动出现在页面中）")
+    return _watcher
+
+def current_folder_map():
+    """当前目录列表：监听器运行时直接返回内存快照（读取快照的耗时同样计入 Server-Timing 的 scan）"""
+    if _watcher is not None:
+        started = time.perf_counter()
+        folder_map = _watcher.folder_map
+        add_timing("scan", time.perf_counter() - started)
+        return folder_map
+    return scan_folders()
+
+def folder_models(path):
+    """目录中的模型分组：监听器运行时直接返回内存快照"""
+    if _watcher is not None:
+        return _watcher.get_models(path)
+    return group_files_in(path)
+
+# ========================
+# 模型列表索引（含“全部”视图的合并索引）
+# ========================
+
+_listing_cache = {}
+_listing_lock = threading.Lock()
+
+def is_aggregate_view(folder_name):
+    """ROOT_NAME（“全部”）显示整个模型库，而不只是 FOLDER 根目录下的文件"""
+    return INCLUDE_ROOT and folder_name == ROOT_NAME
+
+def folder_rows(folder_name, path):
+    """单个目录按名称排序的 [(模型名, 目录名, 分组信息)]；同一份快照只排序一次"""
+    models = folder_models(path)
+    sprite_atlas.lookup(path, models)
+    with _listing_lock:
+        cached = _listing_cache.get(path)
+        if cached is not None and cached[0] is models and cached[1] == folder_name:
+            return cached[2]
+    rows = [(name, folder_name, models[name]) for name in sorted(models)]
+    with _listing_lock:
+        _listing_cache[path] = (models, folder_name, rows)
+    return rows
+
+def merged_rows(folder_map):
+    """合并所有目录已排序的分组结果（不重新扫描磁盘），返回 (行列表, 各目录模型数)"""
+    per_folder = []
+    for folder_name, path in sorted(folder_map.items()):
+        per_folder.append((folder_name, folder_rows(folder_name, path)))
+
+    key = tuple((label, id(rows)) for label, rows in per_folder)
+    with _listing_lock:
+        cached = _listing_cache.get(("merged",))
+        if cached is not None and cached[0] == key:
+            return cached[1], cached[2]
+
+    rows = list(heapq.merge(*(rows for _, rows in per_folder), key=lambda row: (row[0], row[1])))
+    counts = {label: len(rows_) for label, rows_ in per_folder if rows_}
+    with _listing_lock:
+        # 同时保存各目录行列表的引用，保证 id() 在缓存有效期内不会被复用
+        _listing_cache[("merged",)] = (key, rows, counts, per_folder)
+    return rows, counts
+
+def listing_rows(folder_name):
+    """页面与 /api/models 使用的模型行：普通目录为单目录结果，“全部”为合并索引"""
+    folder_map = current_folder_map()
+    if is_aggregate_view(folder_name):
+        return merged_rows(folder_map)
+    rows = folder_rows(folder_name, folder_map.get(folder_name, FOLDER))
+    return rows, None
+
+def folder_counts_html(counts, extra_query=""):
+    """“全部”视图顶部的各目录模型数"""
+    links = [f'<a href="/?dir={quote(name)}{extra_query}">{name}</a> ({count})'
+             for name, count in sorted(counts.items())]
+    return f"<p class='folder-counts'>{' · '.join(links)}</p>"
+
+# ========================
+# 重复文件报告
+# ========================
+
+_sample_hashes = {}  # 文件路径 -> (大小, mtime_ns, 首尾采样哈希)
+_sample_hashes_lock = threading.Lock()
+
+def sample_hash(path, size, mtime_ns):
+    """文件开头和结尾各 DUPLICATE_SAMPLE_BYTES 字节的哈希（safetensors 的文件头就在开头）"""
+    with _sample_hashes_lock:
+        cached = _sample_hashes.get(path)
+    if cached and cached[0] == size and cached[1] == mtime_ns:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        digest.update(f.read(DUPLICATE_SAMPLE_BYTES))
+        if size > DUPLICATE_SAMPLE_BYTES * 2:
+            f.seek(size - DUPLICATE_SAMPLE_BYTES)
+        digest.update(f.read(DUPLICATE_SAMPLE_BYTES))
+    value = digest.hexdigest()
+    with _sample_hashes_lock:
+        _sample_hashes[path] = (size, mtime_ns, value)
+    return value
+
+def find_duplicates():
+    """在整个模型库中查找内容相同的模型文件
+
+    依次按文件大小、首尾采样哈希、完整 SHA-256 分组，只有前一步仍然相同的文件才进入下一步，
+    绝大多数文件只用到内存快照中的大小。完整哈希来自后台哈希服务，尚未算完的组标记为“待确认”，
+    并提交给哈希服务。返回按可回收空间从大到小排列的分组。
+    """
+    by_size = {}
+    for folder_name, path in current_folder_map().items():
+        for name, files in folder_models(path).items():
+            if files.get('model') and files.get('size'):
+                entry = {"folder": folder_name, "name": name, "file": files['model'],
+                         "path": os.path.join(path, files['model']), "folder_path": path,
+                         "size": files['size'], "mtime_ns": files.get('mtime_ns'),
+                         "sha256": files.get('sha256')}
+                by_size.setdefault(files['size'], []).append(entry)
+
+    groups = []
+    for size, entries in by_size.items():
+        if len(entries) < 2:
+            continue
+        by_sample = {}
+        for entry in entries:
+            try:
+                key = sample_hash(entry["path"], size, entry["mtime_ns"])
+            except OSError:
+                continue
+            by_sample.setdefault(key, []).append(entry)
+
+        for candidates in by_sample.values():
+            if len(candidates) < 2:
+                continue
+            unhashed = [e for e in candidates if not e["sha256"]]
+            if unhashed:
+                # 完整哈希还没算完：采样一致，先列为待确认，并让哈希服务处理这些文件
+                for e in unhashed:
+                    hash_service.request(e["folder_path"], [(e["file"], e["size"], e["mtime_ns"])])
+                groups.append({"size": size, "sha256": None, "confirmed": False, "files": candidates})
+                continue
+            by_hash = {}
+            for e in candidates:
+                by_hash.setdefault(e["sha256"], []).append(e)
+            for sha256, same in by_hash.items():
+                if len(same) > 1:
+                    groups.append({"size": size, "sha256": sha256, "confirmed": True, "files": same})
+
+    for group in groups:
+        group["files"].sort(key=lambda e: (e["folder"], e["name"]))
+        group["reclaimable"] = group["size"] * (len(group["files"]) - 1)
+        for e in group["files"]:
+            for key in ("path", "folder_path", "mtime_ns", "sha256"):
+                e.pop(key, None)
+    groups.sort(key=lambda g: -g["reclaimable"])
+    return groups
+
+def format_size_gb(size_bytes):
+    return f"{size_bytes / (1024 ** 3):.2f}GB"
+
+# ========================
+# 生成 HTML 页面
+# ========================
+
+def page_css():
+    """页面公共样式（完整列表与虚拟列表共用）"""
+    return f"""
             body {{ font-family: "Segoe UI", Arial, sans-serif; margin: 20px; background: #f9f9fb; }}
             h1 {{ color: #444; border-bottom: 2px solid #007acc; padding-bottom: 5px; }}
             .nav-container {{
@@ -217,17 +2195,61 @@ def generate_html(current_folder_name=""):
             .nav-links {{ font-size: 1.1em; }}
             .nav-links a {{ text-decoration: none; color: #555; margin: 0 10px; }}
             .nav-links a:hover {{ color: #007acc; }}
+            .nav-group {{ display: inline-block; position: relative; }}
+            .nav-group summary {{ display: inline; cursor: pointer; }}
+            .nav-children {{
+                position: absolute;
+                z-index: 10;
+                min-width: 160px;
+                padding: 6px 10px;
+                background: white;
+                border: 1px solid #ddd;
+                border-radius: 6px;
+                box-shadow: 0 2px 6px rgba(0,0,0,0.15);
+                white-space: nowrap;
+                font-size: 0.95em;
+            }}
+            .nav-children .nav-group {{ display: block; }}
+            .nav-children .nav-children {{ position: static; border: none; box-shadow: none; padding: 0 0 0 14px; }}
             .search-box {{
                 display: flex;
                 align-items: center;
             }}
             #searchInput {{
                 padding: 6px 10px;
-                width: 200px;
+                width: 260px;
                 border: 1px solid #ccc;
                 border-radius: 4px;
                 font-size: 0.9em;
             }}
+            .search-box {{ position: relative; }}
+            #searchResults {{
+                display: none;
+                position: absolute;
+                top: 100%;
+                right: 0;
+                z-index: 20;
+                width: 480px;
+                max-height: 70vh;
+                overflow-y: auto;
+                background: white;
+                border: 1px solid #ddd;
+                border-radius: 6px;
+                box-shadow: 0 2px 8px rgba(0,0,0,0.2);
+            }}
+            #searchResults.open {{ display: block; }}
+            #searchResults a {{
+                display: block;
+                padding: 8px 12px;
+                border-bottom: 1px solid #eee;
+                color: #333;
+                text-decoration: none;
+            }}
+            #searchResults a:hover {{ background: #f5f8ff; }}
+            #searchResults .result-folder {{ color: #8a6d3b; font-size: 0.85em; margin-left: 8px; }}
+            #searchResults .result-snippet {{ color: #666; font-size: 0.85em; margin-top: 2px; }}
+            #searchResults .result-meta {{ color: #999; font-size: 0.8em; padding: 6px 12px; }}
+            #searchResults mark {{ background: #ffe58a; padding: 0; }}
             .item {{
                 border: 1px solid #ddd;
                 padding: 16px;
@@ -259,6 +2281,12 @@ def generate_html(current_folder_name=""):
                 max-height: 100%;
                 object-fit: contain;
             }}
+            .thumb-pane .sprite {{
+                width: {THUMBNAIL_WIDTH}px;
+                height: {THUMBNAIL_HEIGHT}px;
+                flex-shrink: 0;
+                background-repeat: no-repeat;
+            }}
             .video-indicator {{
                 position: absolute;
                 top: 5px;
@@ -307,6 +2335,12 @@ def generate_html(current_folder_name=""):
                 font-weight: bold;
                 margin-right: 8px;
             }}
+            .model-info .model-folder {{
+                color: #8a6d3b;
+                margin-right: 8px;
+            }}
+            .folder-counts {{ font-size: 0.9em; color: #666; }}
+            .folder-counts a {{ color: #555; }}
             .model-info .created-time {{
                 color: #6c757d;
             }}
@@ -397,8 +2431,51 @@ def generate_html(current_folder_name=""):
                 z-index: 1001;
             }}
             .modal .close:hover {{ color: #bbb; }}
-        </style>
-        <script>
+
+            /* 虚拟列表：只渲染可见行，DOM 大小与模型数量无关 */
+            #virtualList {{ position: relative; }}
+            .virtual-row {{
+                position: absolute;
+                left: 0;
+                right: 0;
+                height: {VIRTUAL_ROW_HEIGHT - 20}px;
+                box-sizing: border-box;
+                overflow: hidden;
+            }}
+            .model-meta {{
+                font-size: 0.85em;
+                color: #555;
+                margin: -4px 0 6px;
+                white-space: nowrap;
+                overflow: hidden;
+                text-overflow: ellipsis;
+            }}
+            .model-meta .meta-base {{
+                background: #e8f0fe;
+                color: #1a56b0;
+                border-radius: 3px;
+                padding: 1px 6px;
+                margin-right: 6px;
+            }}
+            .model-meta .meta-rank {{ margin-right: 6px; }}
+            .model-meta .meta-hash {{
+                font-family: monospace;
+                color: #777;
+                margin-right: 6px;
+                cursor: help;
+            }}
+            .model-meta .meta-tag {{
+                background: #f0f0f0;
+                border-radius: 3px;
+                padding: 1px 5px;
+                margin-right: 4px;
+            }}
+            .virtual-row .text-content {{ max-height: {MAX_VISIBLE_LINES * LINE_HEIGHT}px; }}
+            .view-switch {{ margin-left: 10px; font-size: 0.9em; }}"""
+
+def page_script():
+    """页面公共脚本：大图/视频模态框、搜索过滤、文本折叠、视频缩略图轮询"""
+    return f"""
             let currentModalSrc = null;
 
             function showModal(src, isVideo = false) {{
@@ -461,6 +2538,20 @@ def generate_html(current_folder_name=""):
 
             function toggleText(btn, textId) {{
                 const textElement = document.getElementById(textId);
+                if (textElement.classList.contains('collapsed') && !textElement.dataset.loaded) {{
+                    // 页面只带预览，第一次展开时再加载完整说明
+                    btn.textContent = '加载中...';
+                    fetch(textElement.dataset.textUrl)
+                        .then(r => r.json())
+                        .then(data => {{
+                            if (data.text === undefined) throw new Error(data.error);
+                            textElement.querySelector('.text-body').textContent = data.text;
+                            textElement.dataset.loaded = '1';
+                            toggleText(btn, textId);
+                        }})
+                        .catch(() => {{ btn.textContent = '加载失败，点击重试'; }});
+                    return;
+                }}
                 if (textElement.classList.contains('collapsed')) {{
                     textElement.classList.remove('collapsed');
                     textElement.classList.add('expanded');
@@ -472,99 +2563,283 @@ def generate_html(current_folder_name=""):
                 }}
             }}
 
+            // 回车时在整个模型库的模型名与 .txt 说明中搜索
+            function searchLibrary() {{
+                const input = document.getElementById('searchInput');
+                const panel = document.getElementById('searchResults');
+                const q = input.value.trim();
+                if (!q) {{
+                    panel.classList.remove('open');
+                    return;
+                }}
+                fetch('/api/search?q=' + encodeURIComponent(q))
+                    .then(r => r.json())
+                    .then(data => {{
+                        const rows = data.items.map(item =>
+                            '<a href="/?dir=' + encodeURIComponent(item.folder) + '&q=' + encodeURIComponent(item.name) + '">'
+                            + '<strong>' + item.name_html + '</strong>'
+                            + '<span class="result-folder">📂 ' + item.folder.replace(/&/g, '&amp;').replace(/</g, '&lt;') + '</span>'
+                            + (item.snippet ? '<div class="result-snippet">' + item.snippet + '</div>' : '')
+                            + '</a>');
+                        const shown = data.has_more ? '，显示前 ' + data.items.length + ' 条' : '';
+                        const meta = '<div class="result-meta">全库搜索：' + data.total + ' 条结果' + shown + '（' + data.took_ms + ' ms）</div>';
+                        panel.innerHTML = meta + rows.join('');
+                        panel.classList.add('open');
+                    }});
+            }}
+
+            function setupLibrarySearch(onInput) {{
+                const input = document.getElementById('searchInput');
+                const initial = new URLSearchParams(location.search).get('q');
+                if (initial) input.value = initial;
+                input.focus();
+                input.addEventListener('input', onInput);
+                input.addEventListener('keydown', e => {{
+                    if (e.key === 'Enter') searchLibrary();
+                    if (e.key === 'Escape') document.getElementById('searchResults').classList.remove('open');
+                }});
+                document.addEventListener('click', e => {{
+                    if (!e.target.closest('.search-box')) document.getElementById('searchResults').classList.remove('open');
+                }});
+                if (initial) onInput();
+            }}
+
+            // 轮询视频缩略图任务，完成后替换占位内容
+            function pollVideoThumbnails() {{
+                const pending = document.querySelectorAll('.video-pending');
+                if (!pending.length) return;
+                const dir = new URLSearchParams(location.search).get('dir') || '';
+                fetch('/api/thumbnails?dir=' + encodeURIComponent(dir))
+                    .then(r => r.json())
+                    .then(data => {{
+                        pending.forEach(el => {{
+                            const job = data.jobs[el.dataset.video];
+                            if (!job) {{
+                                const pane = el.parentElement;
+                                pane.innerHTML = '<img src="' + el.dataset.thumb + '" alt="视频缩略图"><div class="video-indicator">🎥</div>';
+                            }} else if (job.status === 'failed') {{
+                                el.classList.remove('video-pending');
+                                el.querySelector('.pending-text').textContent = '缩略图生成失败';
+                            }}
+                        }});
+                        setTimeout(pollVideoThumbnails, 2000);
+                    }})
+                    .catch(() => setTimeout(pollVideoThumbnails, 5000));
+            }}
+
             window.onload = () => {{
-                document.getElementById('searchInput').focus();
-                document.getElementById('searchInput').addEventListener('input', filterModels);
-            }};
-        </script>
+                setupLibrarySearch(filterModels);
+                setTimeout(pollVideoThumbnails, 1000);
+            }};"""
+
+def build_folder_tree(folder_map):
+    """把 a/b/c 形式的目录名整理为嵌套字典"""
+    tree = {}
+    for name in folder_map:
+        if INCLUDE_ROOT and name == ROOT_NAME:
+            continue
+        node = tree
+        for part in name.split("/"):
+            node = node.setdefault(part, {})
+    return tree
+
+def build_nav_html(folder_map, current_folder_name, is_root, extra_query=""):
+    """导航链接：顶层目录横向排列，含子目录的项可展开为树"""
+    def link(name, label):
+        active = 'style="font-weight:bold;color:#007acc;"' if name == current_folder_name or (is_root and name == ROOT_NAME) else ''
+        encoded_name = quote(name)
+        return f'<a href="/?dir={encoded_name}{extra_query}" {active}>{label}</a>'
+
+    def render(name, label, children):
+        if not children:
+            return link(name, label)
+        is_open = " open" if current_folder_name.startswith(name + "/") else ""
+        inner = "".join(f"<div>{render(f'{name}/{part}', part, children[part])}</div>" for part in sorted(children))
+        return (f'<details class="nav-group"{is_open}><summary>{link(name, label)}</summary>'
+                f'<div class="nav-children">{inner}</div></details>')
+
+    tree = build_folder_tree(folder_map)
+    top_level = sorted(list(tree) + ([ROOT_NAME] if INCLUDE_ROOT and ROOT_NAME in folder_map else []))
+    nav_items = [link(name, name) if name not in tree else render(name, name, tree[name]) for name in top_level]
+    return " | ".join(nav_items)
+
+def metadata_html(meta, sha256=None):
+    """元数据摘要行（AutoV2 哈希、底模、rank/alpha、训练标签）；内容来自模型文件，需要转义"""
+    if not meta and not sha256:
+        return ""
+    meta = meta or {}
+    parts = ["<div class='model-meta'>"]
+    if sha256:
+        parts.append(f"<span class='meta-hash' title='SHA256: {sha256}'>{autov2_hash(sha256)}</span>")
+    if meta.get("base_model"):
+        parts.append(f"<span class='meta-base'>{html.escape(meta['base_model'])}</span>")
+    if meta.get("dim"):
+        rank = f"dim {html.escape(meta['dim'])}"
+        if meta.get("alpha"):
+            rank += f" / alpha {html.escape(meta['alpha'])}"
+        parts.append(f"<span class='meta-rank'>{rank}</span>")
+    for tag in meta.get("tags", []):
+        parts.append(f"<span class='meta-tag'>{html.escape(tag)}</span>")
+    parts.append("</div>")
+    return "".join(parts)
+
+def render_model_card(name, files, current_encoded, folder_label=None, card_index=None):
+    """单个模型卡片的 HTML；folder_label 用于“全部”视图中显示所在目录"""
+    parts = []
+    model_file = files.get('model', '未知模型')
+    model_ext = files.get('model_ext', '')
+    file_size = files.get('file_size', '未知')
+    image_file = files.get('image')
+    video_file = files.get('video')
+    thumbnail_file = files.get('thumbnail')
+    text_file = files.get('text')
+    text_content = files.get('text_content', '')
+    needs_collapse = files.get('needs_collapse', False)
+    created_time = files.get('created_time', '未知')
+
+    # ========== 决定缩略图和点击行为 ==========
+    has_image = bool(image_file)
+    has_video = bool(video_file)
+    has_thumbnail = bool(thumbnail_file)
+
+    params = f"?dir={current_encoded}" if current_encoded else ""
+    sprite = sprite_tile(files, unquote(current_encoded))
+
+    if has_image:
+        # 列表中显示缩小后的缩略图（或拼图中的对应格子），点击后才加载原图
+        file_url = f"/file/{quote(image_file)}{params}"
+        thumb_url = f"/thumb/{quote(image_file)}{params}"
+        if sprite:
+            thumb_html = f'<div class="sprite" role="img" aria-label="预览图" style="{sprite_style(sprite)}"></div>'
+        else:
+            thumb_html = f'<img src="{thumb_url}" alt="预览图" loading="lazy">'
+        click_handler = f"showModal('{file_url}', false)"
+    elif has_thumbnail:
+        # 使用视频缩略图
+        file_url = f"/file/{quote(thumbnail_file)}{params}"
+        if sprite:
+            thumb_html = f'<div class="sprite" role="img" aria-label="视频缩略图" style="{sprite_style(sprite)}"></div>'
+        else:
+            thumb_html = f'<img src="{file_url}" alt="视频缩略图">'
+        thumb_html += '<div class="video-indicator">🎥</div>'
+        video_url = f"/file/{quote(video_file)}{params}"
+        click_handler = f"showModal('{video_url}', true)"
+    elif has_video:
+        # 视频文件但还没有缩略图：页面轮询任务状态，生成后自动替换
+        video_url = f"/file/{quote(video_file)}{params}"
+        pending_thumb_url = f"/file/{quote(THUMBNAIL_DIR)}/{quote(os.path.splitext(video_file)[0])}.jpg{params}"
+        video_key = video_job_key(os.path.join(files['folder_path'], video_file))
+        thumb_html = (f'<div class="video-pending" data-video="{html.escape(video_key, quote=True)}" '
+                      f'data-thumb="{html.escape(pending_thumb_url, quote=True)}">'
+                      '<span class="play-icon">▶</span><br><span class="pending-text">生成缩略图中...</span></div>')
+        click_handler = f"showModal('{video_url}', true)"
+    else:
+        thumb_html = '<span class="missing">📷 无预览</span>'
+        click_handler = "alert('该模型没有关联的图片或视频文件。')"
+
+    # ========== 输出模型项 ==========
+    parts.append(f"<div class='item' data-model-name='{name}'>")
+    parts.append(f"<div class='thumb-pane' onclick=\"{click_handler}\">{thumb_html}</div>")
+    parts.append("<div class='content-pane'>")
+
+    parts.append(f"<div class='header-row'>")
+    parts.append(f"<h2>{name}</h2>")
+    folder_html = f"<span class='model-folder'>📂 {folder_label}</span>" if folder_label else ""
+    parts.append(f"<span class='model-info'>{folder_html}<span class='file-size'>{file_size}</span><span class='file-ext'>{model_ext.upper()}</span> | <span class='created-time'>创建: {created_time}</span></span>")
+    parts.append("</div>")
+    parts.append(metadata_html(files.get('metadata'), files.get('sha256')))
+
+    # 移除了重复的文件名显示行
+
+    if text_file:
+        text_id = f"text-{name.replace(' ', '-').lower()}"
+        if card_index is not None:
+            text_id += f"-{card_index}"  # “全部”视图中不同目录可能有同名模型
+        collapse_class = "collapsed" if needs_collapse else "expanded"
+        btn_text = "展开完整说明" if needs_collapse else "收起说明"
+        
+        text_url = f"/api/text?dir={current_encoded}&name={quote(name)}"
+        parts.append(f"<div id='{text_id}' class='text-content {collapse_class}' data-text-url='{text_url}'>")
+        parts.append(f"<span class='text-body'>{text_content}</span>")
+        if needs_collapse:
+            parts.append('<div class="text-fade"></div>')
+        parts.append("</div>")
+        
+        if needs_collapse:
+            parts.append(f"<button class='toggle-text-btn' onclick=\"toggleText(this, '{text_id}')\">{btn_text}</button>")
+    else:
+        parts.append("<p><em>📝 无描述文件 (.txt)</em></p>")
+
+    parts.append("</div></div>")
+
+    return "".join(parts)
+
+def iter_html(current_folder_name=""):
+    """逐段生成页面：先输出页头（样式、脚本），再按 HTML_STREAM_BATCH 个一批输出模型卡片
+
+    目录扫描和分组在输出页头之前完成，流式发送时这两段耗时可以放在响应头的 Server-Timing 中。
+    """
+    folder_map = current_folder_map()
+    if not folder_map:
+        yield "<h1>未找到任何子文件夹或根目录不可访问</h1>"
+        return
+
+    current_path = folder_map.get(current_folder_name, FOLDER)
+    is_root = (current_path == FOLDER and current_folder_name == ROOT_NAME) if INCLUDE_ROOT else False
+    aggregate = is_aggregate_view(current_folder_name)
+    rows, counts = listing_rows(current_folder_name)
+
+    yield f"""
+    <html>
+    <head>
+        <title>Lora Models Viewer</title>
+        <meta charset="UTF-8">
+        <link rel="stylesheet" href="{static_url('app.css')}">
+        <script src="{static_url('app.js')}"></script>
     </head>
     <body>
         <h1>📁 Lora Models Browser</h1>
+"""
 
+    total = len(rows)
+    current_encoded = quote(current_folder_name)
+    nav_html = build_nav_html(folder_map, current_folder_name, is_root)
+    location = f"{current_path}（含全部子文件夹）" if aggregate else current_path
+
+    yield f"""
         <!-- 导航 + 搜索 -->
         <div class="nav-container">
             <div class="nav-links">{nav_html}</div>
             <div class="search-box">
-                <input type="text" id="searchInput" placeholder="🔍 搜索模型..." autocomplete="off">
+                <input type="text" id="searchInput" placeholder="🔍 搜索模型...（回车搜索全部说明）" autocomplete="off">
+                <div id="searchResults"></div>
             </div>
         </div>
 
-        <p><strong>当前目录:</strong> {current_path} &nbsp;|&nbsp; 共 <strong>{total}</strong> 个模型</p>
+        <p><strong>当前目录:</strong> {location} &nbsp;|&nbsp; 共 <strong>{total}</strong> 个模型
+            <a class="view-switch" href="/?dir={current_encoded}&view=virtual">切换到虚拟列表</a>
+            <a class="view-switch" href="/duplicates">重复模型</a></p>
     """
+    if counts:
+        yield folder_counts_html(counts)
 
-    if not base_names:
-        html += "<p class='empty'>此目录中没有找到任何 Lora 模型。</p>"
+    if not rows:
+        yield "<p class='empty'>此目录中没有找到任何 Lora 模型。</p>"
     else:
-        for name, files in sorted(base_names.items()):
-            model_file = files.get('model', '未知模型')
-            model_ext = files.get('model_ext', '')
-            file_size = files.get('file_size', '未知')
-            image_file = files.get('image')
-            video_file = files.get('video')
-            thumbnail_file = files.get('thumbnail')
-            text_file = files.get('text')
-            text_content = files.get('text_content', '')
-            needs_collapse = files.get('needs_collapse', False)
-            created_time = files.get('created_time', '未知')
-
-            # ========== 决定缩略图和点击行为 ==========
-            has_image = bool(image_file)
-            has_video = bool(video_file)
-            has_thumbnail = bool(thumbnail_file)
-
-            params = f"?dir={current_encoded}" if current_encoded else ""
-
-            if has_image:
-                file_url = f"/file/{quote(image_file)}{params}"
-                thumb_html = f'<img src="{file_url}" alt="预览图">'
-                click_handler = f"showModal('{file_url}', false)"
-            elif has_thumbnail:
-                # 使用视频缩略图
-                file_url = f"/file/{quote(thumbnail_file)}{params}"
-                thumb_html = f'<img src="{file_url}" alt="视频缩略图"><div class="video-indicator">🎥</div>'
-                video_url = f"/file/{quote(video_file)}{params}"
-                click_handler = f"showModal('{video_url}', true)"
-            elif has_video:
-                # 视频文件但还没有缩略图
-                video_url = f"/file/{quote(video_file)}{params}"
-                thumb_html = '<div><span class="play-icon">▶</span><br>生成缩略图中...</div>'
-                click_handler = f"showModal('{video_url}', true)"
+        batch = []
+        for index, (name, folder_name, files) in enumerate(rows):
+            if aggregate:
+                batch.append(render_model_card(name, files, quote(folder_name), folder_name, index))
             else:
-                thumb_html = '<span class="missing">📷 无预览</span>'
-                click_handler = "alert('该模型没有关联的图片或视频文件。')"
-
-            # ========== 输出模型项 ==========
-            html += f"<div class='item' data-model-name='{name}'>"
-            html += f"<div class='thumb-pane' onclick=\"{click_handler}\">{thumb_html}</div>"
-            html += "<div class='content-pane'>"
-
-            html += f"<div class='header-row'>"
-            html += f"<h2>{name}</h2>"
-            html += f"<span class='model-info'><span class='file-size'>{file_size}</span><span class='file-ext'>{model_ext.upper()}</span> | <span class='created-time'>创建: {created_time}</span></span>"
-            html += "</div>"
-
-            # 移除了重复的文件名显示行
-
-            if text_file:
-                text_id = f"text-{name.replace(' ', '-').lower()}"
-                collapse_class = "collapsed" if needs_collapse else "expanded"
-                btn_text = "展开完整说明" if needs_collapse else "收起说明"
-                
-                html += f"<div id='{text_id}' class='text-content {collapse_class}'>"
-                html += f"{text_content}"
-                if needs_collapse:
-                    html += '<div class="text-fade"></div>'
-                html += "</div>"
-                
-                if needs_collapse:
-                    html += f"<button class='toggle-text-btn' onclick=\"toggleText(this, '{text_id}')\">{btn_text}</button>"
-            else:
-                html += "<p><em>📝 无描述文件 (.txt)</em></p>"
-
-            html += "</div></div>"
+                batch.append(render_model_card(name, files, current_encoded))
+            if len(batch) >= HTML_STREAM_BATCH:
+                yield "".join(batch)
+                batch = []
+        if batch:
+            yield "".join(batch)
 
     # ========== 模态框：支持图片和视频 ==========
-    html += """
+    yield """
         <div id="mediaModal" class="modal">
             <span class="close" onclick="hideModal()">&times;</span>
             <div id="modalContent" class="modal-content"></div>
@@ -577,101 +2852,1360 @@ def generate_html(current_folder_name=""):
     </html>
     """
 
+def generate_html(current_folder_name=""):
+    return "".join(iter_html(current_folder_name)).encode('utf-8', errors='replace')
+
+def generate_duplicates_html():
+    """重复文件报告页面"""
+    groups = find_duplicates()
+    confirmed = sum(g["reclaimable"] for g in groups if g["confirmed"])
+    pending = sum(g["reclaimable"] for g in groups if not g["confirmed"])
+
+    parts = [f"""
+    <!DOCTYPE html>
+    <html lang="zh">
+    <head>
+        <meta charset="UTF-8">
+        <title>重复模型 - Lora 浏览器</title>
+        <link rel="stylesheet" href="{static_url('app.css')}">
+        <style>
+            .dup-group {{ background: white; border: 1px solid #ddd; border-radius: 8px; padding: 12px 16px; margin-bottom: 14px; }}
+            .dup-group h3 {{ margin: 0 0 8px; font-size: 1em; }}
+            .dup-group table {{ border-collapse: collapse; width: 100%; }}
+            .dup-group td {{ padding: 3px 8px; border-top: 1px solid #eee; }}
+            .dup-pending {{ color: #b36b00; }}
+            .dup-hash {{ font-family: monospace; color: #777; }}
+        </style>
+    </head>
+    <body>
+        <h1>📁 重复模型</h1>
+        <p><a href="/">← 返回</a></p>
+        <p>共 <strong>{len(groups)}</strong> 组重复文件，确认可回收 <strong>{format_size_gb(confirmed)}</strong>
+            （另有 {format_size_gb(pending)} 待完整哈希确认）</p>
+    """]
+    if not groups:
+        parts.append("<p class='empty'>没有发现重复的模型文件。</p>")
+    for group in groups:
+        if group["confirmed"]:
+            state = f"<span class='dup-hash'>{autov2_hash(group['sha256'])}</span>"
+        else:
+            state = "<span class='dup-pending'>待确认（大小与首尾内容一致，正在计算完整哈希）</span>"
+        parts.append(f"<div class='dup-group'><h3>{format_size_mb(group['size'])} × {len(group['files'])}"
+                     f" &nbsp;|&nbsp; 可回收 {format_size_mb(group['reclaimable'])} &nbsp;|&nbsp; {state}</h3><table>")
+        for e in group["files"]:
+            link = f"/?dir={quote(e['folder'])}&q={quote(e['name'])}"
+            parts.append(f"<tr><td>📂 {html.escape(e['folder'])}</td>"
+                         f"<td><a href='{link}'>{html.escape(e['file'])}</a></td></tr>")
+        parts.append("</table></div>")
+    parts.append("</body></html>")
+    return "".join(parts).encode('utf-8', errors='replace')
+
+def virtual_script():
+    """虚拟列表脚本：按滚动位置渲染可见行，数据由 /api/models 分页加载（DIR 与 total 由页面内联给出）"""
+    return f"""
+            const ROW_HEIGHT = {VIRTUAL_ROW_HEIGHT};
+            const PAGE_SIZE = {API_PAGE_SIZE};
+            const OVERSCAN = 5;
+            let query = '';
+            let pages = {{}};
+            let generation = 0;
+            let renderQueued = false;
+
+            function loadPage(p) {{
+                if (pages[p]) return;
+                pages[p] = 'loading';
+                const gen = generation;
+                const url = '/api/models?dir=' + encodeURIComponent(DIR) + '&offset=' + (p * PAGE_SIZE) +
+                            '&limit=' + PAGE_SIZE + '&q=' + encodeURIComponent(query);
+                fetch(url)
+                    .then(r => r.json())
+                    .then(data => {{
+                        if (gen !== generation) return;
+                        pages[p] = data.items;
+                        setTotal(data.total);
+                        scheduleRender();
+                    }})
+                    .catch(() => {{ if (gen === generation) delete pages[p]; }});
+            }}
+
+            function setTotal(n) {{
+                total = n;
+                document.getElementById('virtualList').style.height = (total * ROW_HEIGHT) + 'px';
+                document.getElementById('totalCount').textContent = total;
+            }}
+
+            function el(tag, className, text) {{
+                const node = document.createElement(tag);
+                if (className) node.className = className;
+                if (text !== undefined) node.textContent = text;
+                return node;
+            }}
+
+            function renderRow(item, index) {{
+                const row = el('div', 'item virtual-row');
+                row.style.top = (index * ROW_HEIGHT) + 'px';
+                if (!item) {{
+                    row.appendChild(el('div', 'thumb-pane'));
+                    return row;
+                }}
+
+                const thumb = el('div', 'thumb-pane');
+                if (item.sprite) {{
+                    const tile = el('div', 'sprite');
+                    tile.style.backgroundImage = "url('" + item.sprite.url + "')";
+                    tile.style.backgroundSize = item.sprite.size[0] + 'px ' + item.sprite.size[1] + 'px';
+                    tile.style.backgroundPosition = -item.sprite.pos[0] + 'px ' + -item.sprite.pos[1] + 'px';
+                    thumb.appendChild(tile);
+                    if (!item.image_url) thumb.appendChild(el('div', 'video-indicator', '🎥'));
+                }} else if (item.thumb_url) {{
+                    const img = el('img');
+                    img.src = item.thumb_url;
+                    img.alt = '预览图';
+                    thumb.appendChild(img);
+                    if (!item.image_url) thumb.appendChild(el('div', 'video-indicator', '🎥'));
+                }} else if (item.video_url) {{
+                    thumb.appendChild(el('span', 'play-icon', '▶'));
+                }} else {{
+                    thumb.appendChild(el('span', 'missing', '📷 无预览'));
+                }}
+                thumb.onclick = () => {{
+                    if (item.image_url) showModal(item.image_url, false);
+                    else if (item.video_url) showModal(item.video_url, true);
+                    else alert('该模型没有关联的图片或视频文件。');
+                }};
+                row.appendChild(thumb);
+
+                const content = el('div', 'content-pane');
+                const header = el('div', 'header-row');
+                header.appendChild(el('h2', '', item.name));
+                const info = el('span', 'model-info');
+                if (item.folder !== DIR) info.appendChild(el('span', 'model-folder', '📂 ' + item.folder));
+                info.appendChild(el('span', 'file-size', item.file_size));
+                info.appendChild(el('span', 'file-ext', (item.model_ext || '').toUpperCase()));
+                info.appendChild(document.createTextNode(' | '));
+                info.appendChild(el('span', 'created-time', '创建: ' + item.created_time));
+                header.appendChild(info);
+                content.appendChild(header);
+                const meta = item.metadata || {{}};
+                if (item.metadata || item.sha256) {{
+                    const line = el('div', 'model-meta');
+                    if (item.sha256) {{
+                        const hash = el('span', 'meta-hash', item.autov2);
+                        hash.title = 'SHA256: ' + item.sha256;
+                        line.appendChild(hash);
+                    }}
+                    if (meta.base_model) line.appendChild(el('span', 'meta-base', meta.base_model));
+                    if (meta.dim) line.appendChild(el('span', 'meta-rank', 'dim ' + meta.dim + (meta.alpha ? ' / alpha ' + meta.alpha : '')));
+                    (meta.tags || []).forEach(tag => line.appendChild(el('span', 'meta-tag', tag)));
+                    content.appendChild(line);
+                }}
+                if (item.has_text) {{
+                    content.appendChild(el('div', 'text-content collapsed', item.text_preview));
+                }} else {{
+                    content.appendChild(el('p', '', '📝 无描述文件 (.txt)'));
+                }}
+                row.appendChild(content);
+                return row;
+            }}
+
+            function render() {{
+                renderQueued = false;
+                const list = document.getElementById('virtualList');
+                const top = list.getBoundingClientRect().top + window.scrollY;
+                const first = Math.max(0, Math.floor((window.scrollY - top) / ROW_HEIGHT) - OVERSCAN);
+                const last = Math.min(total, Math.ceil((window.scrollY - top + window.innerHeight) / ROW_HEIGHT) + OVERSCAN);
+                const rows = [];
+                for (let i = first; i < last; i++) {{
+                    const items = pages[Math.floor(i / PAGE_SIZE)];
+                    if (!Array.isArray(items)) {{
+                        loadPage(Math.floor(i / PAGE_SIZE));
+                        rows.push(renderRow(null, i));
+                    }} else {{
+                        rows.push(renderRow(items[i % PAGE_SIZE], i));
+                    }}
+                }}
+                list.replaceChildren(...rows);
+            }}
+
+            function scheduleRender() {{
+                if (!renderQueued) {{
+                    renderQueued = true;
+                    requestAnimationFrame(render);
+                }}
+            }}
+
+            let searchTimer = null;
+            function onSearch() {{
+                clearTimeout(searchTimer);
+                searchTimer = setTimeout(() => {{
+                    query = document.getElementById('searchInput').value.toLowerCase().trim();
+                    generation++;
+                    pages = {{}};
+                    window.scrollTo(0, 0);
+                    loadPage(0);
+                }}, 200);
+            }}
+
+            window.onload = () => {{
+                setupLibrarySearch(onSearch);
+                window.addEventListener('scroll', scheduleRender, {{ passive: true }});
+                window.addEventListener('resize', scheduleRender);
+                setTotal(total);
+                render();
+            }};"""
+
+def generate_virtual_html(current_folder_name=""):
+    """虚拟列表页面：只输出页面框架，模型数据由 /api/models 按可见区域分页加载"""
+    folder_map = current_folder_map()
+    if not folder_map:
+        return "<h1>未找到任何子文件夹或根目录不可访问</h1>".encode('utf-8')
+
+    current_path = folder_map.get(current_folder_name, FOLDER)
+    is_root = (current_path == FOLDER and current_folder_name == ROOT_NAME) if INCLUDE_ROOT else False
+    rows, counts = listing_rows(current_folder_name)
+    total = len(rows)
+    current_encoded = quote(current_folder_name)
+    nav_html = build_nav_html(folder_map, current_folder_name, is_root, "&view=virtual")
+    location = f"{current_path}（含全部子文件夹）" if is_aggregate_view(current_folder_name) else current_path
+    counts_html = folder_counts_html(counts, "&view=virtual") if counts else ""
+
+    html = f"""
+    <html>
+    <head>
+        <title>Lora Models Viewer</title>
+        <meta charset="UTF-8">
+        <link rel="stylesheet" href="{static_url('app.css')}">
+        <script src="{static_url('app.js')}"></script>
+        <script>
+            const DIR = {json.dumps(current_folder_name)};
+            let total = {total};
+        </script>
+        <script src="{static_url('virtual.js')}"></script>
+    </head>
+    <body>
+        <h1>📁 Lora Models Browser</h1>
+
+        <!-- 导航 + 搜索 -->
+        <div class="nav-container">
+            <div class="nav-links">{nav_html}</div>
+            <div class="search-box">
+                <input type="text" id="searchInput" placeholder="🔍 搜索模型...（回车搜索全部说明）" autocomplete="off">
+                <div id="searchResults"></div>
+            </div>
+        </div>
+
+        <p><strong>当前目录:</strong> {location} &nbsp;|&nbsp; 共 <strong id="totalCount">{total}</strong> 个模型
+            <a class="view-switch" href="/?dir={current_encoded}&view=full">切换到完整列表</a>
+            <a class="view-switch" href="/duplicates">重复模型</a></p>
+        {counts_html}
+
+        <div id="virtualList"></div>
+
+        <div id="mediaModal" class="modal">
+            <span class="close" onclick="hideModal()">&times;</span>
+            <div id="modalContent" class="modal-content"></div>
+        </div>
+    </body>
+    </html>
+    """
+
     return html.encode('utf-8', errors='replace')
 
+# ========================
+# JSON 接口
+# ========================
+
+def model_item(name, files, folder_name):
+    """把一个模型分组转为 JSON 条目"""
+    params = f"?dir={quote(folder_name)}" if folder_name else ""
+    image_file = files.get('image')
+    video_file = files.get('video')
+    thumbnail_file = files.get('thumbnail')
+
+    if image_file:
+        thumb_url = f"/thumb/{quote(image_file)}{params}"
+    elif thumbnail_file:
+        thumb_url = f"/file/{quote(thumbnail_file)}{params}"
+    else:
+        thumb_url = None
+
+    return {
+        "name": name,
+        "folder": folder_name,
+        "model": files.get('model'),
+        "model_ext": files.get('model_ext', ''),
+        "file_size": files.get('file_size', '未知'),
+        "created_time": files.get('created_time', '未知'),
+        "image_url": f"/file/{quote(image_file)}{params}" if image_file else None,
+        "video_url": f"/file/{quote(video_file)}{params}" if video_file else None,
+        "thumb_url": thumb_url,
+        "sprite": sprite_tile(files, folder_name),
+        "has_text": bool(files.get('text')),
+        "text_preview": files.get('text_content', ''),
+        "needs_collapse": files.get('needs_collapse', False),
+        "metadata": files.get('metadata'),
+        "sha256": files.get('sha256'),
+        "autov2": autov2_hash(files['sha256']) if files.get('sha256') else None,
+    }
+
+def query_int(query, key, default, low, high):
+    value = query.get(key, [""])[0]
+    if value == "":
+        return default
+    return max(low, min(int(value), high))
+
+def api_models(query):
+    """/api/models?dir=&offset=&limit=&cursor=&q=&fields=
+
+    cursor 为上一页返回的 next_cursor（优先于 offset）；fields 为逗号分隔的字段名。
+    dir 为 ROOT_NAME 时返回整个模型库的合并列表。
+    """
+    dir_name = query.get("dir", [""])[0]
+    rows, counts = listing_rows(dir_name)
+
+    q = query.get("q", [""])[0].strip().lower()
+    if q:
+        rows = [row for row in rows if q in row[0]]
+
+    limit = query_int(query, "limit", API_PAGE_SIZE, 1, API_MAX_PAGE_SIZE)
+    cursor = query.get("cursor", [""])[0]
+    if cursor:
+        start = bisect.bisect_right([f"{name}\t{folder}" for name, folder, _ in rows], cursor)
+    else:
+        start = query_int(query, "offset", 0, 0, len(rows))
+    page = rows[start:start + limit]
+
+    items = [model_item(name, files, folder) for name, folder, files in page]
+    fields = [f for f in query.get("fields", [""])[0].split(",") if f]
+    if fields:
+        items = [{k: item[k] for k in fields if k in item} for item in items]
+
+    last = page[-1] if page else None
+    result = {
+        "folder": dir_name,
+        "total": len(rows),
+        "offset": start,
+        "limit": limit,
+        "next_cursor": f"{last[0]}\t{last[1]}" if last and start + limit < len(rows) else None,
+        "items": items,
+    }
+    if counts is not None:
+        result["folder_counts"] = counts
+    return result
+
+def api_thumbnails(query):
+    """/api/thumbnails?dir=：视频缩略图任务状态"""
+    dir_name = query.get("dir", [""])[0]
+    if not dir_name or is_aggregate_view(dir_name):
+        folder_path = None  # “全部”视图中的视频分布在各个目录
+    else:
+        folder_path = current_folder_map().get(dir_name)
+    return video_thumbnail_queue.status(folder_path)
+
+def api_hashes(query):
+    """/api/hashes?dir= 或 /api/hashes?hash=
+
+    dir：目录中各模型的 SHA-256 / AutoV2（尚未计算完的不列出）；
+    hash：按完整哈希或 AutoV2 前缀在整个模型库中查找对应的模型。
+    """
+    result = {"status": hash_service.status()}
+    prefix = query.get("hash", [""])[0].strip()
+    if prefix:
+        if not all(c in "0123456789abcdefABCDEF" for c in prefix) or len(prefix) < 6:
+            raise ValueError("hash 需为至少 6 位十六进制字符")
+        folder_names = {path: name for name, path in current_folder_map().items()}
+        result["matches"] = [
+            {"folder": folder_names.get(path), "file": name, "sha256": sha256, "autov2": autov2_hash(sha256)}
+            for path, name, sha256 in get_catalog().find_hash(prefix)]
+        return result
+
+    dir_name = query.get("dir", [""])[0]
+    models = folder_models(current_folder_map().get(dir_name, FOLDER))
+    result["folder"] = dir_name
+    result["items"] = {
+        name: {"file": files['model'], "sha256": files['sha256'], "autov2": autov2_hash(files['sha256'])}
+        for name, files in sorted(models.items()) if files.get('sha256')}
+    return result
+
+def api_duplicates(query):
+    """/api/duplicates：整个模型库中的重复模型文件，以及可回收的空间（字节）"""
+    groups = find_duplicates()
+    return {
+        "groups": groups,
+        "reclaimable": sum(g["reclaimable"] for g in groups if g["confirmed"]),
+        "reclaimable_pending": sum(g["reclaimable"] for g in groups if not g["confirmed"]),
+        "hashing": hash_service.status(),
+    }
+
+def api_text(query):
+    """/api/text?dir=&name=：读取模型的完整 .txt 说明（页面展开时加载）"""
+    dir_name = query.get("dir", [""])[0]
+    name = query.get("name", [""])[0]
+    path = current_folder_map().get(dir_name, FOLDER)
+    files = folder_models(path).get(name)
+    if not files or not files.get('text'):
+        raise LookupError(f"没有找到说明文件: {name}")
+    content, _ = read_text_file(os.path.join(path, files['text']))
+    return {"folder": dir_name, "name": name, "text": content}
+
+def highlight_terms(text, terms):
+    """HTML 转义文本，并用 <mark> 标出关键词（不区分大小写）"""
+    pattern = re.compile("|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)), re.IGNORECASE)
+    parts = []
+    pos = 0
+    for m in pattern.finditer(text):
+        parts.append(html.escape(text[pos:m.start()]))
+        parts.append(f"<mark>{html.escape(m.group())}</mark>")
+        pos = m.end()
+    parts.append(html.escape(text[pos:]))
+    return "".join(parts)
+
+def search_snippet(text, terms):
+    """截取第一个命中位置附近的说明文字作为摘要"""
+    lower = text.lower()
+    hits = [p for p in (lower.find(t) for t in terms) if p >= 0]
+    start = max(0, min(hits) - SEARCH_SNIPPET_CHARS) if hits else 0
+    end = min(len(text), start + SEARCH_SNIPPET_CHARS * 2 + max(map(len, terms)))
+    snippet = highlight_terms(" ".join(text[start:end].split()), terms)
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+def api_search(query):
+    """/api/search?q=&limit=：在整个模型库的模型名与 .txt 说明中搜索
+
+    多个关键词以空格分隔，需全部命中；返回的 name_html 与 snippet 已转义并用 <mark> 标出关键词。
+    """
+    started = time.perf_counter()
+    terms = query.get("q", [""])[0].lower().split()
+    limit = query_int(query, "limit", SEARCH_DEFAULT_LIMIT, 1, SEARCH_MAX_LIMIT)
+    items = []
+    total = 0
+    if terms:
+        folder_names = {path: name for name, path in current_folder_map().items()}
+        total = sum(n for path, n in get_catalog().count(terms).items() if path in folder_names)
+        # 多取一些，已不在目录列表中的旧记录会被过滤掉
+        for path, base, body, score in get_catalog().search(terms, limit * 2):
+            folder_name = folder_names.get(path)
+            files = folder_models(path).get(base) if folder_name is not None else None
+            if files is None:
+                continue
+            item = model_item(base, files, folder_name)
+            item["name_html"] = highlight_terms(base, terms)
+            item["snippet"] = search_snippet(body or "", terms)
+            item["score"] = round(-score, 3)
+            items.append(item)
+            if len(items) >= limit:
+                break
+    return {
+        "q": " ".join(terms),
+        "total": total,  # 全部命中数；items 最多 limit 条
+        "has_more": total > len(items),
+        "took_ms": round((time.perf_counter() - started) * 1000, 1),
+        "items": items,
+    }
+
+API_ROUTES = {
+    "api/duplicates": api_duplicates,
+    "api/hashes": api_hashes,
+    "api/models": api_models,
+    "api/search": api_search,
+    "api/text": api_text,
+    "api/thumbnails": api_thumbnails,
+}
+
+# ========================
+# HTTP 辅助函数
+# ========================
+
+def file_etag(st):
+    """根据文件 stat 信息（修改时间 + 大小）生成 ETag"""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def http_date(timestamp):
+    """时间戳转为 HTTP 日期格式"""
+    return formatdate(timestamp, usegmt=True)
+
+def if_range_matches(if_range, etag, last_modified):
+    """If-Range 与当前文件一致时才允许返回部分内容"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return if_range == last_modified
+
+def cache_control(filepath):
+    """按文件位置决定 Cache-Control 策略"""
+    parent = os.path.dirname(filepath)
+    if THUMBNAIL_DIR in (os.path.basename(parent), os.path.basename(os.path.dirname(parent))):
+        max_age = THUMBNAIL_CACHE_MAX_AGE  # 缩略图与拼图（拼图 URL 带版本号，内容变化时地址随之变化）
+    else:
+        max_age = FILE_CACHE_MAX_AGE
+    if max_age <= 0:
+        return "no-cache"
+    return f"max-age={max_age}"
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match 比较（弱比较，W/ 前缀忽略）"""
+    if if_none_match.strip() == "*":
+        return True
+    def opaque(tag):
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+    return any(opaque(tag) == opaque(etag) for tag in if_none_match.split(","))
+
+def is_not_modified(headers, etag, mtime):
+    """判断条件请求是否可以返回 304：If-None-Match 优先于 If-Modified-Since"""
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError, IndexError, OverflowError):
+            return False
+        return int(mtime) <= since
+    return False
+
+def parse_range_header(header, size):
+    """解析 Range 请求头，返回 [(start, end), ...]（end 包含在内）
+
+    语法无法识别时返回 None（按完整文件处理）；所有区间都超出文件范围时返回 []（416）。
+    重叠或相邻的区间会被合并。
+    """
+    if not header or not header.startswith("bytes="):
+        return None
+    specs = header[len("bytes="):].split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges = []
+    for spec in specs:
+        spec = spec.strip()
+        if "-" not in spec:
+            return None
+        first, last = spec.split("-", 1)
+        first, last = first.strip(), last.strip()
+        try:
+            if first == "":
+                # 后缀区间：最后 N 个字节
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                if last:
+                    end = int(last)
+                    if end < start:
+                        return None
+                    end = min(end, size - 1)
+                else:
+                    end = size - 1
+        except ValueError:
+            return None
+        if start >= size or start < 0:
+            continue
+        ranges.append((start, end))
+
+    if len(ranges) <= 1:
+        return ranges
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def content_type_for(filepath):
+    """按扩展名返回文件的 Content-Type"""
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext in IMAGE_EXTS:
+        return {
+            '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
+            '.png': 'image/png', '.webp': 'image/webp',
+            '.bmp': 'image/bmp', '.tiff': 'image/tiff',
+            '.gif': 'image/gif'
+        }.get(ext, 'image')
+    elif ext == '.mp4':
+        return "video/mp4"
+    elif ext == '.mkv':
+        return "video/x-matroska"
+    return "application/octet-stream"
+
+def resolve_path(folder_path, filename):
+    """把 URL 中的文件名解析为磁盘路径；越出 FOLDER 时返回 None"""
+    filepath = os.path.normpath(os.path.join(folder_path, filename))
+    if os.path.commonpath([FOLDER]) != os.path.commonpath([FOLDER, filepath]):
+        return None
+    return filepath
+
+def multipart_ranges(ranges, size, content_type):
+    """多区间响应的分段头：返回 (boundary, 各段头部, 结尾, 总长度)"""
+    boundary = secrets.token_hex(12)
+    part_headers = [
+        (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+         f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode('latin-1')
+        for start, end in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode('latin-1')
+    length = sum(len(h) for h in part_headers) + len(closing)
+    length += sum(end - start + 1 for start, end in ranges)
+    return boundary, part_headers, closing, length
+
+def file_response(filepath, st, request_headers, caching=None):
+    """文件响应：返回 (状态码, 响应头列表, 内容)，两个后端共用
+
+    处理条件请求（304）、Range / If-Range（206、416）与多区间 multipart/byteranges。
+    内容为列表，元素是直接写出的 bytes 或从文件发送的 (offset, length)。
+    """
+    size = st.st_size
+    content_type = content_type_for(filepath)
+    etag = file_etag(st)
+    last_modified = http_date(st.st_mtime)
+    validators = [("ETag", etag), ("Last-Modified", last_modified),
+                  ("Cache-Control", caching or cache_control(filepath))]
+
+    if is_not_modified(request_headers, etag, st.st_mtime):
+        return 304, validators, []
+
+    ranges = None
+    range_header = request_headers.get("Range")
+    if range_header and if_range_matches(request_headers.get("If-Range"), etag, last_modified):
+        ranges = parse_range_header(range_header, size)
+
+    if ranges == []:
+        return 416, [("Content-Range", f"bytes */{size}"), ("Content-Length", "0")], []
+    file_headers = [("Accept-Ranges", "bytes")] + validators
+    if not ranges:
+        return 200, [("Content-type", content_type)] + file_headers + [("Content-Length", str(size))], [(0, size)]
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return 206, [("Content-type", content_type)] + file_headers + [
+            ("Content-Range", f"bytes {start}-{end}/{size}"),
+            ("Content-Length", str(end - start + 1))], [(start, end - start + 1)]
+
+    boundary, part_headers, closing, length = multipart_ranges(ranges, size, content_type)
+    parts = []
+    for header, (start, end) in zip(part_headers, ranges):
+        parts += [header, (start, end - start + 1)]
+    parts.append(closing)
+    return 206, [("Content-type", f"multipart/byteranges; boundary={boundary}")] + file_headers + [
+        ("Content-Length", str(length))], parts
+
+# ========================
+# 响应压缩与静态资源
+# ========================
+
+def choose_encoding(accept_encoding):
+    """按 Accept-Encoding 选择压缩方式：优先 br（需安装 brotli），其次 gzip，不接受时返回 None"""
+    accepted = {}
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in (("br",) if brotli is not None else ()) + ("gzip",):
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+def compress_body(body, encoding, best=False):
+    if encoding == "br":
+        return brotli.compress(body, quality=11 if best else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if best else GZIP_LEVEL, mtime=0)
+
+class StreamCompressor:
+    """流式压缩：每批数据都同步刷新，浏览器可以边收边渲染"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip 格式
+
+    def compress(self, data):
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush(zlib.Z_FINISH)
+
+def body_response(body, content_type, accept_encoding, status=200, cache=None, timing=None):
+    """已生成的文本响应：返回 (状态码, 响应头列表, 内容)，客户端支持时压缩；timing 为 Server-Timing 的值"""
+    encoding = choose_encoding(accept_encoding) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        body = compress_body(body, encoding)
+    headers = [("Content-type", content_type)]
+    if cache:
+        headers.append(("Cache-Control", cache))
+    if timing:
+        headers.append(("Server-Timing", timing))
+    headers.append(("Vary", "Accept-Encoding"))
+    if encoding:
+        headers.append(("Content-Encoding", encoding))
+    headers.append(("Content-Length", str(len(body))))
+    return status, headers, body
+
+class HtmlStream:
+    """边生成边发送的页面：响应头、压缩与分块编码，两个后端共用
+
+    HTTP/1.1 客户端使用分块传输编码（连接可复用），HTTP/1.0 客户端发送完毕后关闭连接；
+    给出 timings（发送响应头前已记录的扫描、分组等阶段）时以 Server-Timing 响应头发送，
+    渲染与发送耗时在最后以尾部字段补充（开发者工具和 curl 通常不显示尾部字段）。
+    """
+
+    def __init__(self, request_version, accept_encoding, timings=None):
+        self.chunked = request_version == "HTTP/1.1"
+        self.sent_phases = set(timings or ())
+        self.timed = self.chunked and timings is not None and SERVER_TIMING
+        encoding = choose_encoding(accept_encoding)
+        self.compressor = StreamCompressor(encoding) if encoding else None
+        self.headers = [("Content-type", "text/html; charset=utf-8"), ("Vary", "Accept-Encoding")]
+        if encoding:
+            self.headers.append(("Content-Encoding", encoding))
+        if self.chunked:
+            self.headers.append(("Transfer-Encoding", "chunked"))
+        else:
+            self.headers.append(("Connection", "close"))
+        if timings and SERVER_TIMING:
+            self.headers.append(("Server-Timing", format_server_timing(timings)))
+        if self.timed:
+            self.headers.append(("Trailer", "Server-Timing"))
+
+    def frame(self, data):
+        if not data:
+            return b""
+        return b"%X\r\n%s\r\n" % (len(data), data) if self.chunked else data
+
+    def encode(self, chunk):
+        """一段页面文本对应要写出的字节（可能为空）"""
+        data = chunk.encode('utf-8', errors='replace')
+        if data and self.compressor:
+            data = self.compressor.compress(data)
+        return self.frame(data)
+
+    def finish(self, timings, generate, sending, total):
+        """结尾：压缩器中剩余的数据、最后一个分块与 Server-Timing 尾部字段（不重复响应头中已发送的阶段）"""
+        data = self.frame(self.compressor.finish()) if self.compressor else b""
+        if self.timed:
+            trailer = server_timing(timings, generate, sending, total, skip=self.sent_phases)
+            data += f"0\r\nServer-Timing: {trailer}\r\n\r\n".encode("latin-1")
+        elif self.chunked:
+            data += b"0\r\n\r\n"
+        return data
+
+_static_assets = None
+_static_assets_lock = threading.Lock()
+
+def get_static_assets():
+    """页面公用的 CSS / JS：首次调用时生成并预压缩，之后直接复用"""
+    global _static_assets
+    with _static_assets_lock:
+        if _static_assets is None:
+            assets = {}
+            for name, content_type, source in (
+                    ("app.css", "text/css; charset=utf-8", page_css),
+                    ("app.js", "application/javascript; charset=utf-8", page_script),
+                    ("virtual.js", "application/javascript; charset=utf-8", virtual_script)):
+                body = source().encode('utf-8')
+                version = hashlib.sha256(body).hexdigest()[:12]
+                encoded = {None: body, "gzip": compress_body(body, "gzip", best=True)}
+                if brotli is not None:
+                    encoded["br"] = compress_body(body, "br", best=True)
+                assets[name] = {"type": content_type, "version": version,
+                                "etag": f'"{version}"', "encoded": encoded}
+            _static_assets = assets
+        return _static_assets
+
+def static_url(name):
+    """带版本号的静态资源地址，内容变化后浏览器会重新下载"""
+    return f"/static/{name}?v={get_static_assets()[name]['version']}"
+
+def static_response(name, request_headers):
+    """/static/ 资源：返回 (状态码, 响应头列表, 内容)，按 Accept-Encoding 选择预压缩好的版本；不存在时返回 None"""
+    asset = get_static_assets().get(name)
+    if asset is None:
+        return None
+    if etag_matches(request_headers.get("If-None-Match", ""), asset["etag"]):
+        return 304, [("ETag", asset["etag"])], b""
+    encoding = choose_encoding(request_headers.get("Accept-Encoding"))
+    body = asset["encoded"].get(encoding, asset["encoded"][None])
+    headers = [("Content-type", asset["type"]),
+               ("Cache-Control", f"public, max-age={STATIC_CACHE_MAX_AGE}, immutable"),
+               ("ETag", asset["etag"]), ("Vary", "Accept-Encoding")]
+    if encoding and encoding in asset["encoded"]:
+        headers.append(("Content-Encoding", encoding))
+    headers.append(("Content-Length", str(len(body))))
+    return 200, headers, body
+
 # ========================
 # 自定义请求处理器（含美化日志）
 # ========================
 
-class CustomHandler(http.server.SimpleHTTPRequestHandler):
+class CustomHandler(KeepAliveHandler):
+    keepalive_timeout = KEEPALIVE_TIMEOUT
+    keepalive_linger = KEEPALIVE_LINGER
+    keepalive_max_requests = KEEPALIVE_MAX_REQUESTS
+    copy_chunk_size = COPY_CHUNK_SIZE
+
+    def log_message(self, format, *args):
+        """错误信息也走日志队列（基类直接写 stderr）"""
+        error_logger.warning("%s - %s", self.client_address[0], format % args)
+
     def log_request(self, code='-', size='-'):
-        """重写日志方法：将 URL 解码后输出，避免 %E5%95%86 这类编码出现在 cmd 中"""
+        """GET 请求在处理完后由 do_GET 记录（此时耗时和字节数已知）；其它情况（如 501）在此记录"""
+        if getattr(self, "in_get", False):
+            return
         if hasattr(self, 'command') and hasattr(self, 'path'):
-            try:
-                decoded_path = unquote(self.path)
-                client = self.client_address[0]
-                print(f"{client} - \"{self.command} {decoded_path}\" → status={code}")
-            except Exception:
-                super().log_request(code, size)
+            log_access(self.client_address[0], self.command, self.path, int(code) if code != '-' else code)
         else:
             super().log_request(code, size)
 
+    def send_headers(self, status, headers):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+
+    def send_html_stream(self, chunks, started=None):
+        """边生成边发送页面；给出 started（请求开始时间）时附带 Server-Timing
+
+        先生成页头（此时目录扫描和分组已经完成），这些阶段的耗时放在响应头中，渲染与发送耗时以尾部字段发送。
+        """
+        chunks = iter(chunks)
+        step = time.perf_counter()
+        chunk = next(chunks, None)
+        generate = time.perf_counter() - step
+        timings = dict(_request_timings.get() or {}) if started is not None else None
+        stream = HtmlStream(self.request_version, self.headers.get("Accept-Encoding"), timings)
+        self.send_headers(200, stream.headers)
+        sending = 0.0
+        try:
+            while chunk is not None:
+                step = time.perf_counter()
+                data = stream.encode(chunk)
+                if data:
+                    self.wfile.write(data)
+                sending += time.perf_counter() - step
+                step = time.perf_counter()
+                chunk = next(chunks, None)
+                generate += time.perf_counter() - step
+            total = time.perf_counter() - started if started is not None else None
+            self.wfile.write(stream.finish(_request_timings.get() or {}, generate, sending, total))
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def send_json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        self.send_body(body, "application/json; charset=utf-8", status, cache="no-store")
+
+    def send_body(self, body, content_type, status=200, cache=None, timing=None):
+        """发送已生成的文本响应，客户端支持时压缩；timing 为 Server-Timing 的值"""
+        status, headers, body = body_response(body, content_type, self.headers.get("Accept-Encoding"),
+                                              status, cache, timing)
+        self.send_headers(status, headers)
+        self.wfile.write(body)
+
+    def serve_static(self, name):
+        """/static/ 资源：按 Accept-Encoding 直接发送启动时预压缩好的版本"""
+        response = static_response(name, self.headers)
+        if response is None:
+            self.send_error(404, "File not found.")
+            return
+        status, headers, body = response
+        self.send_headers(status, headers)
+        self.wfile.write(body)
+
+    def resolve_file(self, folder_path, filename):
+        """把 URL 中的文件名解析为磁盘路径；越出 FOLDER 时返回 403 并返回 None"""
+        filepath = resolve_path(folder_path, filename)
+        if filepath is None:
+            self.send_error(403, "Forbidden")
+        return filepath
+
+    def serve_file(self, filepath, caching=None):
+        """以流式方式发送文件，支持 Range 分段请求，内存占用与文件大小无关"""
+        try:
+            f = open(filepath, 'rb')
+        except (FileNotFoundError, IsADirectoryError, PermissionError):
+            self.send_error(404, "File not found.")
+            return
+
+        with f:
+            status, headers, parts = file_response(filepath, os.fstat(f.fileno()), self.headers, caching)
+            try:
+                self.send_headers(status, headers)
+                for part in parts:
+                    if isinstance(part, bytes):
+                        self.wfile.write(part)
+                    else:
+                        self.copy_file_range(f, *part)
+            except (BrokenPipeError, ConnectionResetError):
+                # 浏览器中途取消（例如关闭视频或拖动进度条）属于正常情况
+                self.close_connection = True
+
+    def send_profile(self, dir_name, query):
+        """/?profile=1：仅限本机，返回页面生成的 cProfile 结果"""
+        if not PROFILE_ENABLED or not is_local_client(self.client_address[0], self.headers):
+            self.send_error(403, "Profiling is only available from localhost")
+            return
+        try:
+            report = profile_page(dir_name, query.get("sort", ["cumulative"])[0],
+                                  query.get("rescan", [""])[0] == "1")
+        except ValueError as e:
+            self.send_body(str(e).encode("utf-8"), "text/plain; charset=utf-8", status=400)
+            return
+        self.send_body(report.encode("utf-8"), "text/plain; charset=utf-8", cache="no-store")
+
     def do_GET(self):
+        started = time.perf_counter()
+        sent = self.wfile.count
+        self.status_code = None
+        token = _request_timings.set({})
+        self.in_get = True
+        try:
+            with request_load:
+                self.route_get()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        except Exception as e:
+            self.handle_route_error(e)
+        finally:
+            self.in_get = False
+            _request_timings.reset(token)
+            elapsed = time.perf_counter() - started
+            status = self.status_code or "-"
+            metrics.observe_request(route_label(self.path), status, elapsed, self.wfile.count - sent)
+            log_access(self.client_address[0], self.command, self.path, status, elapsed, self.wfile.count - sent)
+
+    def handle_route_error(self, e):
+        """处理请求时出现未预料的异常：记录日志；响应头尚未发出时返回 500，否则只能关闭连接"""
+        error_logger.error("%s - 处理 %s 出错: %r", self.client_address[0], self.path, e, exc_info=True)
+        self.close_connection = True
+        if self.status_code is None:
+            try:
+                self.send_error(500, "Internal server error")
+            except OSError:
+                pass
+
+    def route_get(self):
         parsed = urlparse(self.path)
         query = parse_qs(parsed.query)
         path = unquote(parsed.path.strip("/"))
         dir_name = query.get("dir", [""])[0]
-        folder_map = scan_folders()
+        folder_map = current_folder_map()
 
         current_folder_path = folder_map.get(dir_name, FOLDER)
 
         if path == "":
-            self.send_response(200)
-            self.send_header("Content-type", "text/html; charset=utf-8")
-            self.end_headers()
-            self.wfile.write(generate_html(dir_name))
+            if query.get("profile", [""])[0] == "1":
+                self.send_profile(dir_name, query)
+                return
+            started = time.perf_counter()
+            view = query.get("view", [""])[0]
+            if view != "virtual" and view != "full":
+                many = len(listing_rows(dir_name)[0]) > VIRTUAL_LIST_THRESHOLD
+                view = "virtual" if many else "full"
+            if view == "virtual":
+                body = generate_virtual_html(dir_name)
+                timing = server_timing(_request_timings.get(), time.perf_counter() - started) if SERVER_TIMING else None
+                self.send_body(body, "text/html; charset=utf-8", timing=timing)
+            else:
+                self.send_html_stream(iter_html(dir_name), started)
 
-        elif path.startswith("file/"):
-            filename = path.split("/", 1)[1]
-            filepath = os.path.join(current_folder_path, filename)
+        elif path == "duplicates":
+            self.send_body(generate_duplicates_html(), "text/html; charset=utf-8")
 
-            # 安全检查
-            if os.path.commonpath([FOLDER]) != os.path.commonpath([FOLDER, filepath]):
-                self.send_error(403, "Forbidden")
-                return
+        elif path == "metrics":
+            self.send_body(metrics_text().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8", cache="no-store")
+
+        elif path.startswith("static/"):
+            self.serve_static(path.split("/", 1)[1])
 
-            if os.path.isfile(filepath):
-                self.send_response(200)
+        elif path in API_ROUTES:
+            try:
+                self.send_json(API_ROUTES[path](query))
+            except ValueError as e:
+                self.send_json({"error": str(e)}, status=400)
+            except LookupError as e:
+                self.send_json({"error": str(e)}, status=404)
 
+        elif path.startswith("file/"):
+            filepath = self.resolve_file(current_folder_path, path.split("/", 1)[1])
+            if filepath:
+                self.serve_file(filepath)
+
+        elif path.startswith("thumb/"):
+            filepath = self.resolve_file(current_folder_path, path.split("/", 1)[1])
+            if filepath:
                 ext = os.path.splitext(filepath)[1].lower()
-                if ext in IMAGE_EXTS:
-                    mime = {
-                        '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg',
-                        '.png': 'image/png', '.webp': 'image/webp',
-                        '.bmp': 'image/bmp', '.tiff': 'image/tiff',
-                        '.gif': 'image/gif'
-                    }.get(ext, 'image')
-                    self.send_header("Content-type", mime)
-                elif ext == '.mp4':
-                    self.send_header("Content-type", "video/mp4")
-                elif ext == '.mkv':
-                    self.send_header("Content-type", "video/x-matroska")
+                thumbnail_path = get_image_thumbnail(filepath) if ext in IMAGE_EXTS else None
+                # 缩略图生成失败（格式不支持、缺少 Pillow/ffmpeg 等）时直接返回原图
+                self.serve_file(thumbnail_path or filepath, caching=cache_control(filepath))
+
+        elif path == "favicon.ico":
+            self.send_response(204)  # 204 没有消息体，持久连接可以直接复用
+            self.end_headers()
+
+        else:
+            self.send_error(404, "Not found.")
+
+# ========================
+# asyncio 服务器（可选：python loraview2.py --asyncio）
+# ========================
+
+class AsyncRequestHandler:
+    """asyncio 后端的连接处理：路由与 CustomHandler.route_get 相同
+
+    文件通过 loop.sendfile 发送（不占用线程）；目录扫描、页面生成、JSON 接口、缩略图等阻塞操作
+    放到固定大小的线程池中执行，因此大量视频长连接也只需要少量线程。
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        peer = writer.get_extra_info("peername")
+        self.client = peer[0] if peer else "-"
+        self.close_connection = True
+        self.bytes_sent = 0
+
+    async def handle(self):
+        try:
+            for served in range(KEEPALIVE_MAX_REQUESTS):
+                if not await self.handle_one_request(last=served + 1 >= KEEPALIVE_MAX_REQUESTS):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass  # 浏览器中途断开（例如关闭视频或拖动进度条）属于正常情况
+        finally:
+            # 先半关闭发送方向（缓冲区发完后发出 FIN）：即使套接字同时被其它进程持有，客户端也能读到 EOF
+            try:
+                if self.writer.can_write_eof():
+                    self.writer.write_eof()
+            except OSError:
+                pass
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def handle_one_request(self, last):
+        """读取并处理一个请求，返回是否继续复用连接"""
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), KEEPALIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False
+        except ValueError:
+            # 请求行超过 StreamReader 的长度上限（与 http.server 相同返回 414）
+            self.request_version = "HTTP/1.0"
+            self.close_connection = True
+            await self.send_error(414, "Request-URI Too Long")
+            return False
+        if not line:
+            return False
+        parts = line.decode("latin-1").split()
+        self.method, self.path = (parts + ["", ""])[:2]
+        self.request_version = parts[2] if len(parts) == 3 else "HTTP/1.0"
+
+        try:
+            header_lines = await asyncio.wait_for(self.read_header_lines(), KEEPALIVE_TIMEOUT)
+        except asyncio.TimeoutError:
+            return False  # 请求头迟迟没有发完
+        except ValueError as e:
+            self.close_connection = True
+            await self.send_error(431, str(e))
+            return False
+        self.headers = http.client.parse_headers(io.BytesIO(b"".join(header_lines) + b"\r\n"))
+
+        connection = self.headers.get("Connection", "").lower()
+        if self.request_version == "HTTP/1.1":
+            self.close_connection = connection == "close"
+        else:
+            self.close_connection = connection != "keep-alive"
+        if last or len(parts) != 3:
+            self.close_connection = True
+
+        started = time.perf_counter()
+        self.status_code = None
+        self.bytes_sent = 0
+        try:
+            if len(parts) != 3 or not self.request_version.startswith("HTTP/"):
+                await self.send_error(400, "Bad request syntax")
+            elif self.method != "GET":
+                self.close_connection = True  # 不读取请求体，直接关闭连接
+                await self.send_error(405, "Method not allowed")
+            else:
+                token = _request_timings.set({})
+                try:
+                    with request_load:
+                        await self.route_get()
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    await self.handle_route_error(e)
+                finally:
+                    _request_timings.reset(token)
+                    metrics.observe_request(route_label(self.path), self.status_code or "-",
+                                            time.perf_counter() - started, self.bytes_sent)
+        finally:
+            log_access(self.client, self.method, self.path, self.status_code or "-",
+                       time.perf_counter() - started, self.bytes_sent)
+        await self.writer.drain()
+        return not self.close_connection
+
+    async def read_header_lines(self):
+        """读取请求头各行；单行过长或超过 100 行时抛出 ValueError（与 http.server 相同返回 431）"""
+        header_lines = []
+        while True:
+            try:
+                header = await self.reader.readline()
+            except ValueError:
+                raise ValueError("Line too long") from None  # 超过 StreamReader 的长度上限
+            if header in (b"\r\n", b"\n", b""):
+                return header_lines
+            header_lines.append(header)
+            if len(header_lines) > 100:
+                raise ValueError("Too many headers")
+
+    async def handle_route_error(self, e):
+        """与 CustomHandler.handle_route_error 相同：响应头尚未发出时返回 500，否则只能关闭连接"""
+        error_logger.error("%s - 处理 %s 出错: %r", self.client, self.path, e, exc_info=True)
+        self.close_connection = True
+        if self.status_code is None:
+            await self.send_error(500, "Internal server error")
+
+    def send_headers(self, code, headers):
+        lines = [f"HTTP/1.1 {code} {HTTPStatus(code).phrase}",
+                 "Server: loraview-asyncio",
+                 f"Date: {http_date(time.time())}"]
+        lines += [f"{name}: {value}" for name, value in headers]
+        if any(name.lower() == "connection" and value.lower() == "close" for name, value in headers):
+            self.close_connection = True
+        elif self.close_connection:
+            lines.append("Connection: close")
+        self.status_code = code
+        self.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    def write(self, data):
+        self.bytes_sent += len(data)
+        self.writer.write(data)
+
+    async def send_body(self, body, content_type, status=200, cache=None, timing=None):
+        """发送已生成的文本响应，客户端支持时压缩；timing 为 Server-Timing 的值"""
+        status, headers, body = body_response(body, content_type, self.headers.get("Accept-Encoding"),
+                                              status, cache, timing)
+        self.send_headers(status, headers)
+        self.write(body)
+        await self.writer.drain()
+
+    async def send_json(self, obj, status=200):
+        body = json.dumps(obj, ensure_ascii=False).encode('utf-8')
+        await self.send_body(body, "application/json; charset=utf-8", status, cache="no-store")
+
+    async def send_error(self, code, message):
+        body = f"<h1>{code} {html.escape(message)}</h1>".encode("utf-8")
+        self.send_headers(code, [("Content-Type", "text/html; charset=utf-8"), ("Content-Length", str(len(body)))])
+        self.write(body)
+        await self.writer.drain()
+
+    async def run_blocking(self, func, *args):
+        """在线程池中执行阻塞操作；复制当前上下文，使其中的耗时计入本请求的 Server-Timing"""
+        return await self.loop.run_in_executor(None, contextvars.copy_context().run, func, *args)
+
+    async def send_html_stream(self, chunks, started=None):
+        """逐段生成页面（在线程池中推进生成器）并发送，格式与 CustomHandler.send_html_stream 相同"""
+        step = time.perf_counter()
+        chunk = await self.run_blocking(next, chunks, None)
+        generate = time.perf_counter() - step
+        timings = dict(_request_timings.get() or {}) if started is not None else None
+        stream = HtmlStream(self.request_version, self.headers.get("Accept-Encoding"), timings)
+        self.send_headers(200, stream.headers)
+        sending = 0.0
+        while chunk is not None:
+            step = time.perf_counter()
+            data = stream.encode(chunk)
+            if data:
+                self.write(data)
+                await self.writer.drain()
+            sending += time.perf_counter() - step
+            step = time.perf_counter()
+            chunk = await self.run_blocking(next, chunks, None)
+            generate += time.perf_counter() - step
+        total = time.perf_counter() - started if started is not None else None
+        self.write(stream.finish(_request_timings.get() or {}, generate, sending, total))
+
+    async def serve_static(self, name):
+        response = static_response(name, self.headers)
+        if response is None:
+            await self.send_error(404, "File not found.")
+            return
+        status, headers, body = response
+        self.send_headers(status, headers)
+        self.write(body)
+
+    async def serve_file(self, filepath, caching=None):
+        """与 CustomHandler.serve_file 相同的响应（file_response），文件内容用 loop.sendfile 发送"""
+        def open_file():
+            f = open(filepath, 'rb')
+            return f, os.fstat(f.fileno())
+        try:
+            f, st = await self.run_blocking(open_file)
+        except (FileNotFoundError, IsADirectoryError, PermissionError):
+            await self.send_error(404, "File not found.")
+            return
+
+        with f:
+            status, headers, parts = file_response(filepath, st, self.headers, caching)
+            self.send_headers(status, headers)
+            for part in parts:
+                if isinstance(part, bytes):
+                    self.write(part)
                 else:
-                    self.send_header("Content-type", "application/octet-stream")
+                    await self.send_file_range(f, *part)
 
-                self.end_headers()
-                with open(filepath, 'rb') as f:
-                    self.wfile.write(f.read())
+    async def send_file_range(self, f, offset, length):
+        if length > 0:
+            await self.writer.drain()
+            self.bytes_sent += await self.loop.sendfile(self.writer.transport, f, offset, length)
+
+    async def send_profile(self, dir_name, query):
+        if not PROFILE_ENABLED or not is_local_client(self.client, self.headers):
+            await self.send_error(403, "Profiling is only available from localhost")
+            return
+        try:
+            report = await self.run_blocking(profile_page, dir_name, query.get("sort", ["cumulative"])[0],
+                                             query.get("rescan", [""])[0] == "1")
+        except ValueError as e:
+            await self.send_body(str(e).encode("utf-8"), "text/plain; charset=utf-8", status=400)
+            return
+        await self.send_body(report.encode("utf-8"), "text/plain; charset=utf-8", cache="no-store")
+
+    async def route_get(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        path = unquote(parsed.path.strip("/"))
+        dir_name = query.get("dir", [""])[0]
+        current_folder_path = (await self.run_blocking(current_folder_map)).get(dir_name, FOLDER)
+
+        if path == "":
+            if query.get("profile", [""])[0] == "1":
+                await self.send_profile(dir_name, query)
+                return
+            started = time.perf_counter()
+            view = query.get("view", [""])[0]
+            if view != "virtual" and view != "full":
+                many = len((await self.run_blocking(listing_rows, dir_name))[0]) > VIRTUAL_LIST_THRESHOLD
+                view = "virtual" if many else "full"
+            if view == "virtual":
+                body = await self.run_blocking(generate_virtual_html, dir_name)
+                timing = server_timing(_request_timings.get(), time.perf_counter() - started) if SERVER_TIMING else None
+                await self.send_body(body, "text/html; charset=utf-8", timing=timing)
             else:
-                self.send_error(404, "File not found.")
+                await self.send_html_stream(iter_html(dir_name), started)
+
+        elif path in API_ROUTES:
+            try:
+                await self.send_json(await self.run_blocking(API_ROUTES[path], query))
+            except ValueError as e:
+                await self.send_json({"error": str(e)}, status=400)
+            except LookupError as e:
+                await self.send_json({"error": str(e)}, status=404)
+
+        elif path == "duplicates":
+            await self.send_body(await self.run_blocking(generate_duplicates_html), "text/html; charset=utf-8")
+
+        elif path == "metrics":
+            await self.send_body(metrics_text().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8", cache="no-store")
+
+        elif path.startswith("static/"):
+            await self.serve_static(path.split("/", 1)[1])
+
+        elif path.startswith("file/") or path.startswith("thumb/"):
+            filepath = resolve_path(current_folder_path, path.split("/", 1)[1])
+            if filepath is None:
+                await self.send_error(403, "Forbidden")
+            elif path.startswith("file/"):
+                await self.serve_file(filepath)
+            else:
+                ext = os.path.splitext(filepath)[1].lower()
+                thumbnail_path = await self.run_blocking(get_image_thumbnail, filepath) if ext in IMAGE_EXTS else None
+                await self.serve_file(thumbnail_path or filepath, caching=cache_control(filepath))
 
         elif path == "favicon.ico":
-            self.send_response(204)
-            self.end_headers()
+            self.send_headers(204, [])
 
         else:
-            self.send_error(404, "Not found.")
+            await self.send_error(404, "Not found.")
+
+async def serve_async():
+    """asyncio 后端：单个事件循环处理所有连接，阻塞操作交给固定大小的线程池"""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS,
+                                                 thread_name_prefix="lora-async"))
+    server = await asyncio.start_server(
+        lambda reader, writer: AsyncRequestHandler(reader, writer).handle(), "", PORT, backlog=128)
+    print_banner(f"asyncio 事件循环，阻塞操作使用 {ASYNC_EXECUTOR_WORKERS} 个线程")
+    get_static_assets()
+    start_watcher()
+    print()
+    async with server:
+        await server.serve_forever()
 
 # ========================
 # 启动服务器
 # ========================
 
-def run_server():
+def print_banner(concurrency):
+    print(f"\nLora 浏览器已启动（v6：优化信息显示 + 文件大小）")
+    print(f"   访问地址: http://localhost:{PORT}")
+    print(f"   并发: {concurrency}")
+    print(f"   功能: 图片/视频预览 + 视频缩略图 + 搜索 + 文件大小 + 创建日期 + 文本折叠")
+    print(f"   提示: 按 Ctrl+C 停止服务")
+    print(f"   注意: 首次访问视频文件时会自动生成缩略图，请确保系统已安装 ffmpeg")
+    print(f"   压缩: gzip{' + brotli' if brotli is not None else ''}（静态资源已预压缩）")
+    if SPRITE_ENABLED:
+        print(f"   拼图: {'已启用' if Image is not None else '需要 Pillow，已停用'}")
+
+def run_server(backend=SERVER_BACKEND):
     if not os.path.isdir(FOLDER):
         print(f"错误：目录不存在！\n路径: {FOLDER}")
         return
 
     os.chdir(FOLDER)
+    setup_logging()
     try:
-        with socketserver.TCPServer(("", PORT), CustomHandler) as httpd:
-            print(f"\nLora 浏览器已启动（v6：优化信息显示 + 文件大小）")
-            print(f"   访问地址: http://localhost:{PORT}")
-            print(f"   功能: 图片/视频预览 + 视频缩略图 + 搜索 + 文件大小 + 创建日期 + 文本折叠")
-            print(f"   提示: 按 Ctrl+C 停止服务")
-            print(f"   注意: 首次访问视频文件时会自动生成缩略图，请确保系统已安装 ffmpeg\n")
+        if backend == "asyncio":
+            asyncio.run(serve_async())
+            return
+        with PooledHTTPServer(("", PORT), CustomHandler,
+                              workers=WORKER_THREADS, max_queued=MAX_QUEUED_CONNECTIONS) as httpd:
+            print_banner(f"{WORKER_THREADS} 个工作线程，最多 {MAX_QUEUED_CONNECTIONS} 个排队连接")
+            get_static_assets()
+            start_watcher()
+            print()
             httpd.serve_forever()
     except Exception as e:
         print(f"启动失败: {e}")
 
 if __name__ == "__main__":
-    run_server()
+    parser = argparse.ArgumentParser(description="Lora 模型浏览器")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="使用 asyncio 服务器（大量客户端同时播放视频时线程数保持不变）")
+    args = parser.parse_args()
+    run_server("asyncio" if args.asyncio else SERVER_BACKEND)
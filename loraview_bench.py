@@ -0,0 +1,683 @@
+# loraview_bench.py - 合成模型库生成器 + loraview.py / loraview2.py 端到端性能基准
+#
+# 用法示例：
+#   python loraview_bench.py                          # 1000 个模型，两个浏览器都测
+#   python loraview_bench.py --models 1000,10000,50000 --out bench.json
+#   python loraview_bench.py --viewers loraview2,loraview2:asyncio --models 10000
+#   python loraview_bench.py --downloads 4,16         # 4 个、16 个 Range 下载进行中的页面与缩略图延迟
+#   python loraview_bench.py --idle 100,1000          # 100 个、1000 个空闲持久连接保持打开时的延迟与线程数
+#   python loraview_bench.py --scan-compare --models 17000  # 约 5 万个文件：原扫描方式与递归并行扫描的耗时对比
+#
+# 每个规模生成一次可复现的合成库（同样的 --seed 得到同样的文件），缓存在 --workdir 中。
+# 冷/热扫描、页面生成在独立子进程中测量；服务器指标对本机启动的真实服务器测量。
+# 结果写为 JSON，便于比较不同版本或不同机器的运行结果。
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import struct
+import zlib
+import argparse
+import platform
+import subprocess
+import tempfile
+import threading
+import importlib.util
+import http.client
+from urllib.parse import quote
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+# ========================
+# 配置区
+# ========================
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT_NAME = "全部"  # 与浏览器配置中的 ROOT_NAME 一致（loraview2 中为包含全部子文件夹的视图）
+DEFAULT_WORKDIR = os.path.join(tempfile.gettempdir(), "loraview_bench")
+DEFAULT_MODELS = "1000"  # 逗号分隔的模型数量，每个数量生成一个合成库
+DEFAULT_VIEWERS = "loraview,loraview2"  # 要测试的浏览器；loraview2:asyncio 表示使用 asyncio 后端
+MODELS_PER_FOLDER = 250  # 合成库每个子文件夹的模型数
+VIDEO_EVERY = 10  # 每隔多少个模型使用视频预览（其余使用图片）
+LONG_NOTE_EVERY = 50  # 每隔多少个模型生成一个超长说明文件
+LONG_NOTE_BYTES = 256 * 1024  # 超长说明文件的大小
+LARGE_FILE_MB = 64  # 测试大文件吞吐量时使用的模型文件大小
+IMAGE_SIZE = 64  # 合成预览图边长（像素）
+
+PAGE_REPEATS = 5  # 每个页面测量 TTFB 的次数
+FILE_REQUESTS = 500  # 并发文件测试的请求总数
+FILE_CONCURRENCY = 16  # 并发文件测试的客户端数
+LARGE_FILE_CONCURRENCY = 4  # 同时下载大文件的客户端数
+DEFAULT_DOWNLOADS = "8"  # 逗号分隔：并发场景中后台同时进行的 Range 下载数（模拟多个正在播放/拖动的视频）
+BUSY_THUMBS = 50  # 并发场景：下载进行中依次请求的缩略图数
+BUSY_WARMUP = 0.5  # 并发场景：开始测量前等待下载建立（或空闲连接被服务器交给 selector）的秒数
+DEFAULT_IDLE = "200"  # 逗号分隔：空闲场景中保持打开的空闲持久连接数
+SCAN_REPEATS = 5  # --scan-compare：每种扫描方式冷扫描的次数（每次在新的子进程中、使用新的模型目录数据库）
+SERVER_START_TIMEOUT = 600  # 等待服务器首次返回页面的秒数（包括首次扫描）
+HTTP_TIMEOUT = 300
+
+WORDS = ["1girl", "solo", "樱花", "portrait", "anime", "汉服", "landscape", "cyberpunk",
+         "watercolor", "trigger", "风景", "detailed", "style", "lineart", "chibi", "写实"]
+
+# ========================
+# 合成模型库
+# ========================
+
+def png_bytes(size, color):
+    """生成纯色 PNG（不依赖 Pillow）"""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    row = b"\0" + bytes(color) * size
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * size, 9))
+            + chunk(b"IEND", b""))
+
+def video_bytes(workdir):
+    """预览视频：有 ffmpeg 时生成 1 秒的真实 mp4，否则使用占位数据（缩略图生成会失败并退避）"""
+    path = os.path.join(workdir, "preview.mp4")
+    if not os.path.exists(path):
+        try:
+            subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi",
+                            "-i", f"color=c=gray:s={IMAGE_SIZE}x{IMAGE_SIZE}:d=1",
+                            "-pix_fmt", "yuv420p", path],
+                           check=True, timeout=60, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.SubprocessError):
+            with open(path, "wb") as f:
+                f.write(b"\0\0\0\x18ftypmp42" + b"\0" * 4096)
+    with open(path, "rb") as f:
+        return f.read()
+
+def safetensors_bytes(rng, index, tensor_bytes):
+    """带有效头部和 kohya 训练元数据的 .safetensors 文件"""
+    tags = {rng.choice(WORDS) + str(j): rng.randint(1, 200) for j in range(30)}
+    metadata = {
+        "ss_output_name": f"model_{index:06d}",
+        "ss_base_model_version": rng.choice(["sdxl_base_v1-0", "sd_v1", "flux1"]),
+        "ss_network_module": "networks.lora",
+        "ss_network_dim": str(rng.choice([8, 16, 32, 64])),
+        "ss_network_alpha": str(rng.choice([1.0, 8.0, 16.0])),
+        "ss_num_epochs": str(rng.randint(1, 20)),
+        "ss_tag_frequency": json.dumps({"10_dataset": tags}, ensure_ascii=False),
+    }
+    header = {
+        "__metadata__": metadata,
+        "lora_unet_down_blocks_0.lora_down.weight": {
+            "dtype": "F16", "shape": [16, 320], "data_offsets": [0, tensor_bytes]},
+    }
+    data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data += b" " * (-len(data) % 8)
+    return struct.pack("<Q", len(data)) + data + rng.randbytes(tensor_bytes)
+
+def note_text(rng, index):
+    words = " ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 40)))
+    text = f"model_{index:06d}\n触发词: {words}\n推荐权重: 0.{rng.randint(5, 9)}\n"
+    if index % LONG_NOTE_EVERY == 0:
+        line = f"超长说明 {words}\n"
+        text += line * (LONG_NOTE_BYTES // len(line.encode("utf-8")))
+    return text
+
+def generate_library(workdir, models, seed):
+    """生成（或复用）包含 models 个模型的合成库，返回库目录"""
+    root = os.path.join(workdir, f"lib_{models}_{seed}")
+    marker = os.path.join(root, ".bench_complete")
+    if os.path.exists(marker):
+        return root
+    if os.path.isdir(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+
+    rng = random.Random(seed)
+    video = video_bytes(workdir)
+    started = time.perf_counter()
+    for index in range(models):
+        folder = os.path.join(root, f"set_{index // MODELS_PER_FOLDER:04d}")
+        if index % MODELS_PER_FOLDER == 0:
+            os.makedirs(folder, exist_ok=True)
+        base = os.path.join(folder, f"model_{index:06d}")
+        with open(base + ".safetensors", "wb") as f:
+            f.write(safetensors_bytes(rng, index, rng.randint(1, 16) * 1024))
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(note_text(rng, index))
+        if index % VIDEO_EVERY == 0:
+            with open(base + ".mp4", "wb") as f:
+                f.write(video)
+        else:
+            with open(base + ".png", "wb") as f:
+                f.write(png_bytes(IMAGE_SIZE, (rng.randrange(256), rng.randrange(256), rng.randrange(256))))
+
+    # 大文件吞吐量测试用的模型
+    with open(os.path.join(root, "large.safetensors"), "wb") as f:
+        f.write(safetensors_bytes(rng, models, 1024))
+        block = rng.randbytes(1024 * 1024)
+        for _ in range(LARGE_FILE_MB):
+            f.write(block)
+
+    with open(marker, "w") as f:
+        f.write(f"{models} {seed}\n")
+    print(f"  已生成合成库: {root}（{models} 个模型，{time.perf_counter() - started:.1f} 秒）")
+    return root
+
+# ========================
+# 进程内测量（子进程中运行）
+# ========================
+
+def load_viewer(viewer, library, catalog):
+    """按路径导入浏览器模块并指向合成库；不启动服务器"""
+    spec = importlib.util.spec_from_file_location(viewer, os.path.join(HERE, f"{viewer}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.FOLDER = library
+    if hasattr(module, "CATALOG_DB"):
+        module.CATALOG_DB = catalog
+    if hasattr(module, "HASH_ENABLED"):
+        module.HASH_ENABLED = False  # 后台哈希会持续占用磁盘带宽，测量结果不可比较
+    return module
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, round((time.perf_counter() - started) * 1000, 2)
+
+def measure_scan(viewer, library, catalog):
+    """--scan-compare 的子进程入口：冷扫描一次全部子文件夹
+
+    walk_ms 只计目录列出与文件 stat：loraview2 取 Server-Timing 的 scan、listdir、stat 阶段之和，
+    不含读取说明文字和写入模型目录数据库；loraview 的扫描只做这两件事，取总耗时。
+    """
+    module = load_viewer(viewer, library, catalog)
+    timings = {}
+    if hasattr(module, "_request_timings"):
+        module._request_timings.set(timings)
+        module._schedule_background.set(False)
+    started = time.perf_counter()
+    folder_map = module.scan_folders()
+    scanned = time.perf_counter()
+    folders = [path for name, path in folder_map.items() if path != library]
+    models = sum(len(module.group_files_in(path)) for path in folders)
+    total = time.perf_counter() - started
+    walk = sum(timings.get(phase, 0.0) for phase in ("scan", "listdir", "stat")) if timings else total
+    return {
+        "folders": len(folders),
+        "models": models,
+        "scan_folders_ms": round((scanned - started) * 1000, 2),
+        "walk_ms": round(walk * 1000, 2),
+        "total_ms": round(total * 1000, 2),
+    }
+
+def measure_in_process(viewer, library, catalog):
+    """冷/热扫描与页面生成耗时
+
+    “冷”指浏览器自身的缓存（目录快照、模型目录数据库）为空；操作系统的文件缓存不会被清空。
+    """
+    module = load_viewer(viewer, library, catalog)
+    folder_map, scan_cold = timed(module.scan_folders)
+    _, scan_warm = timed(module.scan_folders)
+    folders = sorted(path for name, path in folder_map.items() if path != library)
+
+    def group_all():
+        return sum(len(module.group_files_in(path)) for path in folders)
+
+    models, group_cold = timed(group_all)
+    _, group_warm = timed(group_all)
+
+    pages = {}
+    first = sorted(name for name, path in folder_map.items() if path != library)[0]
+    for label, name in (("index", ""), ("all", ROOT_NAME), ("folder", first)):
+        body, render_cold = timed(module.generate_html, name)
+        body, render_warm = timed(module.generate_html, name)
+        pages[label] = {"render_cold_ms": render_cold, "render_warm_ms": render_warm, "bytes": len(body)}
+
+    return {
+        "folders": len(folders),
+        "models": models,
+        "scan_folders_cold_ms": scan_cold,
+        "scan_folders_warm_ms": scan_warm,
+        "group_files_cold_ms": group_cold,
+        "group_files_warm_ms": group_warm,
+        "pages": pages,
+    }
+
+# ========================
+# 服务器测量
+# ========================
+
+def serve(viewer, library, port, catalog, backend):
+    """子进程入口：启动指定浏览器的服务器"""
+    module = load_viewer(viewer, library, catalog)
+    module.PORT = port
+    if backend == "asyncio":
+        module.run_server("asyncio")
+    else:
+        module.run_server()
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(p * len(samples)))], 2)
+    return {"p50": pick(0.5), "p95": pick(0.95), "max": round(samples[-1], 2),
+            "mean": round(sum(samples) / len(samples), 2)}
+
+def fetch(conn, path):
+    """返回 (状态码, 首字节毫秒, 总毫秒, 字节数)；首字节以响应头到达为准"""
+    started = time.perf_counter()
+    conn.request("GET", path)
+    response = conn.getresponse()
+    ttfb = time.perf_counter() - started
+    size = 0
+    while True:
+        data = response.read(256 * 1024)
+        if not data:
+            break
+        size += len(data)
+    return response.status, ttfb * 1000, (time.perf_counter() - started) * 1000, size
+
+def wait_ready(port, process):
+    """等待服务器完成首次扫描并返回首页，返回启动耗时（毫秒）"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < SERVER_START_TIMEOUT:
+        if process.poll() is not None:
+            raise RuntimeError("服务器进程已退出")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+            status, _, _, _ = fetch(conn, "/favicon.ico")
+            conn.close()
+            if status < 500:
+                return round((time.perf_counter() - started) * 1000, 1)
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("等待服务器启动超时")
+
+def concurrent_fetch(port, paths, concurrency):
+    """多个持久连接并发请求 paths，返回吞吐量与延迟统计"""
+    chunks = [paths[i::concurrency] for i in range(concurrency)]
+
+    def client(chunk):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+        latencies, size, errors = [], 0, 0
+        for path in chunk:
+            try:
+                status, _, total, length = fetch(conn, path)
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+                errors += 1
+                continue
+            errors += status >= 400
+            latencies.append(total)
+            size += length
+        conn.close()
+        return latencies, size, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, chunks))
+    elapsed = time.perf_counter() - started
+    latencies = [ms for result in results for ms in result[0]]
+    size = sum(result[1] for result in results)
+    return {
+        "requests": len(paths),
+        "concurrency": concurrency,
+        "errors": sum(result[2] for result in results),
+        "seconds": round(elapsed, 3),
+        "requests_per_s": round(len(paths) / elapsed, 1),
+        "mb_per_s": round(size / elapsed / 1024 / 1024, 1),
+        "latency_ms": percentiles(latencies),
+    }
+
+def range_downloader(port, path, size, stop, rng):
+    """后台下载：每次从随机位置请求到文件末尾（浏览器拖动视频进度条时的请求），直到 stop 被设置
+
+    返回 (请求数, 字节数, 错误数)。
+    """
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+    requests, received, errors = 0, 0, 0
+    try:
+        while not stop.is_set():
+            try:
+                conn.request("GET", path, headers={"Range": f"bytes={rng.randrange(size)}-"})
+                response = conn.getresponse()
+                requests += 1
+                errors += response.status >= 400
+                while not stop.is_set():
+                    data = response.read(256 * 1024)
+                    if not data:
+                        break
+                    received += len(data)
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+    finally:
+        conn.close()  # 停止时响应可能还没读完，直接关闭连接
+    return requests, received, errors
+
+def measure_under_downloads(port, library, page_path, thumb_paths, downloads):
+    """downloads 个 Range 下载进行期间的页面 TTFB 与缩略图延迟（大文件传输是否拖慢其它请求）"""
+    path = "/file/large.safetensors"
+    size = os.path.getsize(os.path.join(library, "large.safetensors"))
+    stop = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=downloads)
+    started = time.perf_counter()
+    futures = [pool.submit(range_downloader, port, path, size, stop, random.Random(i)) for i in range(downloads)]
+    try:
+        time.sleep(BUSY_WARMUP)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+        pages = [fetch(conn, page_path) for _ in range(PAGE_REPEATS)]
+        conn.close()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+        thumbs = [fetch(conn, thumb) for thumb in thumb_paths]
+        conn.close()
+    finally:
+        stop.set()
+        results = [future.result() for future in futures]
+        pool.shutdown()
+    elapsed = time.perf_counter() - started
+    return {
+        "downloads": downloads,
+        "page_path": page_path,
+        "page_ttfb_ms": percentiles([run[1] for run in pages]),
+        "page_total_ms": percentiles([run[2] for run in pages]),
+        "thumbs": len(thumbs),
+        "thumb_errors": sum(run[0] >= 400 for run in thumbs),
+        "thumb_ms": percentiles([run[2] for run in thumbs]),
+        "download_requests": sum(result[0] for result in results),
+        "download_errors": sum(result[2] for result in results),
+        "download_mb_per_s": round(sum(result[1] for result in results) / elapsed / 1024 / 1024, 1),
+    }
+
+def process_threads(pid):
+    """服务器进程的线程数（读取 /proc，其它平台返回 None）"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def measure_with_idle(port, pid, page_path, thumb_paths, idle):
+    """idle 个空闲持久连接保持打开时的页面 TTFB、缩略图延迟和服务器线程数
+
+    每个空闲连接先完成一次请求，测量结束后再在每个连接上请求一次，统计仍可复用的连接
+    （空闲超过服务器 KEEPALIVE_TIMEOUT 的连接会被关闭）。缩略图预热后分别用一个持久连接、逐个新建连接各请求一遍。
+    """
+    threads_before = process_threads(pid)
+    conns = []
+    for _ in range(idle):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+        try:
+            fetch(conn, "/favicon.ico")
+            conns.append(conn)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+    opened = time.perf_counter()
+    try:
+        time.sleep(BUSY_WARMUP)
+        threads_idle = process_threads(pid)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+        pages = [fetch(conn, page_path) for _ in range(PAGE_REPEATS)]
+        for thumb in thumb_paths:
+            fetch(conn, thumb)  # 先生成缩略图，两种方式比较的都是已缓存的缩略图
+        conn.close()
+
+        started = time.perf_counter()
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+        thumbs = [fetch(conn, thumb) for thumb in thumb_paths]
+        conn.close()
+        keepalive_total = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for thumb in thumb_paths:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+            fetch(conn, thumb)
+            conn.close()
+        per_connection_total = time.perf_counter() - started
+
+        idle_seconds = time.perf_counter() - opened
+        reused = 0
+        for conn in conns:
+            try:
+                reused += fetch(conn, "/favicon.ico")[0] < 400
+            except (OSError, http.client.HTTPException):
+                pass
+    finally:
+        for conn in conns:
+            conn.close()
+    return {
+        "idle": idle,
+        "opened": len(conns),
+        "threads_before": threads_before,
+        "threads_idle": threads_idle,
+        "page_path": page_path,
+        "page_ttfb_ms": percentiles([run[1] for run in pages]),
+        "thumbs": len(thumbs),
+        "thumb_errors": sum(run[0] >= 400 for run in thumbs),
+        "thumb_ms": percentiles([run[2] for run in thumbs]),
+        "thumbs_keepalive_total_ms": round(keepalive_total * 1000, 2),
+        "thumbs_new_connection_total_ms": round(per_connection_total * 1000, 2),
+        "idle_seconds": round(idle_seconds, 2),
+        "reused": reused,
+    }
+
+def measure_server(viewer, backend, library, catalog, downloads=(), idle=()):
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", viewer, library, str(port), catalog, backend]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=HERE)
+    try:
+        startup = wait_ready(port, process)
+        folders = sorted(name for name in os.listdir(library) if name.startswith("set_"))
+        first = folders[0]
+        pages = {"index": "/", "all": f"/?dir={quote(ROOT_NAME)}", "folder": f"/?dir={quote(first)}"}
+        if viewer == "loraview2":
+            pages["all_full"] = f"/?dir={quote(ROOT_NAME)}&view=full"
+
+        results = {"startup_ms": startup, "pages": {}}
+        for label, path in pages.items():
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=HTTP_TIMEOUT)
+            runs = [fetch(conn, path) for _ in range(PAGE_REPEATS)]
+            conn.close()
+            results["pages"][label] = {
+                "path": path,
+                "status": runs[-1][0],
+                "bytes": runs[-1][3],
+                "first_ttfb_ms": round(runs[0][1], 2),
+                "ttfb_ms": percentiles([run[1] for run in runs]),
+                "total_ms": percentiles([run[2] for run in runs]),
+            }
+
+        # 同一子文件夹的预览图（即浏览器打开该页面时发出的请求）
+        images = sorted(name for name in os.listdir(os.path.join(library, first)) if name.endswith(".png"))
+        paths = [f"/file/{quote(name)}?dir={quote(first)}" for name in images]
+        paths = (paths * (FILE_REQUESTS // max(1, len(paths)) + 1))[:FILE_REQUESTS]
+        results["files"] = concurrent_fetch(port, paths, FILE_CONCURRENCY)
+
+        large = ["/file/large.safetensors"] * (LARGE_FILE_CONCURRENCY * 2)  # 不带 dir 参数即根目录
+        results["large_file"] = concurrent_fetch(port, large, LARGE_FILE_CONCURRENCY)
+
+        # 并发场景：后台 Range 下载进行中打开子文件夹页面（loraview 没有 /thumb/，页面直接加载原图）
+        route = "thumb" if viewer == "loraview2" else "file"
+        thumbs = [f"/{route}/{quote(name)}?dir={quote(first)}" for name in images[:BUSY_THUMBS]]
+        results["under_downloads"] = [measure_under_downloads(port, library, pages["folder"], thumbs, n)
+                                      for n in downloads]
+        # 空闲场景：大量空闲持久连接（如多个打开着的浏览器标签页）是否占用工作线程、拖慢新请求
+        results["with_idle"] = [measure_with_idle(port, process.pid, pages["folder"], thumbs, n) for n in idle]
+        return results
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+# ========================
+# 主流程
+# ========================
+
+def remove_catalog(catalog):
+    for path in (catalog, catalog + "-wal", catalog + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def run_scan_compare(args):
+    """原扫描方式（loraview：只列一层子文件夹，os.listdir 后逐个 os.path.isfile）与
+    递归并行扫描（loraview2：线程池 + os.scandir）在同一合成库上的冷扫描耗时对比
+
+    两种方式交替运行，操作系统文件缓存对两者的影响相同；合成库只有一层子文件夹，两者扫描到的文件相同。
+    """
+    os.makedirs(args.workdir, exist_ok=True)
+    report = {
+        "generated": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"seed": args.seed, "models_per_folder": MODELS_PER_FOLDER, "scan_repeats": SCAN_REPEATS},
+        "scan_compare": [],
+    }
+    for models in [int(n) for n in args.models.split(",")]:
+        print(f"\n📦 {models} 个模型")
+        library = generate_library(args.workdir, models, args.seed)
+        runs = {"loraview": [], "loraview2": []}
+        for _ in range(SCAN_REPEATS):
+            for viewer, results in runs.items():
+                catalog = os.path.join(args.workdir, f"scan_{viewer}_{models}.db")
+                remove_catalog(catalog)
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--measure-scan", viewer, library, catalog],
+                    check=True, capture_output=True, text=True, cwd=HERE).stdout
+                results.append(json.loads(output.strip().splitlines()[-1]))
+                remove_catalog(catalog)
+
+        entry = {"models": models, "library": library, "files": sum(len(files) for _, _, files in os.walk(library))}
+        for viewer, results in runs.items():
+            entry[viewer] = {
+                "folders": results[-1]["folders"],
+                "models": results[-1]["models"],
+                "scan_folders_ms": percentiles([r["scan_folders_ms"] for r in results]),
+                "walk_ms": percentiles([r["walk_ms"] for r in results]),
+                "total_ms": percentiles([r["total_ms"] for r in results]),
+            }
+        old, new = entry["loraview"]["walk_ms"]["p50"], entry["loraview2"]["walk_ms"]["p50"]
+        entry["walk_speedup"] = round(old / new, 2) if new else None
+        report["scan_compare"].append(entry)
+        print(f"     {entry['files']} 个文件，列目录与 stat p50: 原方式 {old} ms，递归并行 {new} ms"
+              f"（{entry['walk_speedup']} 倍）；loraview2 含读取说明与写入数据库共 "
+              f"{entry['loraview2']['total_ms']['p50']} ms")
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {args.out}")
+
+def run_benchmark(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    report = {
+        "generated": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            "seed": args.seed,
+            "models_per_folder": MODELS_PER_FOLDER,
+            "video_every": VIDEO_EVERY,
+            "long_note_every": LONG_NOTE_EVERY,
+            "page_repeats": PAGE_REPEATS,
+            "file_requests": FILE_REQUESTS,
+            "file_concurrency": FILE_CONCURRENCY,
+            "large_file_mb": LARGE_FILE_MB,
+            "downloads": args.downloads,
+            "busy_thumbs": BUSY_THUMBS,
+            "idle": args.idle,
+            "hashing": False,
+        },
+        "results": [],
+    }
+    downloads = [int(n) for n in args.downloads.split(",") if n]
+    idle = [int(n) for n in args.idle.split(",") if n]
+    for models in [int(n) for n in args.models.split(",")]:
+        print(f"\n📦 {models} 个模型")
+        library = generate_library(args.workdir, models, args.seed)
+        for spec in args.viewers.split(","):
+            viewer, _, backend = spec.partition(":")
+            backend = backend or "threads"
+            catalog = os.path.join(args.workdir, f"catalog_{viewer}_{models}.db")
+            remove_catalog(catalog)
+
+            entry = {"viewer": viewer, "backend": backend, "models": models, "library": library}
+            if backend == "threads":
+                print(f"  ⏱ {viewer}: 扫描与页面生成")
+                output = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), "--measure", viewer, library, catalog],
+                    check=True, capture_output=True, text=True, cwd=HERE).stdout
+                entry["in_process"] = json.loads(output.strip().splitlines()[-1])
+                remove_catalog(catalog)
+
+            print(f"  🌐 {spec}: 服务器")
+            entry["server"] = measure_server(viewer, backend, library, catalog, downloads, idle)
+            report["results"].append(entry)
+            summarize(entry)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已写入: {args.out}")
+
+def summarize(entry):
+    in_process = entry.get("in_process")
+    if in_process:
+        print(f"     扫描 冷/热: {in_process['group_files_cold_ms']:.0f} / {in_process['group_files_warm_ms']:.0f} ms，"
+              f"“{ROOT_NAME}”页面生成: {in_process['pages']['all']['render_warm_ms']:.0f} ms")
+    server = entry["server"]
+    page = server["pages"]["all"]
+    print(f"     启动: {server['startup_ms']:.0f} ms，“{ROOT_NAME}”页面 TTFB p50: {page['ttfb_ms']['p50']} ms（{page['bytes']} 字节），"
+          f"文件: {server['files']['requests_per_s']} 请求/秒，大文件: {server['large_file']['mb_per_s']} MB/秒")
+    for busy in server.get("under_downloads", []):
+        print(f"     {busy['downloads']} 个下载进行中: 页面 TTFB p50 {busy['page_ttfb_ms']['p50']} ms，"
+              f"缩略图 p50/p95 {busy['thumb_ms']['p50']} / {busy['thumb_ms']['p95']} ms，"
+              f"下载 {busy['download_mb_per_s']} MB/秒")
+    for idle in server.get("with_idle", []):
+        print(f"     {idle['opened']} 个空闲连接: 线程 {idle['threads_before']} → {idle['threads_idle']}，"
+              f"页面 TTFB p50 {idle['page_ttfb_ms']['p50']} ms，{idle['thumbs']} 个缩略图 复用连接/逐个新建 "
+              f"{idle['thumbs_keepalive_total_ms']:.0f} / {idle['thumbs_new_connection_total_ms']:.0f} ms，"
+              f"{idle['idle_seconds']} 秒后仍可复用 {idle['reused']} 个")
+
+def main():
+    parser = argparse.ArgumentParser(description="Lora 浏览器性能基准")
+    parser.add_argument("--models", default=DEFAULT_MODELS, help="逗号分隔的模型数量（如 1000,10000,50000）")
+    parser.add_argument("--viewers", default=DEFAULT_VIEWERS, help="逗号分隔的浏览器（loraview、loraview2、loraview2:asyncio）")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="合成库与模型目录数据库的存放位置")
+    parser.add_argument("--downloads", default=DEFAULT_DOWNLOADS,
+                        help="逗号分隔：并发场景中同时进行的 Range 下载数（空字符串跳过该场景）")
+    parser.add_argument("--idle", default=DEFAULT_IDLE,
+                        help="逗号分隔：空闲场景中保持打开的空闲持久连接数（空字符串跳过该场景）")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子，相同种子生成相同的合成库")
+    parser.add_argument("--out", default="bench_results.json", help="JSON 结果文件")
+    parser.add_argument("--scan-compare", action="store_true",
+                        help="只比较原扫描方式（loraview）与递归并行扫描（loraview2）的冷扫描耗时")
+    parser.add_argument("--measure", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument("--measure-scan", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument("--serve", nargs=5, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_in_process(*args.measure)))
+    elif args.measure_scan:
+        print(json.dumps(measure_scan(*args.measure_scan)))
+    elif args.serve:
+        viewer, library, port, catalog, backend = args.serve
+        serve(viewer, library, int(port), catalog, backend)
+    elif args.scan_compare:
+        run_scan_compare(args)
+    else:
+        run_benchmark(args)
+
+if __name__ == "__main__":
+    main()
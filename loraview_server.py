@@ -0,0 +1,278 @@
+# loraview_server.py - loraview.py 与 loraview2.py 共用的线程池服务器与持久连接请求处理
+
+import os
+import html
+import http.server
+import socketserver
+import queue
+import threading
+import select
+import selectors
+import socket
+import time
+
+# ========================
+# 持久连接请求处理器
+# ========================
+
+class CountingWriter:
+    """包装 wfile，统计写出的字节数（含 sendfile 发送的部分）"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.raw.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+class KeepAliveHandler(http.server.SimpleHTTPRequestHandler):
+    """HTTP/1.1 持久连接：空闲超时、每个连接的请求数上限、零拷贝发送文件
+
+    两次请求之间空闲的连接交还给 PooledHTTPServer 的 selector 等待，不占用工作线程。
+    各项参数为类属性，由两个浏览器的 CustomHandler 按各自配置区的设置覆盖。
+    """
+    protocol_version = "HTTP/1.1"  # 持久连接：同一页面的大量缩略图请求复用 TCP 连接
+    disable_nagle_algorithm = True  # 响应头与文件内容分开发送，复用连接时避免 Nagle 与延迟确认叠加的 40ms 等待
+    keepalive_timeout = 5  # 持久连接空闲多少秒后关闭
+    keepalive_linger = 0.1  # 请求处理完后在工作线程中等待下一个请求的秒数，超过后才把连接交还给 selector
+    keepalive_max_requests = 200  # 每个连接最多处理的请求数，之后关闭连接让客户端重新建立
+    copy_chunk_size = 256 * 1024  # 平台不支持 sendfile 时，每次读取并发送的字节数
+
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+        # 从 selector 交还回来的连接：接着之前的请求数计数
+        self.requests_handled = getattr(self.server, "handled", {}).pop(self.request, 0)
+
+    def handle_one_request(self):
+        """等待下一个请求时使用空闲超时；每个连接处理的请求数有上限"""
+        self.connection.settimeout(self.keepalive_timeout)
+        super().handle_one_request()
+        self.requests_handled = getattr(self, "requests_handled", 0) + 1
+        if self.requests_handled >= self.keepalive_max_requests:
+            self.close_connection = True
+
+    def handle(self):
+        """处理连接上的请求；两次请求之间空闲的连接交还给服务器的 selector 等待，不占用工作线程"""
+        self.parked = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if self.connection_idle():
+                self.parked = True  # 由 PooledHTTPServer 在 finish() 之后接管连接
+                return
+            self.handle_one_request()
+
+    def connection_idle(self):
+        """下一个请求没有在 keepalive_linger 秒内到达时返回 True（缓冲区里已有数据时不能交出连接）"""
+        if not hasattr(self.server, "park") or self.close_connection:
+            return False
+        self.connection.settimeout(0)
+        try:
+            if self.rfile.peek(1):
+                return False  # 已读入缓冲区的下一个请求（或连接已被对方关闭前的数据）
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(None)
+        # 分小段等待，期间有其它连接排队就不再占着线程
+        deadline = time.monotonic() + self.keepalive_linger
+        while True:
+            ready, _, _ = select.select([self.connection], [], [], 0.01)
+            if ready:
+                return False
+            if self.server.pending.qsize() or time.monotonic() >= deadline:
+                return True
+
+    def parse_request(self):
+        # 请求头读完后才取消空闲超时（卡在请求头中途的客户端会超时断开）；
+        # 之后不再限时：浏览器暂停读取视频流时不能因超时中断传输
+        ok = super().parse_request()
+        self.connection.settimeout(None)
+        return ok
+
+    def send_response(self, code, message=None):
+        self.status_code = int(code)
+        super().send_response(code, message)
+        if getattr(self, "requests_handled", 0) + 1 >= self.keepalive_max_requests:
+            self.send_header("Connection", "close")
+
+    def send_error(self, code, message=None, explain=None):
+        """请求本身完整时，错误响应也带 Content-Length 并保留连接（基类总是关闭连接）"""
+        if self.close_connection or getattr(self, "command", None) is None:
+            super().send_error(code, message, explain)
+            return
+        shortmsg, longmsg = self.responses.get(code, ("???", "???"))
+        message = message or shortmsg
+        self.log_error("code %d, message %s", code, message)
+        body = (self.error_message_format % {
+            "code": code,
+            "message": html.escape(message, quote=False),
+            "explain": html.escape(explain or longmsg, quote=False),
+        }).encode("utf-8", "replace")
+        self.send_response(code, message)
+        self.send_header("Content-Type", self.error_content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def log_error(self, format, *args):
+        if format.startswith("Request timed out"):
+            return  # 空闲的持久连接超时关闭属于正常情况
+        super().log_error(format, *args)
+
+    def copy_file_range(self, f, offset, length):
+        """发送文件的 [offset, offset+length) 区间：支持 sendfile 的平台走零拷贝，否则按固定大小分块"""
+        if length <= 0:
+            return
+        if hasattr(os, "sendfile"):
+            self.wfile.count += self.connection.sendfile(f, offset, length)
+            return
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = f.read(min(self.copy_chunk_size, remaining))
+            if not chunk:
+                break
+            self.wfile.write(chunk)
+            remaining -= len(chunk)
+
+# ========================
+# 线程池服务器
+# ========================
+
+class PooledHTTPServer(socketserver.TCPServer):
+    """固定数量工作线程处理连接，等待队列有上限，避免单个大文件传输阻塞其它请求
+
+    空闲的持久连接由一个 selector 线程等待（超时取处理器的 keepalive_timeout），下一个请求到达时再放回工作队列。
+    """
+    allow_reuse_address = True
+    request_queue_size = 128  # listen 积压队列长度
+
+    def __init__(self, server_address, handler_class, workers=16, max_queued=64):
+        # 先建队列：绑定端口失败时 TCPServer 会立即调用 server_close()
+        self.pending = queue.Queue(maxsize=max_queued)
+        self.workers = []
+        self.stopping = threading.Event()
+        self.parking = queue.Queue()  # 等待交给 selector 的空闲连接
+        self.handled = {}  # 空闲连接 -> 已处理的请求数
+        self.wakeup = None
+        super().__init__(server_address, handler_class)
+        for i in range(workers):
+            t = threading.Thread(target=self._worker_loop, name=f"lora-worker-{i}", daemon=True)
+            t.start()
+            self.workers.append(t)
+        self.wakeup = socket.socketpair()
+        self.idle_thread = threading.Thread(target=self._idle_loop, name="lora-keepalive", daemon=True)
+        self.idle_thread.start()
+
+    def _worker_loop(self):
+        while not self.stopping.is_set():
+            try:
+                item = self.pending.get(timeout=1)
+            except queue.Empty:
+                continue
+            if item is None:
+                break
+            request, client_address = item
+            handler = None
+            try:
+                handler = self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if getattr(handler, "parked", False):
+                    self.park(request, client_address, handler.requests_handled)
+                else:
+                    self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def park(self, request, client_address, handled):
+        """空闲的持久连接交给 selector 线程，等到下一个请求到达再放回工作队列"""
+        if self.stopping.is_set():
+            self.shutdown_request(request)
+            return
+        self.handled[request] = handled
+        self.parking.put((request, client_address))
+        self.wake()
+
+    def wake(self):
+        try:
+            self.wakeup[1].send(b"\0")
+        except (OSError, TypeError):
+            pass
+
+    def _idle_loop(self):
+        """等待空闲连接：可读（新请求或对方关闭）时放回工作队列，空闲超时则关闭"""
+        timeout = getattr(self.RequestHandlerClass, "keepalive_timeout", KeepAliveHandler.keepalive_timeout)
+        sel = selectors.DefaultSelector()
+        sel.register(self.wakeup[0], selectors.EVENT_READ)
+        try:
+            while not self.stopping.is_set():
+                while True:
+                    try:
+                        request, client_address = self.parking.get_nowait()
+                    except queue.Empty:
+                        break
+                    sel.register(request, selectors.EVENT_READ, (client_address, time.monotonic() + timeout))
+                for key, _ in sel.select(timeout=1):
+                    if key.data is None:
+                        try:
+                            self.wakeup[0].recv(4096)
+                        except OSError:
+                            pass
+                        continue
+                    sel.unregister(key.fileobj)
+                    self.process_request(key.fileobj, key.data[0])
+                now = time.monotonic()
+                for key in list(sel.get_map().values()):
+                    if key.data is not None and key.data[1] <= now:
+                        sel.unregister(key.fileobj)
+                        self.handled.pop(key.fileobj, None)
+                        self.shutdown_request(key.fileobj)
+        finally:
+            for key in list(sel.get_map().values()):
+                if key.data is not None:
+                    self.handled.pop(key.fileobj, None)
+                    self.shutdown_request(key.fileobj)
+            sel.close()
+            for sock in self.wakeup:
+                sock.close()
+
+    def process_request(self, request, client_address):
+        """主线程只负责把连接放入队列，队列已满时立即拒绝"""
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            try:
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\n"
+                                b"Retry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.handled.pop(request, None)
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        # 丢弃尚未处理的连接，然后通知所有工作线程退出（不阻塞：队列放不下的线程由 stopping 标志结束）
+        self.stopping.set()
+        self.wake()
+        while True:
+            try:
+                item = self.pending.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self.shutdown_request(item[0])
+        for _ in self.workers:
+            try:
+                self.pending.put_nowait(None)
+            except queue.Full:
+                break
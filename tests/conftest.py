@@ -0,0 +1,75 @@
+import asyncio
+import http.client
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import loraview2  # noqa: E402
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    """空的模型库目录：目录缓存放在临时目录中，不启动监听器，不安排后台任务"""
+    folder = tmp_path / "loras"
+    folder.mkdir()
+    monkeypatch.setattr(loraview2, "FOLDER", str(folder))
+    monkeypatch.setattr(loraview2, "CATALOG_DB", str(tmp_path / "catalog.db"))
+    monkeypatch.setattr(loraview2, "_catalog", None)
+    monkeypatch.setattr(loraview2, "_watcher", None)
+    monkeypatch.setattr(loraview2, "_listing_cache", {})
+    token = loraview2._schedule_background.set(False)
+    yield folder
+    loraview2._schedule_background.reset(token)
+
+
+@pytest.fixture(params=["threads", "asyncio"])
+def server(request, library, monkeypatch):
+    """在后台线程中启动指定后端的服务器，返回端口号
+
+    请求在服务器线程中处理，看不到测试线程中的 _schedule_background，因此直接关闭哈希并让 ffmpeg 不可用。
+    """
+    monkeypatch.setattr(loraview2, "HASH_ENABLED", False)
+    monkeypatch.setattr(loraview2, "FFMPEG_BIN", str(library / "no-ffmpeg"))
+    if request.param == "threads":
+        httpd = loraview2.PooledHTTPServer(("127.0.0.1", 0), loraview2.CustomHandler, workers=4)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        yield httpd.server_address[1]
+        httpd.shutdown()
+        httpd.server_close()
+        return
+
+    loop = asyncio.new_event_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=4))
+    async_server = loop.run_until_complete(asyncio.start_server(
+        lambda reader, writer: loraview2.AsyncRequestHandler(reader, writer).handle(), "127.0.0.1", 0))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield async_server.sockets[0].getsockname()[1]
+    loop.call_soon_threadsafe(async_server.close)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+
+
+def write_files(folder, files):
+    """按 {相对路径: 内容} 创建文件"""
+    for rel, content in files.items():
+        path = folder / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content.encode("utf-8") if isinstance(content, str) else content)
+
+
+def fetch(port, path, headers=None):
+    """发送一个 GET 请求，返回 (状态码, 响应头, 响应体)"""
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        conn.request("GET", path, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        conn.close()
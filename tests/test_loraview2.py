@@ -0,0 +1,370 @@
+import http.client
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import loraview2
+from conftest import fetch, write_files
+
+
+def test_orphan_video_renders_in_folder_and_aggregate_view(library):
+    """没有对应模型文件的视频不应让目录页和“全部”页出错"""
+    write_files(library, {
+        "sub/model.safetensors": b"\0" * 16,
+        "sub/model.png": b"png",
+        "sub/orphan.mp4": b"video",
+    })
+
+    page = loraview2.generate_html("sub").decode("utf-8")
+    assert 'data-video="sub/orphan.mp4"' in page
+
+    page = loraview2.generate_html(loraview2.ROOT_NAME).decode("utf-8")
+    assert 'data-video="sub/orphan.mp4"' in page
+    assert "model.png" in page
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_video_queue_survives_stale_duplicate_jobs(tmp_path, monkeypatch):
+    """视频被替换后同一路径入队两次：旧任务被跳过，工作线程不会因状态已删除而退出"""
+    gate = threading.Event()
+    generated = []
+
+    def fake_generate(video_path, thumbnail_path):
+        gate.wait(5)
+        generated.append(video_path)
+        open(thumbnail_path, "wb").close()
+        return True
+
+    monkeypatch.setattr(loraview2, "generate_video_thumbnail", fake_generate)
+    video_queue = loraview2.VideoThumbnailQueue(workers=1)
+    blocker, video, other = (str(tmp_path / name) for name in ("blocker.mp4", "clip.mp4", "other.mp4"))
+    video_queue.request(blocker, loraview2.video_thumbnail_path(blocker), 1)  # 占住唯一的工作线程
+    thumb = loraview2.video_thumbnail_path(video)
+    video_queue.request(video, thumb, 1)
+    video_queue.request(video, thumb, 2)  # 视频被替换：旧任务仍在队列中
+    gate.set()
+    assert wait_until(lambda: not video_queue.states)
+    assert generated == [blocker, video]
+
+    video_queue.pending.put((video, thumb, 2))  # 状态已删除后才取出的重复任务
+    video_queue.request(other, loraview2.video_thumbnail_path(other), 1)
+    assert wait_until(lambda: not video_queue.states)
+    assert generated == [blocker, video, other]
+    assert all(t.is_alive() for t in video_queue.threads)
+
+
+def test_failed_image_thumbnail_is_not_resubmitted(library, monkeypatch):
+    """无法生成缩略图的图片按修改时间记住：原图未变时直接返回原图，不再提交到进程池"""
+    submitted = []
+
+    def fake_render(src, dst, size, fmt, quality):
+        submitted.append(src)
+        return False
+
+    monkeypatch.setattr(loraview2, "render_image_thumbnail", fake_render)
+    monkeypatch.setattr(loraview2, "_image_thumb_failures", {})
+    monkeypatch.setattr(loraview2, "_image_thumb_pool", ThreadPoolExecutor(max_workers=1))
+    image = library / "broken.png"
+    image.write_bytes(b"not an image")
+
+    assert loraview2.get_image_thumbnail(str(image)) is None
+    assert wait_until(lambda: not loraview2._image_thumb_jobs)
+    assert loraview2.get_image_thumbnail(str(image)) is None
+    assert len(submitted) == 1
+
+    st = image.stat()
+    os.utime(image, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))  # 原图被替换后重新尝试
+    assert loraview2.get_image_thumbnail(str(image)) is None
+    assert len(submitted) == 2
+
+
+def raw_request(port, data, full=False):
+    """发送原始请求字节，读到 EOF 为止，返回状态行（full 为真时返回完整响应）"""
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+        sock.sendall(data)
+        response = b""
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                return response if full else response.split(b"\r\n", 1)[0]
+            response += chunk
+
+
+def test_oversized_request_lines_are_answered(server):
+    """请求行或请求头超过长度上限时返回 414 / 431 并关闭连接，而不是直接断开"""
+    assert raw_request(server, b"GET /" + b"a" * 70000 + b" HTTP/1.1\r\n\r\n").startswith(b"HTTP/1.1 414")
+    big_header = b"GET / HTTP/1.1\r\nHost: x\r\nX-Big: " + b"a" * 70000 + b"\r\n\r\n"
+    assert raw_request(server, big_header).startswith(b"HTTP/1.1 431")
+    many_headers = b"GET / HTTP/1.1\r\n" + b"X-A: 1\r\n" * 150 + b"\r\n"
+    assert raw_request(server, many_headers).startswith(b"HTTP/1.1 431")
+
+
+def test_streamed_page_sends_server_timing_header(server, library):
+    """流式页面：扫描和分组耗时在响应头中（开发者工具可见），渲染与发送耗时在尾部字段中"""
+    write_files(library, {"sub/model.safetensors": b"\0" * 16})
+    status, headers, body = fetch(server, "/?dir=sub&view=full")
+    assert status == 200
+    phases = [item.split(";")[0] for item in headers["Server-Timing"].split(", ")]
+    assert "scan" in phases and "group" in phases
+    assert "render" not in phases
+    assert headers["Trailer"] == "Server-Timing"
+
+    response = raw_request(server, b"GET /?dir=sub&view=full HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n",
+                           full=True)
+    trailer = response.rsplit(b"0\r\n", 1)[1]
+    assert trailer.startswith(b"Server-Timing: render;")
+    assert b"scan;" not in trailer
+
+
+def test_parse_range_header():
+    """Range 解析：单区间、后缀、开放结尾、越界截断与合并；无法识别的语法按完整文件处理"""
+    parse = loraview2.parse_range_header
+    assert parse("bytes=0-9", 100) == [(0, 9)]
+    assert parse("bytes=-10", 100) == [(90, 99)]
+    assert parse("bytes=90-", 100) == [(90, 99)]
+    assert parse("bytes=90-500", 100) == [(90, 99)]
+    assert parse("bytes=0-9,5-19,20-29,50-59", 100) == [(0, 29), (50, 59)]
+    assert parse("bytes=200-300,-0", 100) == []
+    assert parse("bytes=9-0", 100) is None
+    assert parse("bytes=a-b", 100) is None
+    assert parse("items=0-9", 100) is None
+    assert parse("bytes=" + ",".join(["0-1"] * (loraview2.MAX_RANGES + 1)), 100) is None
+
+
+VIDEO_DATA = bytes(range(256)) * 4
+
+
+def test_range_request_returns_partial_content(server, library):
+    """单区间返回 206；区间全部越界返回 416；If-Range 与当前文件不一致时返回完整文件"""
+    write_files(library, {"sub/clip.mp4": VIDEO_DATA})
+    path = "/file/clip.mp4?dir=sub"
+    status, headers, body = fetch(server, path, {"Range": "bytes=100-199"})
+    assert status == 206
+    assert headers["Content-Range"] == f"bytes 100-199/{len(VIDEO_DATA)}"
+    assert body == VIDEO_DATA[100:200]
+
+    status, headers, body = fetch(server, path, {"Range": "bytes=5000-"})
+    assert status == 416
+    assert headers["Content-Range"] == f"bytes */{len(VIDEO_DATA)}"
+    assert body == b""
+
+    status, headers, body = fetch(server, path, {"Range": "bytes=0-9", "If-Range": '"stale"'})
+    assert status == 200
+    assert body == VIDEO_DATA
+
+
+def test_multiple_ranges_use_multipart_byteranges(server, library):
+    """多区间返回 multipart/byteranges，各段带 Content-Range，Content-Length 与实际长度一致"""
+    write_files(library, {"sub/clip.mp4": VIDEO_DATA})
+    status, headers, body = fetch(server, "/file/clip.mp4?dir=sub", {"Range": "bytes=0-9,500-509"})
+    assert status == 206
+    content_type, _, boundary = headers["Content-Type"].partition("; boundary=")
+    assert content_type == "multipart/byteranges"
+    assert int(headers["Content-Length"]) == len(body)
+
+    parts = body.split(f"--{boundary}".encode())
+    assert parts[0] == b"\r\n" and parts[-1] == b"--\r\n"
+    segments = []
+    for part in parts[1:-1]:
+        head, _, content = part.partition(b"\r\n\r\n")
+        assert content.endswith(b"\r\n")
+        assert b"Content-Type: video/mp4" in head
+        segments.append((head.rsplit(b"Content-Range: ", 1)[1].decode(), content[:-2]))
+    size = len(VIDEO_DATA)
+    assert segments == [(f"bytes 0-9/{size}", VIDEO_DATA[0:10]), (f"bytes 500-509/{size}", VIDEO_DATA[500:510])]
+
+
+def test_etag_matches():
+    """If-None-Match：列表中任一 ETag 相同即匹配，W/ 前缀忽略，* 匹配任何文件"""
+    assert loraview2.etag_matches('"a"', '"a"')
+    assert loraview2.etag_matches('"x", W/"a"', '"a"')
+    assert loraview2.etag_matches("*", '"a"')
+    assert not loraview2.etag_matches('"b"', '"a"')
+
+
+def test_conditional_get_returns_not_modified(server, library):
+    """ETag 或 Last-Modified 未变时返回不带内容的 304，且连接可继续使用；文件修改后返回新内容"""
+    write_files(library, {"sub/model.png": b"png-v1"})
+    path = "/file/model.png?dir=sub"
+    status, headers, body = fetch(server, path)
+    assert status == 200 and body == b"png-v1"
+    etag, last_modified = headers["ETag"], headers["Last-Modified"]
+    assert headers["Cache-Control"]
+
+    conn = http.client.HTTPConnection("127.0.0.1", server, timeout=10)
+    try:
+        for validators in ({"If-None-Match": etag}, {"If-Modified-Since": last_modified}):
+            conn.request("GET", path, headers=validators)
+            response = conn.getresponse()
+            assert response.status == 304
+            assert response.read() == b""
+            assert response.headers["ETag"] == etag
+        conn.request("GET", path)
+        assert conn.getresponse().read() == b"png-v1"  # 304 之后同一连接仍然可用
+    finally:
+        conn.close()
+
+    # If-None-Match 优先：ETag 不一致时即使 If-Modified-Since 满足也返回完整内容
+    status, _, body = fetch(server, path, {"If-None-Match": '"other"', "If-Modified-Since": last_modified})
+    assert status == 200 and body == b"png-v1"
+
+    image = library / "sub" / "model.png"
+    image.write_bytes(b"png-v2")
+    st = image.stat()
+    os.utime(image, ns=(st.st_atime_ns, st.st_mtime_ns + 2 * 10**9))
+    status, headers, body = fetch(server, path, {"If-None-Match": etag})
+    assert status == 200 and body == b"png-v2"
+    assert headers["ETag"] != etag
+
+
+def touch_later(path, seconds=2):
+    """把修改时间往后调，避免文件系统时间精度不足时修改看起来没有发生"""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + seconds * 10**9))
+
+
+def test_catalog_reuses_records_and_rescans_incrementally(tmp_path, monkeypatch):
+    """目录未变时直接读库（新实例同样有效）；目录变化时只重新读取有改动的 .txt；目录删除后记录清除"""
+    folder = tmp_path / "sub"
+    write_files(tmp_path, {
+        "sub/a.safetensors": b"\0" * 16,
+        "sub/a.txt": "trigger a",
+        "sub/a.png": b"png",
+        "sub/b.safetensors": b"\0" * 32,
+        "sub/readme.md": "ignored",
+    })
+    reads = []
+    read_text_file = loraview2.read_text_file
+
+    def counting_read(path, max_chars=None):
+        reads.append(os.path.basename(path))
+        return read_text_file(path, max_chars)
+
+    monkeypatch.setattr(loraview2, "read_text_file", counting_read)
+    db = str(tmp_path / "catalog.db")
+
+    records = {r["base"]: r for r in loraview2.ModelCatalog(db).folder_records(str(folder))}
+    assert set(records) == {"a", "b"}
+    assert records["a"]["model"] == "a.safetensors" and records["a"]["image"] == "a.png"
+    assert records["a"]["text_content"] == "trigger a"
+    assert records["b"]["size"] == 32 and records["b"]["text"] is None
+    assert reads == ["a.txt"]
+
+    catalog = loraview2.ModelCatalog(db)
+    assert {r["base"] for r in catalog.folder_records(str(folder))} == {"a", "b"}
+    assert reads == ["a.txt"]  # 重启后目录未变：不再读取文件
+
+    write_files(tmp_path, {"sub/c.safetensors": b"\0", "sub/c.txt": "trigger c"})
+    touch_later(folder)
+    records = {r["base"]: r for r in catalog.folder_records(str(folder))}
+    assert set(records) == {"a", "b", "c"}
+    assert records["a"]["text_content"] == "trigger a"
+    assert reads == ["a.txt", "c.txt"]  # 未改动的 a.txt 沿用库中的预览
+
+    (folder / "a.txt").write_text("edited", encoding="utf-8")
+    touch_later(folder / "a.txt")
+    records = {r["base"]: r for r in catalog.folder_records(str(folder), force=True)}
+    assert records["a"]["text_content"] == "edited"
+
+    for name in os.listdir(folder):
+        os.remove(folder / name)
+    folder.rmdir()
+    assert catalog.folder_records(str(folder)) == []
+    assert catalog.load(str(folder)) == []
+
+
+@pytest.mark.parametrize("backend", ["polling", "inotify"])
+def test_watcher_tracks_new_files_and_folders(library, monkeypatch, backend):
+    """没有 inotify 时退回轮询；两种方式都能发现新文件、新建和删除的子文件夹"""
+    if backend == "polling":
+        monkeypatch.setattr(loraview2, "load_inotify", lambda: None)
+        monkeypatch.setattr(loraview2, "WATCH_POLL_INTERVAL", 0.05)
+    elif loraview2.load_inotify() is None:
+        pytest.skip("当前平台没有 inotify")
+    monkeypatch.setattr(loraview2, "HASH_ENABLED", False)
+    write_files(library, {"sub/a.safetensors": b"\0" * 16})
+    sub = str(library / "sub")
+
+    watcher = loraview2.FolderWatcher()
+    watcher.start()
+    try:
+        assert watcher.backend == backend
+        assert set(watcher.get_models(sub)) == {"a"}
+
+        write_files(library, {"sub/b.safetensors": b"\0" * 16})
+        touch_later(sub)
+        assert wait_until(lambda: set(watcher.get_models(sub)) == {"a", "b"})
+
+        write_files(library, {"new/deep/c.safetensors": b"\0" * 16})
+        touch_later(library)
+        assert wait_until(lambda: "new/deep" in watcher.folder_map)
+        deep = watcher.folder_map["new/deep"]
+        assert wait_until(lambda: set(watcher.get_models(deep)) == {"c"})
+
+        os.remove(os.path.join(deep, "c.safetensors"))
+        os.rmdir(deep)
+        os.rmdir(library / "new")
+        touch_later(library)
+        assert wait_until(lambda: "new" not in watcher.folder_map and "new/deep" not in watcher.folder_map)
+    finally:
+        watcher.stop()
+        watcher.thread.join(5)
+
+
+def test_highlight_terms_escapes_html():
+    """摘要与模型名先转义再标出关键词；关键词中的正则符号按字面匹配"""
+    text = '<b>Tag</b> a.b axb & tag'
+    assert loraview2.highlight_terms(text, ["tag", "a.b"]) == (
+        "&lt;b&gt;<mark>Tag</mark>&lt;/b&gt; <mark>a.b</mark> axb &amp; <mark>tag</mark>")
+    assert loraview2.highlight_terms("x<y", ["<"]) == "x<mark>&lt;</mark>y"
+
+
+@pytest.mark.parametrize("fts", [True, False])
+def test_search_treats_special_characters_literally(library, fts):
+    """FTS5 语法字符（引号、*、括号、减号）与 LIKE 通配符（%、_）都按字面匹配，不会报错"""
+    write_files(library, {
+        "sub/quoted.safetensors": b"\0",
+        "sub/quoted.txt": 'style "soft light" 100% done_ok (v2) -neg a*b',
+        "sub/plain.safetensors": b"\0",
+        "sub/plain.txt": "style soft light 1000 doneXok v2 neg ab",
+    })
+    catalog = loraview2.get_catalog()
+    catalog.connect()
+    catalog.fts = catalog.fts and fts
+    catalog.folder_records(str(library / "sub"))
+
+    def bases(*terms):
+        return sorted(base for _, base, _, _ in catalog.search(list(terms), 10))
+
+    assert bases("style") == ["plain", "quoted"]
+    for term in ('"soft light"', "100%", "%", "_", "done_ok", "(v2)", "-neg", "a*b", 'light"'):
+        assert bases(term) == ["quoted"], term
+        assert sum(catalog.count([term]).values()) == 1, term
+    assert bases("style", "%") == ["quoted"]
+
+
+def test_search_api_escapes_model_names(library):
+    """/api/search 返回的 name_html 与 snippet 已转义，文件名中的 HTML 不会被浏览器执行"""
+    write_files(library, {
+        "sub/<img src=x onerror=alert(1)>.safetensors": b"\0",
+        "sub/<img src=x onerror=alert(1)>.txt": "<script>alert(1)</script> trigger",
+    })
+    loraview2.group_files_in(str(library / "sub"))  # 运行中的服务器由监听器完成首次分组并建立索引
+    result = loraview2.api_search({"q": ["alert"]})
+    assert result["total"] == 1
+    item = result["items"][0]
+    assert item["name_html"] == "&lt;img src=x onerror=<mark>alert</mark>(1)&gt;"
+    assert "<script>" not in item["snippet"]
+    assert "&lt;script&gt;<mark>alert</mark>(1)&lt;/script&gt;" in item["snippet"]